@@ -990,9 +990,7 @@ def manage_ancient(Options_, outfile_rom_buffer: BytesIO, infile_rom_buffer: Byt
         location.npcs.append(renamer)
 
     for s in sorted(rest_shops, key=lambda s: s.name):
-        if "shops"not in randlog:
-            randlog["shops"] = []
-        randlog["shops"].append(str(s))
+        randlog.add(str(s), "shops")
 
     assert not optional_chars
 
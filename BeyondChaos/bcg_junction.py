@@ -3,7 +3,7 @@ from randomtools.tablereader import (
     tblpath, write_patch, set_addressing_mode, get_open_file, verify_patchlist)
 
 import json
-from collections import defaultdict
+from collections import Counter, defaultdict
 from os import path
 
 # TODO: Use Substitution class to make writes, since that class handles patch verification
@@ -42,6 +42,7 @@ def populate_data(data, filename, address):
         pointers.append(pointer)
         pointer += len(values)
 
+    end = pointer
     assert len(pointers) == maxdex + 1
     assert len({map_to_snes(pointer) >> 16 for pointer in pointers}) == 1
     f.seek(address-1)
@@ -54,6 +55,8 @@ def populate_data(data, filename, address):
         assert 0 <= p <= 0xFFFF
         f.write(p.to_bytes(2, byteorder='little'))
 
+    return address, end
+
 def recursive_merge(original, update):
     for key in sorted(update):
         if key in original:
@@ -73,6 +76,10 @@ class JunctionManager:
         self.directory = tblpath
         self.patches = set()
         self.patch_blacklist = set()
+        # (start, end, name) of every table written at a fixed address
+        self.claimed_ranges = []
+        # Lowercase name to index for each category, and the names used
+        self.category_name_indexes = {}
 
         assert manifest or data
         if manifest:
@@ -312,10 +319,18 @@ class JunctionManager:
     def get_category_index(self, category, key):
         if isinstance(key, int):
             return key
-        names = [n.lower() for n in getattr(self, '%s_names' % category)]
+        names = getattr(self, '%s_names' % category)
+        indexed_names, name_indexes = self.category_name_indexes.get(
+            category, (None, None))
+        # The names can be changed, e.g. for renamed monsters
+        if indexed_names != names:
+            name_indexes = {}
+            for index, name in enumerate(names):
+                name_indexes.setdefault(name.lower(), index)
+            self.category_name_indexes[category] = (list(names), name_indexes)
         key = key.lower()
-        if key in names:
-            return names.index(key)
+        if key in name_indexes:
+            return name_indexes[key]
         return self.clean_number(key)
 
     def reverse_index(self, category, index):
@@ -331,7 +346,8 @@ class JunctionManager:
         data[0] = sorted(set(data[0]))
 
         address = self.clean_number(self.always_whitelist_address)
-        populate_data(data, self.outfile, address)
+        start, end = populate_data(data, self.outfile, address)
+        self.claimed_ranges.append((start, end, 'always_whitelist'))
 
     def populate_list(self, category, color, max_index):
         data = {}
@@ -355,7 +371,8 @@ class JunctionManager:
 
         address = getattr(self, '%s_%slist_address' % (category, color))
         address = self.clean_number(address)
-        populate_data(data, self.outfile, address)
+        start, end = populate_data(data, self.outfile, address)
+        self.claimed_ranges.append((start, end, '%s_%slist' % (category, color)))
 
     def populate_everything(self):
         self.populate_always()
@@ -659,41 +676,47 @@ class JunctionManager:
         exclusive_tag_pool = ((junction_tag_pool | item_tag_pool)
                               - common_tag_pool)
 
+        # Each item's tags are counted once, so that scoring a junction
+        # looks up its tags and their negations instead of comparing pairs
+        item_tag_counts = {}
+        for item_index in sorted(all_item_tags):
+            item_tags = all_item_tags[item_index]
+            item_tags = [t for t in item_tags if t in common_tag_pool]
+            for t in list(item_tags):
+                while t in item_tags and '-%s' % t in item_tags:
+                    item_tags.remove(t)
+                    item_tags.remove('-%s' % t)
+            item_tag_counts[item_index] = (Counter(item_tags), len(item_tags))
+
         for junction_index in sorted(junctions):
             junction_tags = self.junction_tags[junction_index]
             junction_tags = [t for t in junction_tags if t in common_tag_pool]
             for item_index in sorted(all_item_tags):
-                item_tags = all_item_tags[item_index]
-                item_tags = [t for t in item_tags if t in common_tag_pool]
-                for t in list(item_tags):
-                    while t in item_tags and '-%s' % t in item_tags:
-                        item_tags.remove(t)
-                        item_tags.remove('-%s' % t)
+                item_tags, num_item_tags = item_tag_counts[item_index]
                 score = 1
                 for j in junction_tags:
-                    for i in item_tags:
-                        if j == i:
-                            score += 1
-                        elif j == '-%s' % i or i == '-%s' % j:
-                            score -= 1
-                score = score / ((len(junction_tags) * len(item_tags)) + 2)
+                    score += item_tags[j] - item_tags['-%s' % j]
+                    if j.startswith('-'):
+                        score -= item_tags[j[1:]]
+                score = score / ((len(junction_tags) * num_item_tags) + 2)
                 scores[(item_index, junction_index)] = (
                     score, random.random(), item_index, junction_index)
 
-        sorted_item_junctions = {}
+        junction_ranks = {}
         for item_index in sorted(all_item_tags):
             sorted_junctions = sorted(
                 junctions, key=lambda j: scores[(item_index, j)])
-            sorted_item_junctions[item_index] = sorted_junctions
+            junction_ranks[item_index] = {
+                j: rank for (rank, j) in enumerate(sorted_junctions)}
+        max_junction_index = len(junctions)-1
         for junction_index in sorted(junctions):
             sorted_items = sorted(all_item_tags,
                                   key=lambda i: scores[(i, junction_index)])
             max_item_index = len(sorted_items)-1
+            item_ranks = {i: rank for (rank, i) in enumerate(sorted_items)}
             for item_index in sorted(all_item_tags):
-                sorted_junctions = sorted_item_junctions[item_index]
-                max_junction_index = len(sorted_junctions)-1
-                item_rank = sorted_items.index(item_index) / max_item_index
-                junction_rank = (sorted_junctions.index(junction_index)
+                item_rank = item_ranks[item_index] / max_item_index
+                junction_rank = (junction_ranks[item_index][junction_index]
                                  / max_junction_index)
                 weight = item_rank * junction_rank
                 if item_index not in weights:
@@ -3,17 +3,9 @@ from io import BytesIO
 from dialoguemanager import set_dialogue
 from formationrandomizer import get_formations, get_fsets
 from itemrandomizer import get_ranked_items, get_item
+from randomizercontext import get_context
 from utils import read_multi, write_multi, mutate_index, utilrandom as random, Substitution
 
-valid_ids = list(range(1, 0x200))
-banned_formids = [0, 0x1d7]
-extra_miabs = []
-orphaned_formations = None
-used_formations = []
-done_items = []
-
-appropriate_formations = None
-
 EVENT_ENEMIES = [0x00, 0x01, 0x02, 0x06, 0x09, 0x19, 0x1a, 0x1b, 0x1c, 0x22, 0x24,
                  0x33, 0x38, 0x39, 0x3a, 0x3f, 0x42, 0x43, 0x4f, 0x50, 0x59, 0x60,
                  0x5e, 0x64, 0x65, 0x73, 0x79, 0x7f, 0x9f, 0xaf, 0xb6, 0xcf, 0xd1,
@@ -27,15 +19,15 @@ OLD_EVENT_ENEMIES = [0x00, 0x01, 0x02, 0x09, 0x19, 0x1b, 0x22, 0x24, 0x33, 0x38,
 
 
 def add_orphaned_formation(formation):
-    global orphaned_formations
-    orphaned_formations.append(formation)
+    get_context().orphaned_formations.append(formation)
 
 
 def get_orphaned_formations(old_version=False):
-    global orphaned_formations
-    if orphaned_formations is not None:
-        return orphaned_formations
+    context = get_context()
+    if context.orphaned_formations is not None:
+        return context.orphaned_formations
 
+    banned_formids = context.miab_banned_formids
     orphaned_formations = set([])
     from monsterrandomizer import get_monsters
     monsters = get_monsters()
@@ -64,20 +56,20 @@ def get_orphaned_formations(old_version=False):
                     if len(ens) == 1:
                         banned_formids.append(x.formid)
 
-    orphaned_formations = sorted(orphaned_formations, key=lambda f: f.formid)
+    context.orphaned_formations = sorted(orphaned_formations, key=lambda f: f.formid)
     return get_orphaned_formations(old_version)
 
 
 def get_appropriate_formations():
-    global appropriate_formations
-    if appropriate_formations is not None:
-        return appropriate_formations
+    context = get_context()
+    if context.miab_appropriate_formations is not None:
+        return context.miab_appropriate_formations
 
     from formationrandomizer import NOREPLACE_FORMATIONS
     formations = get_formations()
     formations = [f for f in formations if not f.battle_event]
     formations = [f for f in formations if f.formid not in
-                  banned_formids + NOREPLACE_FORMATIONS]
+                  context.miab_banned_formids + NOREPLACE_FORMATIONS]
     formations = [f for f in formations if len(f.present_enemies) >= 1]
     formations = [f for f in formations if 273 not in
                   [e.id for e in f.present_enemies]]
@@ -96,7 +88,7 @@ def get_appropriate_formations():
                 formations.remove(f)
                 form_enames.remove(enames)
 
-    appropriate_formations = formations
+    context.miab_appropriate_formations = formations
     return get_appropriate_formations()
 
 
@@ -115,20 +107,21 @@ def add_extra_miab(setid):
     setid |= 0x100
     fset = [fs for fs in get_fsets() if fs.setid == setid][0]
     formation = fset.formations[0]
+    extra_miabs = get_context().extra_miabs
     if formation not in extra_miabs:
         extra_miabs.append(fset.formations[0])
 
 
 def get_extra_miabs(lowest_rank):
-    candidates = [f for f in extra_miabs if f.rank() >= lowest_rank and
-                  f.formid not in banned_formids]
+    context = get_context()
+    candidates = [f for f in context.extra_miabs if f.rank() >= lowest_rank and
+                  f.formid not in context.miab_banned_formids]
     return sorted(candidates, key=lambda f: f.rank())
 
 
 def get_valid_chest_id():
-    global valid_ids
     try:
-        valid = valid_ids[0]
+        valid = get_context().valid_chest_ids[0]
     except IndexError:
         raise Exception("Not enough chest IDs available.")
     mark_taken_id(valid)
@@ -136,14 +129,15 @@ def get_valid_chest_id():
 
 
 def mark_taken_id(taken):
-    global valid_ids
+    context = get_context()
     assert 1 <= taken < 0x200
-    if taken in valid_ids:
-        valid_ids = [i for i in valid_ids if i != taken]
+    if taken in context.valid_chest_ids:
+        context.valid_chest_ids = [i for i in context.valid_chest_ids if i != taken]
 
 
 def select_monster_in_a_box(rank, value, clock, guarantee_miab_treasure, enemy_limit, old_version):
-    global banned_formids
+    context = get_context()
+    used_formations = context.miab_used_formations
     formations = get_appropriate_formations()
     formations = [f for f in formations if
                   f.get_guaranteed_drop_value() >= value * 100]
@@ -158,7 +152,8 @@ def select_monster_in_a_box(rank, value, clock, guarantee_miab_treasure, enemy_l
 
 
     if old_version:
-        banned_formids = [f.formid for f in formations if f.rank() < 2000]
+        context.miab_banned_formids = [f.formid for f in formations if f.rank() < 2000]
+    banned_formids = context.miab_banned_formids
 
     if guarantee_miab_treasure:
         extra_miabs = []
@@ -221,7 +216,7 @@ def select_monster_in_a_box(rank, value, clock, guarantee_miab_treasure, enemy_l
         candidates = [c for c in candidates
                       if c.formid not in banned_formids]
         if len(candidates) != 1:
-            formations = [c for c in appropriate_formations
+            formations = [c for c in context.miab_appropriate_formations
                           if c.rank() <= max_rank and c.get_guaranteed_drop_value() >= min_value]
 
             formations = [c for c in formations if c not in used_formations]
@@ -282,14 +277,15 @@ class ChestBlock:
         self.chestid = chestid
 
     def read_data(self, infile_rom_buffer: BytesIO=False):
-        global extra_miabs
         infile_rom_buffer.seek(self.pointer)
         self.position = read_multi(infile_rom_buffer, length=2)
         self.memid = ord(infile_rom_buffer.read(1))
         self.content_type = ord(infile_rom_buffer.read(1))
         self.contents = ord(infile_rom_buffer.read(1))
         self.oldid = self.memid | ((self.content_type & 1) << 8)
+        self.register_contents()
 
+    def register_contents(self):
         mark_taken_id(self.effective_id)
         if self.monster:
             add_extra_miab(self.contents)
@@ -421,7 +417,8 @@ class ChestBlock:
     def mutate_contents(self, guideline=None, monster=None,
                         guarantee_miab_treasure=False, enemy_limit=None,
                         uniqueness=False, crazy_prices=False, uncapped_monsters=False, no_monsters=False):
-        global used_formations, done_items
+        context = get_context()
+        used_formations = context.miab_used_formations
 
         if self.do_not_mutate and self.contents is not None:
             return
@@ -501,8 +498,9 @@ class ChestBlock:
             # treasure
             self.set_content_type(0x40)
             if uniqueness and random.randint(1, 7) != 7:
-                if len(done_items) >= len(items):
-                    done_items = []
+                if len(context.done_chest_items) >= len(items):
+                    context.done_chest_items = []
+                done_items = context.done_chest_items
                 temp = [i for i in items
                         if i == indexed_item or i not in done_items]
                 if len(temp) > 1:
@@ -513,13 +511,14 @@ class ChestBlock:
             index = mutate_index(index, len(items), [False, True],
                                  (-4, 2), (-2, 2))
             self.contents = items[index].itemid
-            done_items.append(items[index])
+            context.done_chest_items.append(items[index])
 
         assert self.contents <= 0xFF
         self.value = value
 
 
-event_mem_id = 281
+FIRST_EVENT_MEM_ID = 281
+event_mem_id = FIRST_EVENT_MEM_ID
 multiple_event_items = []
 
 
@@ -624,78 +623,84 @@ class EventItem:
             event_item_sub.write(output_rom_buffer, patch_name='chestrandomizer_event_data')
 
 
-# TODO: Maybe this should be in a text file
-event_items_dict = {
-    "Narshe (WoB)": [
-        EventItem(0x40, 0xF6, 0xCA00A, cutscene_skip_pointer=0xC9F87, monster=False, text=False),
-        EventItem(0x40, 0xF6, 0xCA00C, cutscene_skip_pointer=0xC9F89, monster=False, text=False),
-        EventItem(0x40, 0xCD, 0xCD59E, monster=False),
-    ],
-
-    "Figaro Castle": [
-        EventItem(0x40, 0xAA, 0xA66B4, cutscene_skip_pointer=0xA6633, monster=False, text=False),
-    ],
-
-    "Returner's Hideout": [
-        EventItem(0x40, 0xD0, 0xAFB0B, cutscene_skip_pointer=0xAFAC9, monster=False, multiple=True),
-        EventItem(0x40, 0xD1, 0xAFFD2, cutscene_skip_pointer=0xAFDE7, monster=False),
-    ],
-
-    "Mobliz (WoB)": [
-        EventItem(0x40, 0xE5, 0xC6883, monster=False),
-    ],
-
-    "Crescent Mountain": [
-        EventItem(0x40, 0xE8, 0xBC432, postfix_bytes=[0x45, 0x45, 0x45], monster=False),
-    ],
-
-    "Sealed Gate": [
-        EventItem(0x40, 0xAE, 0xB30E5, postfix_bytes=[0xD4, 0x4D, 0xFE]),
-        EventItem(0x40, 0xAC, 0xB3103, postfix_bytes=[0xD4, 0x4E, 0xFE]),
-        EventItem(0x40, 0xF5, 0xB3121, postfix_bytes=[0xD4, 0x4F, 0xFE]),
-        # in vanilla: says Remedy, gives Soft. Changed to give Remedy.
-        EventItem(0x80, 0x14, 0xB313F, postfix_bytes=[0xD4, 0x50, 0xFE]),
-        # in vanilla: says 2000 GP, gives 293 GP. Changed to give 2000 GP.
-    ],
-
-    "Vector": [
-        EventItem(0x40, 0xE5, 0xC9257, monster=False),
-        EventItem(0x40, 0xDF, 0xC926C, monster=False),
-    ],
-
-    "Owzer's Mansion": [
-        EventItem(0x80, 0x14, 0xB4A84, postfix_bytes=[0xD4, 0x59, 0x3A, 0xFE]),
-        # in vanilla: says 2000 GP, gives 293 GP. Changed to give 2000 GP.
-        EventItem(0x40, 0xE9, 0xB4AC4, postfix_bytes=[0xD4, 0x5A, 0x3A, 0xFE]),
-        # in vanilla: says Potion, gives Tonic. Changed to give Potion.
-        EventItem(0x40, 0xEC, 0xB4B03, postfix_bytes=[0xD4, 0x5B, 0x3A, 0xFE]),
-        # in vanilla: says Ether, gives Tincture. Changed to give Ether.
-        EventItem(0x40, 0xF4, 0xB4B42, postfix_bytes=[0xD4, 0x5C, 0x3A, 0xFE]),
-        # in vanilla: says Remedy, gives Soft. Changed to give Remedy.
-    ],
-
-    "Doma Castle": [
-        EventItem(0x40, 0x30, 0xB99F4, monster=False, text=False),
-    ],
-
-    "Kohlingen": [
-        EventItem(0x40, 0xEA, 0xC3240, monster=False),
-        EventItem(0x40, 0xF0, 0xC3242, monster=False),
-        EventItem(0x40, 0xED, 0xC3244, monster=False),
-        EventItem(0x40, 0xEE, 0xC3246, monster=False),
-        EventItem(0x40, 0x60, 0xC3248, monster=False),
-        EventItem(0x40, 0x09, 0xC324A, postfix_bytes=[0xFD, 0xFD, 0xFD], monster=False),
-    ],
-
-    "Narshe (WoR)": [
-        EventItem(0x40, 0x1B, 0xC0B67, monster=False),
-        EventItem(0x40, 0x66, 0xC0B80, postfix_bytes=[0xFD, 0xD0, 0xB8, 0xFD, 0xFD], monster=False),
-    ],
-
-    "Fanatics Tower": [
-        EventItem(0x40, 0x21, 0xC5598, postfix_bytes=[0xFD, 0xFD, 0xFD], monster=False),
-    ]
-}
+def make_event_items():
+    # The event items with their vanilla contents. Every run changes the contents of its own, see get_event_items().
+    global event_mem_id
+    event_mem_id = FIRST_EVENT_MEM_ID
+    multiple_event_items.clear()
+    # TODO: Maybe this should be in a text file
+    return {
+        "Narshe (WoB)": [
+            EventItem(0x40, 0xF6, 0xCA00A, cutscene_skip_pointer=0xC9F87, monster=False, text=False),
+            EventItem(0x40, 0xF6, 0xCA00C, cutscene_skip_pointer=0xC9F89, monster=False, text=False),
+            EventItem(0x40, 0xCD, 0xCD59E, monster=False),
+        ],
+
+        "Figaro Castle": [
+            EventItem(0x40, 0xAA, 0xA66B4, cutscene_skip_pointer=0xA6633, monster=False, text=False),
+        ],
+
+        "Returner's Hideout": [
+            EventItem(0x40, 0xD0, 0xAFB0B, cutscene_skip_pointer=0xAFAC9, monster=False, multiple=True),
+            EventItem(0x40, 0xD1, 0xAFFD2, cutscene_skip_pointer=0xAFDE7, monster=False),
+        ],
+
+        "Mobliz (WoB)": [
+            EventItem(0x40, 0xE5, 0xC6883, monster=False),
+        ],
+
+        "Crescent Mountain": [
+            EventItem(0x40, 0xE8, 0xBC432, postfix_bytes=[0x45, 0x45, 0x45], monster=False),
+        ],
+
+        "Sealed Gate": [
+            EventItem(0x40, 0xAE, 0xB30E5, postfix_bytes=[0xD4, 0x4D, 0xFE]),
+            EventItem(0x40, 0xAC, 0xB3103, postfix_bytes=[0xD4, 0x4E, 0xFE]),
+            EventItem(0x40, 0xF5, 0xB3121, postfix_bytes=[0xD4, 0x4F, 0xFE]),
+            # in vanilla: says Remedy, gives Soft. Changed to give Remedy.
+            EventItem(0x80, 0x14, 0xB313F, postfix_bytes=[0xD4, 0x50, 0xFE]),
+            # in vanilla: says 2000 GP, gives 293 GP. Changed to give 2000 GP.
+        ],
+
+        "Vector": [
+            EventItem(0x40, 0xE5, 0xC9257, monster=False),
+            EventItem(0x40, 0xDF, 0xC926C, monster=False),
+        ],
+
+        "Owzer's Mansion": [
+            EventItem(0x80, 0x14, 0xB4A84, postfix_bytes=[0xD4, 0x59, 0x3A, 0xFE]),
+            # in vanilla: says 2000 GP, gives 293 GP. Changed to give 2000 GP.
+            EventItem(0x40, 0xE9, 0xB4AC4, postfix_bytes=[0xD4, 0x5A, 0x3A, 0xFE]),
+            # in vanilla: says Potion, gives Tonic. Changed to give Potion.
+            EventItem(0x40, 0xEC, 0xB4B03, postfix_bytes=[0xD4, 0x5B, 0x3A, 0xFE]),
+            # in vanilla: says Ether, gives Tincture. Changed to give Ether.
+            EventItem(0x40, 0xF4, 0xB4B42, postfix_bytes=[0xD4, 0x5C, 0x3A, 0xFE]),
+            # in vanilla: says Remedy, gives Soft. Changed to give Remedy.
+        ],
+
+        "Doma Castle": [
+            EventItem(0x40, 0x30, 0xB99F4, monster=False, text=False),
+        ],
+
+        "Kohlingen": [
+            EventItem(0x40, 0xEA, 0xC3240, monster=False),
+            EventItem(0x40, 0xF0, 0xC3242, monster=False),
+            EventItem(0x40, 0xED, 0xC3244, monster=False),
+            EventItem(0x40, 0xEE, 0xC3246, monster=False),
+            EventItem(0x40, 0x60, 0xC3248, monster=False),
+            EventItem(0x40, 0x09, 0xC324A, postfix_bytes=[0xFD, 0xFD, 0xFD], monster=False),
+        ],
+
+        "Narshe (WoR)": [
+            EventItem(0x40, 0x1B, 0xC0B67, monster=False),
+            EventItem(0x40, 0x66, 0xC0B80, postfix_bytes=[0xFD, 0xD0, 0xB8, 0xFD, 0xFD], monster=False),
+        ],
+
+        "Fanatics Tower": [
+            EventItem(0x40, 0x21, 0xC5598, postfix_bytes=[0xFD, 0xFD, 0xFD], monster=False),
+        ]
+    }
+
 
 duplicate_event_item_dict = {
     0xAFB0B: 0xAFB73,  # Gauntlet from Banon
@@ -708,7 +713,10 @@ duplicate_event_item_skip_dict = {
 
 
 def get_event_items():
-    return event_items_dict
+    context = get_context()
+    if context.event_items is None:
+        context.event_items = make_event_items()
+    return context.event_items
 
 
 def mutate_event_items(outfile_rom_buffer: BytesIO, cutscene_skip=False, crazy_prices=False,
@@ -775,8 +783,9 @@ def mutate_event_items(outfile_rom_buffer: BytesIO, cutscene_skip=False, crazy_p
     for index, text in early_end_texts:
         set_dialogue(index, text)
 
-    for location in event_items_dict:
-        for e in event_items_dict[location]:
+    event_items = get_event_items()
+    for location in event_items:
+        for e in event_items[location]:
             e.mutate_contents(cutscene_skip=cutscene_skip, no_monsters=no_monsters, uncapped_monsters=uncapped_monsters,
                               crazy_prices=crazy_prices)
             e.write_data(outfile_rom_buffer, cutscene_skip=cutscene_skip)
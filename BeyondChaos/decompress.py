@@ -5,156 +5,173 @@ from shutil import copyfile
 
 from utils import read_multi, write_multi
 
-def decompress(bytestring, simple=False, complicated=True, debug=False):
-    result = bytearray([])
-    buff = bytearray(2048)
-    buffaddr = 0x7DE
-
-    while bytestring:
-        flags, bytestring = bytestring[0], bytestring[1:]
+# The LZSS format used by FF6: a 2 KiB ring buffer of zeroes, written from 0x7DE onwards.
+#   Each control byte describes the next 8 items, a set bit meaning a literal byte and a clear bit
+#   a 2-byte back reference holding an 11-bit ring buffer address and a length of 3 to 34.
+RING_BUFFER_SIZE = 0x800
+RING_BUFFER_START = 0x7DE
+MIN_MATCH_LENGTH = 3
+MAX_MATCH_LENGTH = 34
+MAX_MATCH_DISTANCE = RING_BUFFER_SIZE - 1
+# The last bytes of the data are always written as literals
+LITERAL_TAIL_LENGTH = 8
+END_MARKER = b'\xFF' + bytes(8)
+
+
+def decompress(bytestring):
+    bytestring = bytes(bytestring)
+    # The output, preceded by the initial contents of the ring buffer. A back reference copies
+    #   byte by byte, so it can repeat bytes that it has written itself.
+    history = bytearray(RING_BUFFER_SIZE)
+    position = 0
+    while position < len(bytestring):
+        flags = bytestring[position]
+        position += 1
         for i in range(8):
-            if not bytestring:
+            if position >= len(bytestring):
                 break
 
             if flags & (1 << i):
-                byte, bytestring = bytestring[0], bytestring[1:]
-                result.append(byte)
-                buff[buffaddr] = byte
-                buffaddr += 1
-                if buffaddr == 0x800:
-                    buffaddr = 0
-                if debug:
-                    print("%x" % ord(byte), end=' ')
+                history.append(bytestring[position])
+                position += 1
             else:
-                low, high, bytestring = (
-                    bytestring[0], bytestring[1], bytestring[2:])
+                low, high = bytestring[position], bytestring[position + 1]
+                position += 2
                 seekaddr = low | ((high & 0x07) << 8)
-                length = ((high & 0xF8) >> 3) + 3
-                if simple:
-                    copied = [buff[seekaddr]] * length
-                elif complicated:
-                    if buffaddr == seekaddr:
-                        raise Exception("buffaddr equals seekaddr")
-                    cycle = buffaddr - seekaddr
-                    if cycle < 0:
-                        cycle += 0x800
-                    subbuff = (buff+buff)[seekaddr:seekaddr+cycle]
-                    while len(subbuff) < length:
-                        subbuff = subbuff + subbuff
-                    copied = subbuff[:length]
+                length = ((high & 0xF8) >> 3) + MIN_MATCH_LENGTH
+                buffaddr = (RING_BUFFER_START + len(history)) % RING_BUFFER_SIZE
+                distance = (buffaddr - seekaddr) % RING_BUFFER_SIZE
+                if distance == 0:
+                    raise Exception("buffaddr equals seekaddr")
+                source = len(history) - distance
+                if distance >= length:
+                    history += history[source:source + length]
                 else:
-                    copied = (buff+buff)[seekaddr:seekaddr+length]
-                assert len(copied) == length
-                result += copied
-                if debug:
-                    print("%x" % seekaddr, length, end=' ')
-                while copied:
-                    byte, copied = copied[0], copied[1:]
-                    buff[buffaddr] = byte
-                    buffaddr += 1
-                    if buffaddr == 0x800:
-                        buffaddr = 0
-                    if debug:
-                        print("%x" % ord(byte), end=' ')
-            if debug:
-                print()
-                import pdb; pdb.set_trace()
-    return result
+                    for index in range(source, source + length):
+                        history.append(history[index])
+    return history[RING_BUFFER_SIZE:]
+
+
+def find_longest_matches(history: bytes, start: int):
+    """
+    For every position of history from start onwards, finds the longest earlier copy of the bytes there
+    that a back reference can reach. Returns the match lengths and the distances back to the copies.
+    """
+    lengths = []
+    distances = []
+    for position in range(start, len(history)):
+        max_length = min(MAX_MATCH_LENGTH, len(history) - position)
+        window_start = position - MAX_MATCH_DISTANCE
+        length = 0
+        source = -1
+        while length < max_length:
+            # Extend the copy found so far while it keeps matching, then look for a longer one.
+            #   The copy may run into the bytes being written, so it only has to start before position.
+            while length < max_length and source >= 0 and history[source + length] == history[position + length]:
+                length += 1
+            if length >= max_length:
+                break
+            found = history.find(history[position:position + length + 1], window_start, position + length)
+            if found < 0:
+                break
+            source = found
+        if length < MIN_MATCH_LENGTH:
+            lengths.append(0)
+            distances.append(0)
+        else:
+            lengths.append(length)
+            distances.append(position - source)
+    return lengths, distances
 
 
 def recompress(bytestring):
-    global buffaddr
-    bytestring = bytearray([c if isinstance(c, int) else ord(c) for c in bytestring])
+    """
+    Compresses bytestring into the smallest stream that the LZSS format allows with the same layout as
+    always: literals for the last LITERAL_TAIL_LENGTH bytes, the last control group padded with zeroes and
+    followed by END_MARKER unless it is all literals ending in two zeroes.
+
+    The longest match at each position is found with bytes.find over the ring buffer window. The items are
+    then chosen by dynamic programming over (position, items in the current control group, whether that
+    group has a back reference), which is enough to price the control bytes, the padding and the end marker
+    exactly.
+    """
+    data = bytes(c if isinstance(c, int) else ord(c) for c in bytestring)
+    size = len(data)
+    if not size:
+        return bytearray()
+    history = bytes(RING_BUFFER_SIZE) + data
+    lengths, distances = find_longest_matches(history, RING_BUFFER_SIZE)
+
+    # States are (items in the current group, group has a back reference). A group holds 1 to 8 items,
+    #   and the run starts as if after a full group, so that the first item pays for a control byte.
+    states = [(items, has_match) for items in range(1, 9) for has_match in (False, True)]
+    state_indexes = {state: index for index, state in enumerate(states)}
+
+    def next_state(items, has_match, is_match):
+        if items == 8:
+            return state_indexes[(1, is_match)], 1
+        return state_indexes[(items + 1, has_match or is_match)], 0
+
+    transitions = [(next_state(items, has_match, False), next_state(items, has_match, True))
+                   for items, has_match in states]
+
+    # cost[state][position] is the size of the rest of the stream from position onwards
+    cost = [[0] * (size + 1) for _ in states]
+    choice = [[0] * size for _ in states]
+    for index, (items, has_match) in enumerate(states):
+        padding = 8 - items
+        if has_match or (padding == 1 and data[-1]) or (padding == 0 and (size < 2 or data[-2] or data[-1])):
+            cost[index][size] = padding + len(END_MARKER)
+        else:
+            cost[index][size] = padding
+
+    for position in range(size - 1, -1, -1):
+        max_length = lengths[position] if position < size - LITERAL_TAIL_LENGTH else 0
+        best_matches = {}
+        for index, ((literal_state, literal_cost), (match_state, match_cost)) in enumerate(transitions):
+            best_cost = 1 + literal_cost + cost[literal_state][position + 1]
+            best_length = 0
+            if max_length:
+                if match_state not in best_matches:
+                    costs = cost[match_state][position + MIN_MATCH_LENGTH:position + max_length + 1]
+                    lowest = min(costs)
+                    best_matches[match_state] = (lowest, costs.index(lowest) + MIN_MATCH_LENGTH)
+                lowest, length = best_matches[match_state]
+                if 2 + match_cost + lowest < best_cost:
+                    best_cost = 2 + match_cost + lowest
+                    best_length = length
+            cost[index][position] = best_cost
+            choice[index][position] = best_length
+
     result = bytearray()
-    buff = bytearray(2048)
-    buffaddr = 0x7DE
-
-    def add_buff(c):
-        global buffaddr
-        buff[buffaddr] = c
-        buffaddr += 1
-        buffaddr = buffaddr % 0x800
-
-    while bytestring:
-        control = 0x00
-        subresult = bytearray()
-        for i in range(8):
-            searchbuff = (buff + buff)
-            for j in range(3, 35):
-                searchstr = bytestring[:j]
-                if searchstr not in searchbuff:
-                    break
-                location = searchbuff.find(searchstr)
-                if location == buffaddr:
-                    location = searchbuff[location+1:].find(searchstr)
-                    if location < 0:
-                        break
-                    location = buffaddr + location + 1
-                    if location % 0x800 == buffaddr:
-                        break
-            else:
-                j = 0
-            j = j - 1
-            goodloop = None
-            loopbuff = buff[:buffaddr]
-            #if len(loopbuff) < 35:
-            #    loopbuff = "".join(buff) + loopbuff
-            for k in range(j+1, 35):
-                searchstr = bytestring[:k]
-                for h in range(1, len(searchstr)+1):
-                    loopstr = searchstr[:h]
-                    mult = (len(searchstr) // len(loopstr)) + 1
-                    if searchstr == (loopstr * mult)[:len(searchstr)]:
-                        if loopbuff.endswith(loopstr):
-                            j = k
-                            goodloop = loopstr
-            if len(bytestring) <= 8:
-                j = 0
-            if j >= 3:
-                substr = bytestring[:j]
-                bytestring = bytestring[j:]
-                if not goodloop:
-                    index = searchbuff.find(substr)
-                    if index % 0x800 == buffaddr:
-                        index = searchbuff[index+1:].find(substr)
-                        index += buffaddr + 1
-                        assert index >= 0
-                        assert index % 0x800 != buffaddr
-                else:
-                    index = len(loopbuff) - len(goodloop)
-                if index < 0:
-                    index += 0x800
-                index = index % 0x800
-
-                try:
-                    assert 0 <= index < 0x800
-                    assert (j-3) & 0xFFE0 == 0
-                except:
-                    import pdb; pdb.set_trace()
-                value = index << 5
-                value = value | (j - 3)
-                while substr:
-                    c = substr[0]
-                    substr = substr[1:]
-                    add_buff(c)
-                byte1 = index & 0xFF
-                byte2 = (index >> 8) | ((j-3) << 3)
-                assert byte1 | ((byte2 & 0x07) << 8) == index
-                assert ((byte2 & 0xF8) >> 3) + 3 == j
-                subresult += bytes([byte1, byte2])
-            else:
-                control |= (1 << i)
-                if bytestring:
-                    c, bytestring = bytestring[0], bytestring[1:]
-                else:
-                    c = 0
-                subresult.append(c)
-                add_buff(c)
-        result += bytes([control]) + subresult
-        if not bytestring and (
-                control != 0xFF
-                or not subresult.endswith(bytes([0, 0]))):
-            result += b'\xFF' + bytes(8)
+    control_index = 0
+    items = 8
+    state = state_indexes[(8, False)]
+    position = 0
+    while position < size:
+        if items == 8:
+            control_index = len(result)
+            result.append(0)
+            items = 0
+        length = choice[state][position]
+        state = transitions[state][1 if length else 0][0]
+        if length:
+            buffaddr = (RING_BUFFER_START + position) % RING_BUFFER_SIZE
+            seekaddr = (buffaddr - distances[position]) % RING_BUFFER_SIZE
+            result += bytes([seekaddr & 0xFF, (seekaddr >> 8) | ((length - MIN_MATCH_LENGTH) << 3)])
+            position += length
+        else:
+            result[control_index] |= 1 << items
+            result.append(data[position])
+            position += 1
+        items += 1
+
+    while items < 8:
+        result[control_index] |= 1 << items
+        result.append(0)
+        items += 1
+    if result[control_index] != 0xFF or not result.endswith(bytes([0, 0])):
+        result += END_MARKER
     return result
 
 
@@ -163,7 +180,7 @@ def decompress_at_location(infile_rom_buffer: BytesIO, address):
     size = read_multi(infile_rom_buffer, length=2)
     # print "Size is %s" % size
     bytestring = infile_rom_buffer.read(size)
-    decompressed = decompress(bytestring, complicated=True)
+    decompressed = decompress(bytestring)
     return decompressed
 
 
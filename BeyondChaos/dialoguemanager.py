@@ -9,6 +9,7 @@
 
 import os
 import re
+from randomizercontext import get_context
 from utils import dialoguetexttable, bytes_to_dialogue, utilrandom as random, open_mei_fallback as open, read_multi, \
     write_multi
 from io import BytesIO
@@ -35,14 +36,9 @@ try:
 except KeyError:
     pass
 
-dialogue_vars = {}
-dialogue_flags = set()
-dialogue_patches = {}
-dialogue_patches_battle = {}
 script_ptrs = {}
 script = {}
 script_bin = bytes()
-script_edited = False
 
 location_name_ptrs = {}
 location_names = {}
@@ -100,10 +96,11 @@ def dialogue_to_bytes(text, null_terminate=True):
 
 
 def set_dialogue_var(key, value):
-    dialogue_vars[key.lower()] = value
+    get_context().dialogue_vars[key.lower()] = value
 
 
 def set_dialogue_flag(flag, value=True):
+    dialogue_flags = get_context().dialogue_flags
     if value:
         dialogue_flags.add(flag.lower())
     elif flag in dialogue_flags:
@@ -150,7 +147,8 @@ def set_pronoun(name, gender, force=True):
 
 
 def patch_dialogue(id, from_text, to_text, index=None, battle=False):
-    patches = dialogue_patches_battle if battle else dialogue_patches
+    context = get_context()
+    patches = context.dialogue_patches_battle if battle else context.dialogue_patches
     if id not in patches:
         patches[id] = {}
     patches[id][(from_text.lower(), index)] = to_text
@@ -161,9 +159,8 @@ def get_dialogue(idx):
 
 
 def set_dialogue(idx, text):
-    global script_edited
     script[idx] = text
-    script_edited = True
+    get_context().script_edited = True
 
 
 def set_location_name(idx, text):
@@ -232,9 +229,10 @@ def read_dialogue(infile_rom_buffer: BytesIO):
 
 def manage_dialogue_patches(outfile_rom_buffer: BytesIO):
     global script_bin
+    context = get_context()
 
     # don't do anything unless we need to
-    if not dialogue_patches and not dialogue_patches_battle and not script_edited:
+    if not context.dialogue_patches and not context.dialogue_patches_battle and not context.script_edited:
         return
 
     # TODO battle pointers
@@ -242,7 +240,7 @@ def manage_dialogue_patches(outfile_rom_buffer: BytesIO):
     # print(f"original script size is ${len(script_bin):X} bytes")
 
     # apply changes to dialogue
-    for idx, patches in dialogue_patches.items():
+    for idx, patches in context.dialogue_patches.items():
         line = split_line(script[idx])
 
         # print(f"patching line {idx}")
@@ -335,9 +333,10 @@ def patch(text, token):
             except ValueError:
                 textiftrue = opts
                 textiffalse = ""
-            var = textiftrue if flag.lower() in dialogue_flags else textiffalse
+            var = textiftrue if flag.lower() in get_context().dialogue_flags else textiffalse
         # handle variables
         else:
+            dialogue_vars = get_context().dialogue_vars
             if match[1].lower() not in dialogue_vars:
                 print(f"warning: dialogue variable {match[1]} not defined")
                 var = match[1]
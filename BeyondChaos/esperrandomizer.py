@@ -5,9 +5,11 @@ from functools import reduce
 from itertools import chain, repeat
 from typing import List
 
+import romsnapshot
 from dialoguemanager import patch_dialogue, set_dialogue_var, set_location_name
 from itemrandomizer import get_item
 from monsterrandomizer import change_enemy_name, get_monster, MonsterGraphicBlock
+from randomizercontext import get_context
 from skillrandomizer import get_ranked_spells, get_spell
 from utils import ESPER_TABLE, MAGICITE_TABLE, hex2int, int2bytes, name_to_bytes, Substitution, utilrandom as random
 
@@ -46,13 +48,10 @@ bonus_strings = {
     0xF: "MAG + 1",
     0x10: "MAG + 2"}
 
-spells = None
-used = set([])
-used_bonuses = set([])
-
 
 def get_candidates(myrank, set_lower=True):
-    global used
+    context = get_context()
+    spells, used = context.esper_spells, context.used_esper_spells
     upper_bound = rankbounds.get(myrank, 999) or 999
     lower_bound = rankbounds.get(myrank - 1, 0) if set_lower else 0
 
@@ -214,10 +213,10 @@ class EsperBlock:
         return s
 
     def read_data(self, rom_file_buffer: BytesIO=False):
-        global spells
+        context = get_context()
         rom_file_buffer.seek(self.pointer)
-        if spells is None:
-            spells = get_ranked_spells(rom_file_buffer, magic_only=True)
+        if context.esper_spells is None:
+            context.esper_spells = get_ranked_spells(rom_file_buffer, magic_only=True)
         self.spells, self.learnrates = [], []
         for _ in range(5):
             learnrate = ord(rom_file_buffer.read(1))
@@ -252,7 +251,7 @@ class EsperBlock:
         return candidates
 
     def generate_spells(self, tierless=False, allow_ultima=True):
-        global used
+        used = get_context().used_esper_spells
 
         self.spells, self.learnrates = [], []
         rank = self.rank
@@ -294,6 +293,7 @@ class EsperBlock:
             self.learnrates.append(learnrate)
 
     def generate_bonus(self):
+        used_bonuses = get_context().used_esper_bonuses
         rank = self.rank
         candidates = set(bonus_ranks[rank])
         candidates = candidates - used_bonuses
@@ -316,7 +316,7 @@ class EsperBlock:
         used_bonuses.add(self.bonus)
 
     def add_spell(self, spellid, learnrate):
-        spell = [s for s in spells if s.spellid == spellid][0]
+        spell = [s for s in get_context().esper_spells if s.spellid == spellid][0]
         spellrates = list(zip(self.spells, self.learnrates))
         if len(spellrates) == 5:
             spellrates = sorted(spellrates, key=lambda s_l: s_l[0].rank())
@@ -474,15 +474,8 @@ def randomize_magicite(outfile_rom_buffer, infile_rom_buffer):
     return shuffled_espers
 
 
-all_espers = None
-
-
-def get_espers(sourcefile):
-    global all_espers
-    if all_espers:
-        return all_espers
-
-    all_espers = []
+def read_espers(sourcefile):
+    espers = []
     for i, line in enumerate(open(ESPER_TABLE)):
         line = line.strip()
         if line[0] == '#':
@@ -493,5 +486,23 @@ def get_espers(sourcefile):
         c = EsperBlock(*line.split(','))
         c.read_data(sourcefile)
         c.set_id(i)
-        all_espers.append(c)
+        espers.append(c)
+    return espers
+
+
+def get_espers(sourcefile):
+    context = get_context()
+    if context.espers:
+        return context.espers
+
+    all_espers = romsnapshot.restore('espers')
+    if all_espers is None:
+        all_espers = read_espers(sourcefile)
+    else:
+        # Snapshot espers come with their own copies of their spells. Link them to the spells of this run.
+        if context.esper_spells is None:
+            context.esper_spells = get_ranked_spells(sourcefile, magic_only=True)
+        for esper in all_espers:
+            esper.spells = [get_spell(spell.spellid) for spell in esper.spells]
+    context.espers = all_espers
     return get_espers(sourcefile)
@@ -2,7 +2,9 @@
 from io import BytesIO
 from math import log, floor
 
-from monsterrandomizer import monsterdict, updatePos, get_monsters
+import romsnapshot
+from monsterrandomizer import updatePos, get_monsters, get_monster
+from randomizercontext import get_context
 from utils import read_multi, write_multi, utilrandom as random
 
 # Guardian x4, Broken Dirt Drgn, Kefka + Ice Dragon
@@ -10,9 +12,6 @@ REPLACE_FORMATIONS = [0x20e, 0x1ca, 0x1e9, 0x1fa]
 KEFKA_EXTRA_FORMATION = 0x1FF  # Fake Atma
 NOREPLACE_FORMATIONS = [0x232, 0x1c5, 0x1bb, 0x230, KEFKA_EXTRA_FORMATION]
 
-fsetdict = None
-formdict = None
-
 
 class Formation():
     def __init__(self, formid):
@@ -255,7 +254,7 @@ class Formation():
             if self.bosses & (1 << i):
                 eid += 0x100
             self.big_enemy_ids.append(eid)
-            self.enemies.append(monsterdict[eid])
+            self.enemies.append(get_monster(eid))
             enemy_pos = self.enemy_pos[i]
             x, y = enemy_pos >> 4, enemy_pos & 0xF
             self.enemies[i].update_pos(x, y)
@@ -369,6 +368,7 @@ class FormationSet():
 
     @property
     def formations(self):
+        formdict = get_context().formdict
         return [formdict[i & 0x7FFF] for i in self.formids]
 
     @property
@@ -487,42 +487,55 @@ class FormationSet():
 
 
 def get_formation(formid):
-    global formdict
-    return formdict[formid]
+    return get_context().formdict[formid]
+
+
+def read_formations(filename):
+    formations = []
+    for i in range(576):
+        f = Formation(i)
+        f.read_data(filename)
+        formations.append(f)
+    return formations
 
 
 def get_formations(filename=None):
-    global formdict
+    formdict = get_context().formdict
     if formdict:
         return [f for (_, f) in sorted(formdict.items())]
 
-    formdict = {}
-    for i in range(576):
-        f = Formation(i)
-        f.read_data(filename)
+    # lookup_enemies() and read_mould() link the formations to the monsters, so they are
+    #   never part of the snapshot.
+    for f in romsnapshot.load('formations', read_formations, filename):
         f.lookup_enemies()
         f.read_mould(filename)
-        formdict[i] = f
+        formdict[f.formid] = f
 
     return get_formations()
 
 
+def read_fsets(filename):
+    fsets = []
+    for i in range(512):
+        fs = FormationSet(setid=i)
+        fs.read_data(filename)
+        fsets.append(fs)
+    return fsets
+
+
 def get_fsets(filename=None):
-    global fsetdict
+    fsetdict = get_context().fsetdict
     if filename is None or fsetdict:
         fsets = [fs for (_, fs) in sorted(fsetdict.items())]
         return fsets
 
-    fsetdict = {}
-    for i in range(512):
-        fs = FormationSet(setid=i)
-        fs.read_data(filename)
-        fsetdict[i] = fs
+    for fs in romsnapshot.load('fsets', read_fsets, filename):
+        fsetdict[fs.setid] = fs
     return get_fsets()
 
 
 def get_fset(setid):
-    return fsetdict[setid]
+    return get_context().fsetdict[setid]
 
 
 if __name__ == "__main__":
@@ -0,0 +1,146 @@
+from bisect import bisect_left, bisect_right, insort
+from typing import List, NamedTuple, Tuple
+
+BANK_SIZE = 0x10000
+
+
+class Allocation(NamedTuple):
+    start: int
+    end: int
+    tag: str
+
+
+class FreeSpace:
+    """
+    The free space of the output ROM, shared by everything in a run that needs room for new data.
+
+    Free space is kept as sorted, disjoint, half-open ranges that are merged whenever they touch, plus a
+    second list of the same ranges sorted by size. allocate() is best-fit: the smallest range that fits,
+    found by binary search, or among the few ranges overlapping a bank or address window when one is
+    required. Every allocation and claim is recorded with a tag for the spoiler's ROM map, and claiming
+    space that was already allocated raises an error right away.
+    """
+    def __init__(self):
+        self.starts: List[int] = []
+        self.ends: List[int] = []
+        # (size, start) of every free range, sorted
+        self.by_size: List[Tuple[int, int]] = []
+        self.allocations: List[Allocation] = []
+        self.allocation_starts: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    @property
+    def total(self) -> int:
+        return sum(end - start for start, end in zip(self.starts, self.ends))
+
+    def get_free_ranges(self) -> List[Tuple[int, int]]:
+        return list(zip(self.starts, self.ends))
+
+    def _insert_range(self, start: int, end: int):
+        index = bisect_left(self.starts, start)
+        self.starts.insert(index, start)
+        self.ends.insert(index, end)
+        insort(self.by_size, (end - start, start))
+
+    def _remove_range(self, index: int):
+        start = self.starts.pop(index)
+        end = self.ends.pop(index)
+        del self.by_size[bisect_left(self.by_size, (end - start, start))]
+
+    def free(self, start: int, end: int):
+        """
+        Adds start to end to the free space, merging it with any free range it touches. Parts of it
+        that are allocated or claimed stay in use.
+        """
+        index = max(bisect_right(self.allocation_starts, start) - 1, 0)
+        for allocation in self.allocations[index:]:
+            if allocation.start >= end:
+                break
+            if allocation.end <= start:
+                continue
+            self._free_range(start, allocation.start)
+            start = allocation.end
+        self._free_range(start, end)
+
+    def _free_range(self, start: int, end: int):
+        if start >= end:
+            return
+        # Every range from the first that ends at or after start to the last that starts at or before end
+        first = bisect_left(self.ends, start)
+        last = bisect_right(self.starts, end)
+        if first < last:
+            start = min(start, self.starts[first])
+            end = max(end, self.ends[last - 1])
+            for index in range(last - 1, first - 1, -1):
+                self._remove_range(index)
+        self._insert_range(start, end)
+
+    def _unfree(self, start: int, end: int):
+        first = bisect_right(self.ends, start)
+        last = bisect_left(self.starts, end)
+        remainders = []
+        for index in range(first, last):
+            if self.starts[index] < start:
+                remainders.append((self.starts[index], start))
+            if self.ends[index] > end:
+                remainders.append((end, self.ends[index]))
+        for index in range(last - 1, first - 1, -1):
+            self._remove_range(index)
+        for remainder in remainders:
+            self._insert_range(*remainder)
+
+    def _record(self, start: int, end: int, tag: str):
+        index = bisect_right(self.allocation_starts, start)
+        for neighbor in self.allocations[max(index - 1, 0):index + 1]:
+            if neighbor.start < end and start < neighbor.end:
+                raise MemoryError(f'{tag} at 0x{start:X}-0x{end - 1:X} overlaps {neighbor.tag} '
+                                  f'at 0x{neighbor.start:X}-0x{neighbor.end - 1:X}')
+        self.allocation_starts.insert(index, start)
+        self.allocations.insert(index, Allocation(start, end, tag))
+
+    def claim(self, start: int, end: int, tag: str):
+        """
+        Marks start to end as used by tag, whether or not it was free. Raises MemoryError if any of it
+        was already allocated or claimed.
+        """
+        if start >= end:
+            return
+        self._record(start, end, tag)
+        self._unfree(start, end)
+
+    def allocate(self, size: int, tag: str, bank: int = None, within: Tuple[int, int] = None) -> int:
+        """
+        Finds room for size bytes, optionally inside one bank or inside the window within (start, end),
+        marks it as used by tag and returns its address. The smallest free range that fits is used,
+        from its lowest address. Raises MemoryError if nothing fits.
+        """
+        if bank is not None:
+            within = (bank * BANK_SIZE, (bank + 1) * BANK_SIZE)
+
+        if within is None:
+            index = bisect_left(self.by_size, (size, -1))
+            if index == len(self.by_size):
+                raise MemoryError(f'Not enough free space for {tag}')
+            start = self.by_size[index][1]
+        else:
+            window_start, window_end = within
+            best = None
+            index = bisect_right(self.ends, window_start)
+            while index < len(self.starts) and self.starts[index] < window_end:
+                start = max(self.starts[index], window_start)
+                room = min(self.ends[index], window_end) - start
+                if room >= size and (best is None or room < best[0]):
+                    best = (room, start)
+                index += 1
+            if best is None:
+                raise MemoryError(f'Not enough free space for {tag}')
+            start = best[1]
+
+        self.claim(start, start + size, tag)
+        return start
+
+    def get_rom_map(self) -> List[str]:
+        return [f'0x{allocation.start:06X}-0x{allocation.end - 1:06X} {allocation.tag}'
+                for allocation in self.allocations]
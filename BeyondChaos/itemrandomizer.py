@@ -1,5 +1,7 @@
 import traceback
 import options
+import romsnapshot
+from randomizercontext import get_context
 
 from io import BytesIO
 from utils import (hex2int, write_multi, read_multi, ITEM_TABLE,
@@ -31,25 +33,16 @@ STATPROTECT = {"fieldeffect": 0xdc,
                "otherproperties": 0xdf,
                "statusacquire2": 0x00}
 
-all_spells = None
-effects_used = []
-itemdict = {}
-customs = {}
-changed_commands = []
-
-# mutated_names keeps track of which item's names have been mutated and how many times they have been mutated
-mutated_names = {}
-
 break_unused_dict = {0x09: list(range(0xA3, 0xAB)),
                      0x08: list(range(0xAB, 0xB0)) + list(range(0x41, 0x44))}
 
 
 def set_item_changed_commands(commands):
-    global changed_commands
-    changed_commands = set(commands)
+    get_context().item_changed_commands = set(commands)
 
 
 def get_custom_items():
+    customs = get_context().custom_items
     if customs:
         return customs
 
@@ -262,7 +255,7 @@ class ItemBlock:
         self.degree = value
 
     def read_stats(self, rom_file_buffer: BytesIO=False):
-        global all_spells
+        context = get_context()
 
         rom_file_buffer.seek(self.pointer)
         self.itemtype = ord(rom_file_buffer.read(1))
@@ -286,9 +279,9 @@ class ItemBlock:
 
         self.price = read_multi(rom_file_buffer, length=2)
 
-        if all_spells is None:
+        if context.item_spells is None:
             all_spells = get_ranked_spells(rom_file_buffer)
-            all_spells = [s for s in all_spells if s.valid]
+            context.item_spells = [s for s in all_spells if s.valid]
 
         rom_file_buffer.seek(0x2CE408 + (8 * self.itemid))
         self.weapon_animation = list(rom_file_buffer.read(8))
@@ -421,6 +414,7 @@ class ItemBlock:
         return mblock
 
     def pick_a_spell(self, magic_only=False, custom=None):
+        all_spells = get_context().item_spells
         if magic_only:
             spells = [s for s in all_spells if s.spellid in range(0, 36)]
         else:
@@ -568,7 +562,7 @@ class ItemBlock:
             self.mutate_name()
 
     def mutate_break_effect(self, always_break=False, wild_breaks=False, no_breaks=False, unbreakable=False):
-        global effects_used
+        context = get_context()
         if self.is_consumable:
             return
 
@@ -581,7 +575,8 @@ class ItemBlock:
             return
 
         if always_break:
-            effects_used = []
+            context.break_effects_used = []
+        effects_used = context.break_effects_used
 
         success = False
         max_spellid = 0xFE if wild_breaks else 0x50
@@ -821,7 +816,7 @@ class ItemBlock:
 
     def mutate(self, always_break=False, crazy_prices=False, extra_effects=False, wild_breaks=False, no_breaks=False,
                unbreakable=False, allow_ultima=True):
-        global changed_commands
+        changed_commands = get_context().item_changed_commands
         self.mutate_stats()
         self.mutate_price(crazy_prices=crazy_prices)
         broken, learned = False, False
@@ -889,7 +884,7 @@ class ItemBlock:
             self.mutate_break_effect(unbreakable=unbreakable)
 
     def mutate_name(self, vanilla=False, character='?'):
-        global mutated_names
+        mutated_names = get_context().mutated_item_names
         if vanilla:
             self.name = self.vanilla_data.name
             self.dataname[1:] = name_to_bytes(self.name, len(self.name))
@@ -1017,7 +1012,7 @@ UMARO_ID = 13
 
 
 def reset_equippable(items, characters, numchars=NUM_CHARS, equip_anything=False):
-    global changed_commands
+    changed_commands = get_context().item_changed_commands
     prevents = [i for i in items if i.prevent_encounters]
     for item in prevents:
         while True:
@@ -1136,7 +1131,7 @@ def reset_cursed_shield(output_rom_buffer: BytesIO):
 
 
 def reset_special_relics(items, characters, output_rom_buffer: BytesIO):
-    global changed_commands
+    changed_commands = get_context().item_changed_commands
     characters = [c for c in characters if c.id < 14]
     changedict = {}
     loglist = []
@@ -1262,18 +1257,28 @@ def items_from_table(tablefile):
     return items
 
 
+def read_items(rom_file_buffer: BytesIO):
+    items = items_from_table(ITEM_TABLE)
+    for i in items:
+        i.read_stats(rom_file_buffer)
+        i.vanilla_data = deepcopy(i)
+    return items
+
+
 def get_items(rom_file_buffer: BytesIO = None, allow_banned=False):
-    global itemdict
+    context = get_context()
+    itemdict = context.itemdict
     if itemdict:
         to_return = [i for i in list(itemdict.values()) if i]
         if not allow_banned:
             to_return = [i for i in to_return if not i.banned]
         return to_return
 
-    items = items_from_table(ITEM_TABLE)
-    for i in items:
-        i.read_stats(rom_file_buffer)
-        i.vanilla_data = deepcopy(i)
+    items = romsnapshot.load('items', read_items, rom_file_buffer)
+    if context.item_spells is None:
+        # Normally loaded by ItemBlock.read_stats, which is skipped for snapshot items
+        all_spells = get_ranked_spells(rom_file_buffer)
+        context.item_spells = [s for s in all_spells if s.valid]
 
     for n, i in enumerate(items):
         i.set_degree(n / float(len(items)))
@@ -1284,8 +1289,7 @@ def get_items(rom_file_buffer: BytesIO = None, allow_banned=False):
 
 
 def get_item(itemid, allow_banned=False):
-    global itemdict
-    item = itemdict[itemid]
+    item = get_context().itemdict[itemid]
     if item and item.banned:
         if allow_banned:
             return item
@@ -1294,7 +1298,7 @@ def get_item(itemid, allow_banned=False):
 
 
 def unbanItems():
-    global itemdict
+    itemdict = get_context().itemdict
     try:
         for x in range(0, len(itemdict)):
             item = itemdict[x]
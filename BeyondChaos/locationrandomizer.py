@@ -1,19 +1,16 @@
 #!/usr/bin/env python3
 from io import BytesIO
 from copy import copy
+import romsnapshot
 from formationrandomizer import get_fset
+from randomizercontext import get_context
 from utils import (read_multi, write_multi, battlebg_palettes, MAP_NAMES_TABLE,
                    UNUSED_LOCATIONS_TABLE, MAP_BATTLE_BG_TABLE,
                    ENTRANCE_REACHABILITY_TABLE, LOCATION_MAPS_TABLE,
                    utilrandom as random)
 
-locations = None
-zones = None
-unused_locs = None
 reachdict = None
 mapnames = {}
-locdict = {}
-chest_id_counts = None
 mapbattlebgs = {}
 maplocations = {}
 maplocations_reverse = {}
@@ -68,15 +65,16 @@ def add_location_map(location_name, mapid):
 
 
 def get_chest_id_counts():
-    global chest_id_counts
-    if chest_id_counts is not None:
-        return chest_id_counts
+    context = get_context()
+    if context.chest_id_counts is not None:
+        return context.chest_id_counts
     chest_id_counts = {}
     for location in get_locations():
         for chest in location.chests:
             if chest.effective_id not in chest_id_counts:
                 chest_id_counts[chest.effective_id] = 0
             chest_id_counts[chest.effective_id] += 1
+    context.chest_id_counts = chest_id_counts
     return get_chest_id_counts()
 
 
@@ -1026,21 +1024,35 @@ class EntranceSet:
             longentrance.desty = e.y
 
 
+def read_locations(infile_rom_buffer: BytesIO):
+    locations = [Location(i) for i in range(415)]
+    for location in locations:
+        location.read_data(infile_rom_buffer)
+        location.fill_battle_bg()
+    return locations
+
+
 def get_locations(infile_rom_buffer: BytesIO = None):
-    global locations
-    if locations is None:
-        locations = [Location(i) for i in range(415)]
+    context = get_context()
+    if context.locations is None:
         if infile_rom_buffer is None:
             raise ValueError("Please supply a filename for new locations.")
+        locations = romsnapshot.restore('locations')
+        if locations is None:
+            locations = read_locations(infile_rom_buffer)
+        else:
+            for location in locations:
+                for chest in location.chests:
+                    chest.register_contents()
         for location in locations:
-            location.read_data(infile_rom_buffer)
-            location.fill_battle_bg()
-            locdict[location.locid] = location
-    return locations
+            context.locdict[location.locid] = location
+        context.locations = locations
+    return context.locations
 
 
 def update_locations(newlocs):
-    global locations
+    context = get_context()
+    locations, locdict = context.locations, context.locdict
     for l in sorted(newlocs, key=lambda o: o.locid):
         if l in locations:
             continue
@@ -1051,30 +1063,35 @@ def update_locations(newlocs):
         l.new = True
 
 
+def read_zones(rom_file_buffer: BytesIO):
+    zones = [Zone(i) for i in range(0x100)]
+    for z in zones:
+        z.read_data(rom_file_buffer)
+    return zones
+
+
 def get_zones(rom_file_buffer: BytesIO = None):
-    global zones
-    if zones is None:
-        zones = [Zone(i) for i in range(0x100)]
+    context = get_context()
+    if context.zones is None:
         if rom_file_buffer is None:
             raise Exception("Please supply a filename for new zones.")
-        for z in zones:
-            z.read_data(rom_file_buffer)
+        context.zones = romsnapshot.load('zones', read_zones, rom_file_buffer)
         return get_zones()
-    assert len(zones) == 0x100
-    return zones
+    assert len(context.zones) == 0x100
+    return context.zones
 
 
 def get_location(locid):
-    global locdict
+    locdict = get_context().locdict
     if locid not in locdict:
         get_locations()
     return locdict[locid]
 
 
 def get_unused_locations():
-    global unused_locs
-    if unused_locs:
-        return unused_locs
+    context = get_context()
+    if context.unused_locations:
+        return context.unused_locations
 
     unused_locs = set([])
     for line in open(UNUSED_LOCATIONS_TABLE):
@@ -1082,7 +1099,7 @@ def get_unused_locations():
         loc = get_location(locid)
         unused_locs.add(loc)
 
-    unused_locs = sorted(unused_locs, key=lambda l: l.locid)
+    context.unused_locations = sorted(unused_locs, key=lambda l: l.locid)
     return get_unused_locations()
 
 
@@ -1,6 +1,10 @@
 import copy
 import traceback
 from io import BytesIO
+import romsnapshot
+import struct
+from romimage import read_struct
+from randomizercontext import get_context
 from utils import (write_multi, read_multi, ENEMY_TABLE,
                    name_to_bytes, get_palette_transformer, mutate_index,
                    make_table, utilrandom as random)
@@ -21,19 +25,17 @@ shortnames = {'level': 'lv',
               'evade%': 'evd',
               'mblock%': 'mblk'}
 
-metamorphs = None
-all_spells = None
 HIGHEST_LEVEL = 77
-xps = []
-gps = []
 AICODES = {0xF0: 3, 0xF1: 1, 0xF2: 3, 0xF3: 2,
            0xF4: 3, 0xF5: 3, 0xF6: 3, 0xF7: 1,
            0xF8: 2, 0xF9: 3, 0xFA: 3, 0xFB: 2,
            0xFC: 3, 0xFD: 0, 0xFE: 0, 0xFF: 0
            }
-monsterdict = {}
 
-globalweights, avgs = None, {}
+# The first 32 bytes of a monster's stats: the stats in stat_order, hp, mp, xp, gp, level, morph, misc1, misc2,
+#   immunities, absorb, null, weakness, 1 unused byte, statuses and special
+MONSTER_STATS_STRUCT = struct.Struct('<8B4H4B3B3B1x4BB')
+MONSTER_PALETTE_STRUCT = struct.Struct('<32H')
 
 statusdict = {
     "blind": (0, 0x01),
@@ -113,8 +115,7 @@ ranked = [specialdict[key] for key in ranked]
 
 
 def updatePos(monsterId, x, y):
-    global monsterdict
-    monsterdict[monsterId].update_pos(x, y)
+    get_context().monsterdict[monsterId].update_pos(x, y)
 
 
 def change_enemy_name(outfile_rom_buffer: BytesIO, enemy_id, name):
@@ -499,7 +500,7 @@ class MonsterBlock:
     def set_id(self, i):
         self.id = i
         self.specialeffectpointer = 0xF37C0 + self.id
-        monsterdict[self.id] = self
+        get_context().monsterdict[self.id] = self
 
     def update_size(self, width, height):
         if not self.width or not self.height:
@@ -664,43 +665,28 @@ class MonsterBlock:
         self.copy_visible(chosen)
 
     def read_stats(self, infile_rom_buffer: BytesIO=False):
-        global all_spells
         global HIGHEST_LEVEL
 
         try:
-            infile_rom_buffer.seek(self.pointer)
-            for key in stat_order:
-                self.stats[key] = ord(infile_rom_buffer.read(1))
-            self.stats['hp'] = read_multi(infile_rom_buffer, length=2)
-            self.stats['mp'] = read_multi(infile_rom_buffer, length=2)
-            self.stats['xp'] = read_multi(infile_rom_buffer, length=2)
-            self.stats['gp'] = read_multi(infile_rom_buffer, length=2)
-            self.stats['level'] = ord(infile_rom_buffer.read(1))
+            stats = read_struct(infile_rom_buffer, MONSTER_STATS_STRUCT, self.pointer)
+            for key, value in zip(stat_order, stats):
+                self.stats[key] = value
+            (self.stats['hp'], self.stats['mp'], self.stats['xp'], self.stats['gp'],
+             self.stats['level'], self.morph, self.misc1, self.misc2) = stats[8:16]
             self.oldlevel = self.stats['level']
+            context = get_context()
             if self.stats['xp'] > 0:
-                xps.append((self.oldlevel, self.stats['xp']))
+                context.monster_xps.append((self.oldlevel, self.stats['xp']))
             if self.stats['gp'] > 0:
-                gps.append((self.oldlevel, self.stats['gp']))
+                context.monster_gps.append((self.oldlevel, self.stats['gp']))
 
-            self.morph = ord(infile_rom_buffer.read(1))
-            self.misc1 = ord(infile_rom_buffer.read(1))
-            self.misc2 = ord(infile_rom_buffer.read(1))
+            self.immunities = list(stats[16:19])
+            self.absorb, self.null, self.weakness = stats[19:22]
+            self.statuses = list(stats[22:26])
+            self.special = stats[26]
 
-            infile_rom_buffer.seek(self.pointer + 20)
-            self.immunities = list(infile_rom_buffer.read(3))
-            self.absorb = ord(infile_rom_buffer.read(1))
-            self.null = ord(infile_rom_buffer.read(1))
-            self.weakness = ord(infile_rom_buffer.read(1))
-
-            infile_rom_buffer.seek(self.attackanimationptr)
-            self.attackanimation = ord(infile_rom_buffer.read(1))
-
-            infile_rom_buffer.seek(self.battleanimationptr)
-            self.battleanimation = ord(infile_rom_buffer.read(1))
-
-            infile_rom_buffer.seek(self.pointer + 27)
-            self.statuses = list(infile_rom_buffer.read(4))
-            self.special = ord(infile_rom_buffer.read(1))
+            self.attackanimation = read_struct(infile_rom_buffer, 'B', self.attackanimationptr)[0]
+            self.battleanimation = read_struct(infile_rom_buffer, 'B', self.battleanimationptr)[0]
 
             infile_rom_buffer.seek(self.itemptr)
             self.items = list(infile_rom_buffer.read(4))
@@ -721,8 +707,8 @@ class MonsterBlock:
             infile_rom_buffer.seek(self.aiptr)
             self.ai = read_multi(infile_rom_buffer, length=2)
 
-            if all_spells is None:
-                all_spells = get_ranked_spells(infile_rom_buffer)
+            if context.all_spells is None:
+                context.all_spells = get_ranked_spells(infile_rom_buffer)
 
             self.read_ai(infile_rom_buffer)
         except Exception as e:
@@ -742,7 +728,7 @@ class MonsterBlock:
                 skillset.add(action[0])
 
         if not ids_only:
-            skillset = [s for s in all_spells if s.spellid in skillset]
+            skillset = [s for s in get_context().all_spells if s.spellid in skillset]
         return skillset
 
     def get_lores(self):
@@ -791,6 +777,7 @@ class MonsterBlock:
                         banned.extend([0xB5, 0xB8, 0xBA])
                         break
 
+        all_spells = get_context().all_spells
         oldskills = sorted([s for s in all_spells if s.spellid in skillset],
                            key=lambda s: s.rank())
         if change_skillset:
@@ -1462,7 +1449,7 @@ class MonsterBlock:
 
     def get_xp_appropriate(self):
         rank = self.level_rank()
-        temp = [b for (a, b) in xps if a >= self.stats['level'] and b > 0]
+        temp = [b for (a, b) in get_context().monster_xps if a >= self.stats['level'] and b > 0]
         temp.sort()
         index = int(len(temp) * rank)
         index = mutate_index(index, len(temp),
@@ -1473,7 +1460,7 @@ class MonsterBlock:
 
     def get_gp_appropriate(self):
         rank = self.level_rank()
-        temp = [b for (a, b) in xps if a >= self.stats['level'] and b > 0]
+        temp = [b for (a, b) in get_context().monster_xps if a >= self.stats['level'] and b > 0]
         temp.sort()
         index = int(len(temp) * rank)
         index = mutate_index(index, len(temp),
@@ -1763,7 +1750,8 @@ class MonsterBlock:
             self.rages = type(other.rages)(other.rages)
 
     def rank(self, weights=None):
-        global globalweights
+        context = get_context()
+        avgs = context.monster_rank_averages
         funcs = {}
         funcs['level'] = lambda m: m.stats['level']
         funcs['hp'] = lambda m: m.stats['hp']
@@ -1782,9 +1770,9 @@ class MonsterBlock:
                 avgs[key] = (sum(funcs[key](m) for m in monsters) / float(len(monsters)))
 
         if weights is None:
-            if globalweights is None:
-                globalweights = {k: _randomweight(k) for k in avgs}
-            weights = globalweights
+            if context.monster_rank_weights is None:
+                context.monster_rank_weights = {k: _randomweight(k) for k in avgs}
+            weights = context.monster_rank_weights
         elif isinstance(weights, int):
             weights = {k: 50 for k in avgs}
 
@@ -1834,22 +1822,46 @@ def monsters_from_table(tablefile):
     return monsters
 
 
+def read_monsters(infile_rom_buffer: BytesIO):
+    monsters = monsters_from_table(ENEMY_TABLE)
+    for monster in monsters:
+        monster.read_stats(infile_rom_buffer)
+
+    for id, monster in enumerate(monsters):
+        mg = MonsterGraphicBlock(pointer=0x127000 + (5 * id), name=monster.name)
+        mg.read_data(infile_rom_buffer)
+        monster.set_graphics(graphics=mg)
+
+    return monsters
+
+
+def register_snapshot_monsters(monsters, infile_rom_buffer: BytesIO = None):
+    # Repeat the bookkeeping that read_monsters() does as a side effect
+    context = get_context()
+    for monster in monsters:
+        monster.set_id(monster.id)
+        if monster.stats['xp'] > 0:
+            context.monster_xps.append((monster.oldlevel, monster.stats['xp']))
+        if monster.stats['gp'] > 0:
+            context.monster_gps.append((monster.oldlevel, monster.stats['gp']))
+    for monster in monsters:
+        monster.graphics.register_palette()
+    if context.all_spells is None:
+        context.all_spells = get_ranked_spells(infile_rom_buffer)
+
+
 def get_monsters(infile_rom_buffer: BytesIO=None):
     try:
+        monsterdict = get_context().monsterdict
         if monsterdict:
             return sorted(list(monsterdict.values()), key=lambda m: m.id)
 
         get_ranked_items(infile_rom_buffer)
-        monsters = monsters_from_table(ENEMY_TABLE)
-        for monster in monsters:
-            monster.read_stats(infile_rom_buffer)
-
-        mgs = []
-        for id, monster in enumerate(monsters):
-            mg = MonsterGraphicBlock(pointer=0x127000 + (5 * id), name=monster.name)
-            mg.read_data(infile_rom_buffer)
-            monster.set_graphics(graphics=mg)
-            mgs.append(mg)
+        monsters = romsnapshot.restore('monsters')
+        if monsters is None:
+            monsters = read_monsters(infile_rom_buffer)
+        else:
+            register_snapshot_monsters(monsters, infile_rom_buffer)
 
         return monsters
     except Exception as e:
@@ -1857,7 +1869,7 @@ def get_monsters(infile_rom_buffer: BytesIO=None):
 
 
 def get_monster(monster_id):
-    return monsterdict[monster_id]
+    return get_context().monsterdict[monster_id]
 
 
 def get_ranked_monsters(infile_rom_buffer: BytesIO = None, bosses=True):
@@ -1930,8 +1942,6 @@ def shuffle_monsters(monsters, safe_solo_terra=True):
                 m.swap_ai(n)
 
 
-palette_pools = {}
-
 
 class MonsterGraphicBlock:
     def __init__(self, pointer, name=None):
@@ -1947,7 +1957,6 @@ class MonsterGraphicBlock:
         self.palette_values = []
 
     def read_data(self, infile_rom_buffer: BytesIO):
-        global palette_pools
         infile_rom_buffer.seek(self.pointer)
         self.graphics = read_multi(infile_rom_buffer, length=2)
         infile_rom_buffer.seek(self.pointer + 2)
@@ -1958,11 +1967,7 @@ class MonsterGraphicBlock:
         infile_rom_buffer.seek(self.pointer + 4)
         self.size_template = ord(infile_rom_buffer.read(1))
 
-        infile_rom_buffer.seek(self.palette_pointer)
-        numcolors = 0x20
-
-        for i in range(numcolors):
-            color = read_multi(infile_rom_buffer, length=2)
+        for color in read_struct(infile_rom_buffer, MONSTER_PALETTE_STRUCT, self.palette_pointer):
             blue = (color & 0x7c00) >> 10
             green = (color & 0x03e0) >> 5
             red = color & 0x001f
@@ -1970,6 +1975,10 @@ class MonsterGraphicBlock:
             self.palette_values.append(int(round(sum([red, green, blue]) / 3.0)))
         self.palette_data = tuple(self.palette_data)
 
+        self.register_palette()
+
+    def register_palette(self):
+        palette_pools = get_context().palette_pools
         if self.graphics not in palette_pools:
             palette_pools[self.graphics] = set([])
         for p in palette_pools[self.graphics]:
@@ -2063,11 +2072,7 @@ class MetamorphBlock:
         return False
 
 
-def get_metamorphs(infile_rom_buffer: BytesIO = None):
-    global metamorphs
-    if metamorphs is not None:
-        return metamorphs
-
+def read_metamorphs(infile_rom_buffer: BytesIO):
     metamorphs = []
     for i in range(32):
         address = 0x47f40 + (i * 4)
@@ -2075,6 +2080,15 @@ def get_metamorphs(infile_rom_buffer: BytesIO = None):
         metamorph.read_data(infile_rom_buffer)
         metamorph.id = i
         metamorphs.append(metamorph)
+    return metamorphs
+
+
+def get_metamorphs(infile_rom_buffer: BytesIO = None):
+    context = get_context()
+    if context.metamorphs is not None:
+        return context.metamorphs
+
+    context.metamorphs = romsnapshot.load('metamorphs', read_metamorphs, infile_rom_buffer)
     return get_metamorphs()
 
 
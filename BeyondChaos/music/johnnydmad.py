@@ -22,7 +22,11 @@
 #   maintainers can easily see and pull from.
 
 import configparser
+import concurrent.futures
+import contextlib
+import io
 import os
+import random
 import re
 import sys
 import traceback
@@ -80,6 +84,33 @@ def print_progress_bar(cur, max):
 def generate_rom():
     pass
     
+# simulated seeds per pool_test job
+POOL_TEST_CHUNK_SIZE = 100
+# the ROM used by pool_test jobs, set once per worker process
+worker_rom = None
+
+def init_worker(inrom):
+    global worker_rom
+    worker_rom = inrom
+
+def run_jobs(function, tasks, jobs=1, initializer=None, initargs=()):
+    #yields function(*task) for each task, in the order of tasks
+    #with jobs > 1 the tasks are shared out across that many processes
+    if jobs is None or jobs <= 1:
+        if initializer:
+            initializer(*initargs)
+        for task in tasks:
+            yield function(*task)
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=initializer, initargs=initargs) as executor:
+        futures = [executor.submit(function, *task) for task in tasks]
+        try:
+            for future in futures:
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+    
 def johnnydmad(args):
     print("johnnydmad EX5 test console")
 
@@ -90,6 +121,7 @@ def johnnydmad(args):
     playlist = args.playlist
     spoiler_outfile = args.spoiler_output_file
     freespace = args.free_space.split(",")
+    jobs = args.jobs
     try:
         print(f"Using {infile} as source")
         with open(infile, "rb") as f:
@@ -136,6 +168,7 @@ def johnnydmad(args):
             
     kw = {}
     kw["playlist_filename"] = playlist
+    kw["jobs"] = jobs
 
     def print_playlist(playlist_name):
         print(f"Playlist file is set to {playlist_name}")
@@ -201,18 +234,33 @@ def tierboss_test(test_song, playlist_filename=None, **kwargs):
         elif i:
             test_song = i.strip()
     
-def pool_test(inrom, battle_only=False, playlist_filename=None, **kwargs):
+def pool_test_chunk(seeds, playlist_filename=None):
+    tracklists = []
+    for seed in seeds:
+        random.seed(seed)
+        tracklists.append(process_music(worker_rom, pool_test=True, playlist_filename=playlist_filename))
+    return tracklists
+    
+def pool_test(inrom, battle_only=False, playlist_filename=None, jobs=1, **kwargs):
     results = {}
     iterations = 10000
     
+    # Each simulated seed sets its own rng seed, so the results don't depend on
+    # how the seeds are split between jobs
+    base_seed = random.randrange(1 << 32)
+    chunks = [(range(base_seed + i, base_seed + min(i + POOL_TEST_CHUNK_SIZE, iterations)), playlist_filename)
+              for i in range(0, iterations, POOL_TEST_CHUNK_SIZE)]
+    
     print()
-    for i in range(iterations):
-        tracklist = process_music(inrom, pool_test=True, playlist_filename=playlist_filename)
-        for track, song in tracklist.items():
-            if track not in results:
-                results[track] = []
-            results[track].append(song)
-        print_progress_bar(i, iterations)
+    i = 0
+    for tracklists in run_jobs(pool_test_chunk, chunks, jobs, initializer=init_worker, initargs=(inrom,)):
+        for tracklist in tracklists:
+            for track, song in tracklist.items():
+                if track not in results:
+                    results[track] = []
+                results[track].append(song)
+            print_progress_bar(i, iterations)
+            i += 1
     print()
     
     if battle_only:
@@ -235,27 +283,22 @@ def pool_test(inrom, battle_only=False, playlist_filename=None, **kwargs):
             pct = (reps / iterations) * 100
             print(f"    {pct:04.1f}% {song:<{songlen}} ({reps} / {iterations})")
         
-def mass_test(sort, playlist_filename=None, **kwargs):
-    global used_song_names
+def mass_test_song(song, sort, capture_output=False):
     testbed = [
         ("***", "plain", 0x4C, False),
         ("rain", "zozo", 0x29, True),
         ("wind", "ruin", 0x4F, True),
         ("train", "train", 0x20, False)
         ]
-    #cursor = " >)|(<"
-    playlist_map, _ = init_playlist(playlist_filename)
-    results = []
-    legacy_files = set()
-    jukebox_titles = {}
-    song_warnings = {}
-    i = 0
-    print("")
-    for song in sorted(playlist_map):
+    #messages printed while checking a song in a worker process are returned
+    #with the result, so they come out in the same order as with one process
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output) if capture_output else contextlib.nullcontext():
         binsizes = {}
         memusage = 0
-        debugtext = f"{song}: "
-        song_warnings[song] = set()
+        is_legacy = False
+        jukebox_title = None
+        song_warnings = set()
         for type, trackname, idx, use_sfx in testbed:
             tl = Tracklist()
             tl.add_random(trackname, [song], idx=idx, allow_duplicates=True)
@@ -265,32 +308,50 @@ def mass_test(sort, playlist_filename=None, **kwargs):
                 
             mml = tl[trackname].mml
             if tl[trackname].is_legacy:
-                legacy_files.add(song)
+                is_legacy = True
                 iset = mml_to_akao(mml, variant=variant, inst_only=True)
                 mml = append_legacy_imports(mml, iset, raw_inst=True)
             mml = apply_variant(mml, type, trackname, variant=variant)
             bin = mml_to_akao(mml, song + ' ' + trackname, sfxmode=use_sfx, variant=variant)[0]
             binsizes[type] = len(bin)
             
-            if song not in jukebox_titles:
-                jukebox_titles[song] = get_jukebox_title(mml, song)
+            if jukebox_title is None:
+                jukebox_title = get_jukebox_title(mml, song)
             var_memusage = get_spc_memory_usage(mml, variant=variant, custompath=os.path.dirname(tl[trackname].file))
-            debugtext += f"({var_memusage}) "
             memusage = max(memusage, var_memusage)
             
             if memusage > 3746:
-                song_warnings[song].add("BRR memory overflow")
+                song_warnings.add("BRR memory overflow")
             if len(bin) > 0x1002:
-                song_warnings[song].add("Sequence memory overflow")
+                song_warnings.add("Sequence memory overflow")
             if "%f0" not in mml:
                 if re.search("%[Ff][0-9]", mml) is None:
-                    song_warnings[song].add("Echo FIR unset (%f)")
+                    song_warnings.add("Echo FIR unset (%f)")
             if "%b" not in mml:
-                song_warnings[song].add("Echo feedback unset (%b)")
+                song_warnings.add("Echo feedback unset (%b)")
             if "%v" not in mml:
-                song_warnings[song].add("Echo volume unset (%v)")
+                song_warnings.add("Echo volume unset (%v)")
         order = memusage if sort == "mem" else max(binsizes.values())
-        results.append((order, song, binsizes, memusage))
+    return (order, song, binsizes, memusage), is_legacy, jukebox_title, song_warnings, output.getvalue()
+        
+def mass_test(sort, playlist_filename=None, jobs=1, **kwargs):
+    global used_song_names
+    playlist_map, _ = init_playlist(playlist_filename)
+    results = []
+    legacy_files = set()
+    jukebox_titles = {}
+    song_warnings = {}
+    i = 0
+    print("")
+    tasks = [(song, sort, jobs is not None and jobs > 1) for song in sorted(playlist_map)]
+    for result, is_legacy, jukebox_title, warnings, output in run_jobs(mass_test_song, tasks, jobs):
+        song = result[1]
+        print(output, end="")
+        if is_legacy:
+            legacy_files.add(song)
+        jukebox_titles[song] = jukebox_title
+        song_warnings[song] = warnings
+        results.append(result)
         print_progress_bar(i, len(playlist_map))
         i += 1
         
@@ -344,12 +405,16 @@ if __name__ == "__main__":
                             dest="prompt_user",
                             help="Automatically run johnnydmad against the specified arguments. Uses set of defaults if none are set.")
 
+    parser.add_argument('-j', '--jobs', type=int,
+                            help="Number of processes used by the song checks and seed simulations")
+
     parser.add_argument('-mp', '--music-player', action='store_true', help="Add a music player to the in-game menu")
     parser.add_argument('-nmp', '--no-music-player', dest='music_player', action='store_false', help = "Do not add the music player to the in-game menu")
 
     parser.set_defaults(
         free_space="53C5F-9FDFF,310000-37FFFF,410000-4FFFFF", 
         input_file="ff6.smc",
+        jobs=1,
         music_player=True, 
         output_file="mytest.smc",
         playlist = "default.txt",
@@ -379,12 +379,17 @@ def to_rom_address(addr):
     return addr
     
 def byte_insert(data, position, newdata, maxlength=0, end=0):
+    #a bytearray is written in place and returned, so that inserting
+    #into a whole ROM doesn't copy it; bytes are copied as before
     while position > len(data):
         data += (b"\x00" * (position - len(data)))
     if end:
         maxlength = end - position + 1
     if maxlength and len(newdata) > maxlength:
         newdata = newdata[:maxlength]
+    if isinstance(data, bytearray):
+        data[position:position + len(newdata)] = newdata
+        return data
     return data[:position] + newdata + data[position + len(newdata):]
 
 def int_insert(data, position, newdata, length, reversed=True):
@@ -1213,7 +1218,7 @@ def insertmfvi(inrom, argparam=None, virt_sample_list=None, virt_seq_list=None,
             warning(f"ROM mapping mode changed to ExHIROM")
     if len(outrom) != len(inrom):
         inform(f"ROM file size is now 0x{len(outrom):06X} bytes")
-    outrom = romheader + outrom
+    outrom[0:0] = romheader
     
     return outrom
     
@@ -26,7 +26,7 @@
 #   submitting changes or through creating a fork that other mfvitools
 #   maintainers can easily see and pull from.
 
-import sys, os, re, traceback, copy, math
+import sys, os, re, traceback, copy, math, collections, hashlib
 try:
     from mmltbl import *
 except ImportError:
@@ -301,7 +301,35 @@ def parse_brr_env(envtext):
         print(f"PARSEBRRINFO: bad adsr data formatting ({envtext}), defaulting to a15d7s7r0")
     return byteenv
     
+# Results of mml_to_akao, most recently used last, keyed by a hash of the MML
+# and the options that change the output. The same song is usually compiled
+# several times per seed (instruments only, then in full, for each track).
+AKAO_CACHE_SIZE = 256
+akao_cache = collections.OrderedDict()
+
+def get_akao_cache_key(mml, sfxmode, variant, inst_only):
+    if isinstance(mml, str):
+        text = "S" + mml
+    else:
+        text = "L" + "\n".join(mml)
+    options = f"{bool(sfxmode)}|{variant}|{bool(inst_only)}|"
+    return hashlib.sha256((options + text).encode("utf-8", "surrogatepass")).hexdigest()
+
 def mml_to_akao(mml, fileid='mml', sfxmode=False, variant=None, inst_only=False):
+    #cached front end for mml_to_akao_uncached
+    #warnings are only printed the first time a song is compiled
+    key = get_akao_cache_key(mml, sfxmode, variant, inst_only)
+    result = akao_cache.get(key)
+    if result is None:
+        result = mml_to_akao_uncached(mml, fileid, sfxmode, variant, inst_only)
+    akao_cache[key] = result
+    akao_cache.move_to_end(key)
+    while len(akao_cache) > AKAO_CACHE_SIZE:
+        akao_cache.popitem(last=False)
+    #callers may change the dict of variants, but never the bytes in it
+    return dict(result) if isinstance(result, dict) else result
+
+def mml_to_akao_uncached(mml, fileid='mml', sfxmode=False, variant=None, inst_only=False):
     #preprocessor
     #returns dict of (data, inst) tuples (4096, 32 bytes max)
     #one generated for each #VARIANT directive
@@ -458,15 +486,15 @@ def mml_to_akao_main(mml, ignore='', fileid='mml'):
             if tweaks:
                 # "o,,": ("+", ",1,")
                 skip = ignore + "\"'{"
-                sq = list(s)
+                sq = collections.deque(s)
                 sr = ""
                 while sq:
-                    c = sq.pop(0)
+                    c = sq.popleft()
                     if c in skip:
                         endat = "}" if c=="{" else c
-                        if sq: c += sq.pop(0)
+                        if sq: c += sq.popleft()
                         while sq:
-                            cc = sq.pop(0)
+                            cc = sq.popleft()
                             if cc == endat:
                                 if endat == "'": c += tweak_text
                                 c += cc
@@ -475,10 +503,10 @@ def mml_to_akao_main(mml, ignore='', fileid='mml'):
                         sr += c
                         continue
                     if sq and c == "%":
-                        c += sq.pop(0)
+                        c += sq.popleft()
                     d = ""
                     while sq and sq[0] in "1234567890,.+-x":
-                        d += sq.pop(0)
+                        d += sq.popleft()
                     cmd = c + ''.join([ch for ch in d if ch == ','])
                     if d and (cmd in tweaks):
                         d = d.split(',')
@@ -546,7 +574,7 @@ def mml_to_akao_main(mml, ignore='', fileid='mml'):
     for i, line in enumerate(mml):
         mml[i] = line.split('#')[0].lower()
             
-    m = list(" ".join(mml))
+    m = collections.deque(" ".join(mml))
     targets, channels, pendingjumps = {}, {}, {}
     data = b"\x00" * 0x26
     defaultlength = 8
@@ -556,16 +584,16 @@ def mml_to_akao_main(mml, ignore='', fileid='mml'):
     jumpout = []
     
     while len(m):
-        command = m.pop(0)
+        command = m.popleft()
                         
         #single character macros
         if command in cdefs:
             repl = list(cdefs[command] + " ")
-            m = repl + m
+            m.extendleft(reversed(repl))
         #conditionally executed statements
         if command in ignore:
             while len(m):
-                next = m.pop(0)
+                next = m.popleft()
                 if next == command:
                     break
             continue
@@ -574,7 +602,7 @@ def mml_to_akao_main(mml, ignore='', fileid='mml'):
             thisnumber = ""    
             numbers = []
             while len(m):
-                command += m.pop(0)
+                command += m.popleft()
                 if command[-1] in "1234567890":
                     thisnumber += command[-1]
                 elif thisnumber:
@@ -587,55 +615,55 @@ def mml_to_akao_main(mml, ignore='', fileid='mml'):
             continue
         #drum mode
         elif command in drums:
-            mls, dms = [], []
+            mls, dms = [], collections.deque()
             drumset = drums[command]
             while len(m):
                 if m[0] != command:
-                    dms.append(m.pop(0))
+                    dms.append(m.popleft())
                 else:
-                    m.pop(0)
+                    m.popleft()
                     break
             dbgdms = "".join(dms)
             lockstate = False
             silent = False
             if len(dms):
                 if dms[0] in "1234567890":
-                    state["o0"] = dms.pop(0)
+                    state["o0"] = dms.popleft()
                 elif dms[0] == ">":
-                    co = dms.pop(0)
+                    co = dms.popleft()
                     while dms[0] == ">":
-                        co += dms.pop(0)
+                        co += dms.popleft()
                     if "o0" in state:
                         state["o0"] += len(co)
                 elif dms[0] == "<":
-                    co = dms.pop(0)
+                    co = dms.popleft()
                     while dms[0] == "<":
-                        co += dms.pop(0)
+                        co += dms.popleft()
                     if "o0" in state:
                         state["o0"] -= len(co)
             while len(dms):
                 if "m0,0" in state:
                     state.pop("m0,0", None)
-                dcom = dms.pop(0)
+                dcom = dms.popleft()
                 if len(dms):
                     if dms[0] in "+-":
-                        dcom += dms.pop(0)
+                        dcom += dms.popleft()
                 if dcom == "\\":
                     lockstate = True if not lockstate else False
                 elif dcom == ":":
                     silent = True if not silent else False
                 elif dcom == "!":
-                    rcom = dms.pop(0)
+                    rcom = dms.popleft()
                     if rcom == "!":
                         if "o0" in state:
                             state = {"o0": state["o0"]}
                         else:
                             state = {}
                         continue
-                    if rcom == "%": rcom += dms.pop(0)
+                    if rcom == "%": rcom += dms.popleft()
                     while len(dms):
                         if dms[0] in "0,":
-                            rcom += dms.pop(0)
+                            rcom += dms.popleft()
                         else: break
                     if rcom in equiv_tbl:
                         rcom = equiv_tbl[rcom]
@@ -688,16 +716,15 @@ def mml_to_akao_main(mml, ignore='', fileid='mml'):
                     s += drumset[dcom].note
                     if not silent: mls.extend(list(s))
             mlog("drum: processed {} -> {}".format(dbgdms, "".join(mls)))
-            mls.extend(m)
-            m = mls
+            m.extendleft(reversed(mls))
             continue
             
         #populate command variables
-        if command == "%": command += m.pop(0)
+        if command == "%": command += m.popleft()
         prefix = command
         if len(m):
             while m[0] in "1234567890,.+-x":
-                command += m.pop(0)
+                command += m.popleft()
                 if not len(m): break
         
         #catch @0x before parsing params
@@ -705,7 +732,7 @@ def mml_to_akao_main(mml, ignore='', fileid='mml'):
             command = "@0x2" + command[1:]
         if "@0x" in command:
             while len(command) < 5:
-                command += m.pop(0)
+                command += m.popleft()
             number = command[-2:]
             try:
                 number = int(number, 16)
@@ -21,8 +21,10 @@
 #   submitting changes or through creating a fork that other johnnydmad
 #   maintainers can easily see and pull from.
 
+import collections
 import configparser
 import copy
+import functools
 import os
 import random as pyrandom
 import re
@@ -134,6 +136,48 @@ def add_encoding_if_text(args, kwargs):
     if len(args) and 'b' not in args[0]:
         kwargs["encoding"] = "utf-8"
         
+# MML files read so far in this process, by absolute path:
+#   [mtime, size, text or None if unreadable, {sfxmode: variant list}]
+# An entry is used again until the file is changed, created or deleted.
+mml_file_cache = {}
+
+def get_mml_cache_entry(fn):
+    if not os.path.isabs(fn):
+        fn = asset_path(fn)
+    try:
+        st = os.stat(fn)
+        stamp = (st.st_mtime_ns, st.st_size)
+    except OSError:
+        stamp = (None, None)
+    entry = mml_file_cache.get(fn)
+    if entry is None or (entry[0], entry[1]) != stamp:
+        mml = None
+        if stamp[0] is not None:
+            try:
+                with open(fn, 'r', encoding="utf-8") as f:
+                    mml = f.read()
+            except IOError:
+                mml = None
+        entry = [stamp[0], stamp[1], mml, {}]
+        mml_file_cache[fn] = entry
+    return entry
+    
+def read_mml(fn):
+    # Returns the text of an MML file, read once per process. Raises IOError if it can't be read.
+    entry = get_mml_cache_entry(fn)
+    if entry[2] is None:
+        raise IOError(f"could not read {fn}")
+    return entry[2]
+    
+def load_mml(fn, sfxmode=False):
+    # Returns the text and variant list of an MML file, parsed once per process. Raises IOError if it can't be read.
+    entry = get_mml_cache_entry(fn)
+    if entry[2] is None:
+        raise IOError(f"could not read {fn}")
+    if sfxmode not in entry[3]:
+        entry[3][sfxmode] = get_variant_list(entry[2], sfxmode)
+    return entry[2], entry[3][sfxmode]
+        
 class PlaylistError(Exception):
     pass
     
@@ -215,9 +259,7 @@ class Tracklist:
                         mml, varlist = potential_files[file_to_check]
                     else:
                         try:
-                            with open_asset(os.path.join(searchpath, file_to_check + ".mml"), 'r') as mmlf:
-                                mml = mmlf.read()
-                            varlist = get_variant_list(mml, sfxmode)
+                            mml, varlist = load_mml(os.path.join(searchpath, file_to_check + ".mml"), sfxmode)
                             potential_files[file_to_check] = (mml, varlist)
                         except IOError:
                             potential_files[file_to_check] = ("", {})
@@ -258,6 +300,171 @@ class Tracklist:
         add_to_spoiler(name, tl=self)
         return True
                     
+class TracklistSolver:
+    # Chooses a song for every randomized track at once, so that a restrictive
+    # playlist either works on the first try or is reported as impossible.
+    # - tracks: track names, in the order their songs are chosen
+    # - pools: track name -> list of songs, repeated to weight the choice
+    # - chains: lists of track names whose song intensities may not decrease,
+    #   each paired with a dict of song name -> intensity
+    # No two tracks get songs with the same song_usage_id. Tracks are filled
+    # in order with random.choice, as before. After every choice, songs that
+    # can no longer be used are removed from the other tracks, and a matching
+    # of the remaining tracks to unused songs is kept up to date; when that
+    # matching breaks, the choice is undone and another song is tried.
+    # - rng: what the songs are drawn with, the module's generator by default
+    # - max_backtracks: how many choices may be undone before solve() gives up,
+    #   no limit by default
+    def __init__(self, tracks, pools, chains=[], rng=None, max_backtracks=None):
+        self.tracks = list(tracks)
+        self.rng = rng
+        self.max_backtracks = max_backtracks
+        self.backtracks = 0
+        self.chains = {}
+        for chain in chains:
+            order, intensities = chain
+            for i, track in enumerate(order):
+                self.chains[track] = (order, i, intensities)
+        # domains: track -> usage id -> song -> weight
+        self.domains = {}
+        # usage id -> tracks that can use it
+        self.usage_tracks = {}
+        for track in self.tracks:
+            domain = {}
+            for song, weight in collections.Counter(pools.get(track, [])).items():
+                usage = song_usage_id(song)
+                domain.setdefault(usage, {})[song] = weight
+                self.usage_tracks.setdefault(usage, set()).add(track)
+            self.domains[track] = domain
+        self.match_track = {}
+        self.match_usage = {}
+        self.assignment = {}
+        self.trail = []
+
+    def remove(self, track, usage, song=None):
+        domain = self.domains[track]
+        if usage not in domain:
+            return
+        if song is None:
+            self.trail.append((track, usage, domain.pop(usage)))
+        elif song in domain[usage]:
+            self.trail.append((track, usage, {song: domain[usage].pop(song)}))
+            if not domain[usage]:
+                del domain[usage]
+
+    def undo(self, mark):
+        while len(self.trail) > mark:
+            track, usage, songs = self.trail.pop()
+            self.domains[track].setdefault(usage, {}).update(songs)
+
+    def augment(self, track, visited):
+        for usage in self.domains[track]:
+            if usage in visited:
+                continue
+            visited.add(usage)
+            other = self.match_usage.get(usage)
+            if other is None or self.augment(other, visited):
+                self.match_usage[usage] = track
+                self.match_track[track] = usage
+                return True
+        return False
+
+    def unmatch(self, track):
+        usage = self.match_track.pop(track, None)
+        if usage is not None and self.match_usage.get(usage) == track:
+            del self.match_usage[usage]
+
+    def rematch(self, tracks):
+        # Matches every given track that is unmatched or lost its usage id.
+        # Returns the first that can't be matched, or None.
+        for track in tracks:
+            if track in self.assignment:
+                continue
+            if self.match_track.get(track) not in self.domains[track]:
+                self.unmatch(track)
+                if not self.augment(track, set()):
+                    return track
+        return None
+
+    def get_unmatchable_track(self):
+        # The first track that can't get a song of its own, or None
+        return self.rematch(self.tracks)
+
+    def choose(self, track, song):
+        usage = song_usage_id(song)
+        self.assignment[track] = song
+        self.unmatch(track)
+        changed = set()
+        for other in self.usage_tracks.get(usage, []):
+            if other not in self.assignment:
+                self.remove(other, usage)
+                changed.add(other)
+        if track in self.chains:
+            order, i, intensities = self.chains[track]
+            level = intensities[song]
+            for j, other in enumerate(order):
+                if other in self.assignment or other not in self.domains:
+                    continue
+                for other_usage, songs in list(self.domains[other].items()):
+                    for other_song in list(songs):
+                        other_level = intensities[other_song]
+                        if (j < i and other_level > level) or (j > i and other_level < level):
+                            self.remove(other, other_usage, other_song)
+                            changed.add(other)
+        return self.rematch(sorted(changed, key=self.tracks.index)) is None
+
+    def solve(self, index=0):
+        if index >= len(self.tracks):
+            return True
+        track = self.tracks[index]
+        mark = len(self.trail)
+        while self.domains[track]:
+            if self.max_backtracks is not None and self.backtracks >= self.max_backtracks:
+                break
+            pool = [song for songs in self.domains[track].values()
+                    for song, weight in songs.items() for _ in range(weight)]
+            song = (self.rng or random).choice(pool)
+            choice_mark = len(self.trail)
+            if self.choose(track, song) and self.solve(index + 1):
+                return True
+            # Undoing only adds songs back, so the matching can always be repaired
+            self.undo(choice_mark)
+            self.backtracks += 1
+            del self.assignment[track]
+            self.rematch(self.tracks[index:])
+            self.remove(track, song_usage_id(song), song)
+            if self.rematch([track]) is not None:
+                break
+        self.undo(mark)
+        self.rematch(self.tracks[index:])
+        return False
+
+def solve_tracklist(tracks, pools, chains, max_backtracks=1000):
+    # Chooses a song for every track, keeping the intensity chains in order
+    # where possible, and returns track name -> song. The chains are solved
+    # one after another, each with the songs of the chains before it already
+    # chosen, so a chain that can't be kept in order, by itself or next to
+    # the others, is ignored on its own. Each of these searches may undo at
+    # most max_backtracks choices, as the old retry loop was limited to 1000
+    # attempts. The tracks must all be matchable.
+    chosen = {}
+    for chain in chains:
+        order, intensities = chain
+        chain_pools = dict(pools)
+        chain_pools.update((track, [song]) for track, song in chosen.items())
+        solver = TracklistSolver(tracks, chain_pools, [chain], max_backtracks=max_backtracks)
+        if solver.get_unmatchable_track() is None and solver.solve():
+            chosen.update((track, solver.assignment[track]) for track in order)
+        else:
+            print(f"info: no song choices keep {order[0]} to {order[-1]} intensity in order, ignoring it")
+    pools = dict(pools)
+    pools.update((track, [song]) for track, song in chosen.items())
+    solver = TracklistSolver(tracks, pools)
+    solver.get_unmatchable_track()
+    solver.solve()
+    return solver.assignment
+
+@functools.lru_cache(maxsize=None)
 def song_usage_id(name):
     name = os.path.splitext(os.path.basename(name))[0]
     if name.count("_") <= 1:
@@ -528,8 +735,7 @@ def generate_tierboss_mml(pool, force_include=None):
             
             self.file = os.path.join(TIERBOSS_MUSIC_PATH, name + ".mml")
             try:
-                with open_fallback(self.file, "r") as f:
-                    self.mml = f.read()
+                self.mml = read_mml(fallback_path(self.file))
             except OSError:
                 print(f"tierboss_mml: couldn't load {self.file}")
                 self.mml = ""
@@ -858,7 +1064,7 @@ def process_music(inrom, meta={}, f_chaos=False, f_battle=True, opera=None, even
         if "battle" in song_categories:
             intensitytable["battle"][song[0]] = epic
     
-    # -- retry loop
+    # -- retry loop, for missing song files and failed insertion
     processing_complete = False
     attempts = 0
     while not processing_complete:
@@ -895,48 +1101,66 @@ def process_music(inrom, meta={}, f_chaos=False, f_battle=True, opera=None, even
         progression = {}
         progression['battle'] = ["battle", "bat2", "bat3", "bat4"]
         progression['boss'] = ["mboss", "boss", "atma", "dmad5"]
+        
+        # -- choose songs for all randomized tracks at once
+        # progressions are chosen first, in the order lowest, highest, then the middle tiers
+        random_tracks = []
+        chains = []
+        for cat, order in progression.items():
+            if all(track in track_pools for track in order):
+                random_tracks.extend(order[i] for i in (0, 3, 1, 2))
+                chains.append((order, intensitytable[cat]))
+        # songs already used by tierboss are ruled out everywhere
+        track_choices = {track: [s for s in track_pools[track] if song_usage_id(s) not in used_song_names]
+                         for track in random_tracks}
+        # fixed tracks rule out songs of the same name, but only for tracks added after them
+        unavailable = set(used_song_names)
+        for category, tracks in sorted(category_tracks.items()):
+            if category == "fixed":
+                unavailable.update(song_usage_id(track) for track in tracks)
+                continue
+            elif category in ["opera", "tierboss", "ext"]:
+                continue
+            elif category == "default":
+                tracks = tracks + category_tracks["ext"]
+            if tracks: #make deterministic based on seed, don't let any undefined order (from dict) sneak in
+                tracks = sorted(tracks)
+                random.shuffle(tracks)
+            for track in tracks:
+                if track in track_choices:
+                    continue
+                random_tracks.append(track)
+                track_choices[track] = [s for s in track_pools.get(track, []) if song_usage_id(s) not in unavailable]
+        
+        solver = TracklistSolver(random_tracks, track_choices, chains)
+        unmatchable = solver.get_unmatchable_track()
+        if unmatchable is not None:
+            print(f"Music randomization failed: not enough songs left for track {unmatchable}. Your custom music configuration files and/or filters may be too restrictive.")
+            if enable_exceptions:
+                raise PlaylistError(f"Music randomization failed: not enough songs left for track {unmatchable}.")
+            return inrom
+        track_choices = solve_tracklist(random_tracks, track_choices, chains)
+        
+        # -- add chosen songs to tracklist
+        # a song whose file can't be found is removed from that track's pool before retrying
+        def add_chosen(track):
+            ok = tracklist.add_random(track, [track_choices[track]])
+            if not ok:
+                track_pools[track] = [s for s in track_pools[track] if s != track_choices[track]]
+            return ok
         already_added = set()
         for cat, order in progression.items():
-            prog_attempts = 0
-            while prog_attempts < 1000:
-                prog_choices = {}
-                prog_level = 0
-                prog_max = 100
-                temp_used_song_names = copy.copy(used_song_names)
-                for i in (0, 3, 1, 2):
-                    track = order[i]
-                    # get song options for tier (exclude by used and under level)
-                    if track not in track_pools:
-                        prog_attempts = 1000
+            for track in order:
+                if track in track_choices:
+                    if not add_chosen(track):
+                        processing_failed = True
                         break
-                    track_pool = [s for s in track_pools[track] if song_usage_id(s) not in temp_used_song_names and intensitytable[cat][s] >= prog_level and intensitytable[cat][s] <= prog_max]
-                    # choose one; if no options retry
-                    if not track_pool:
-                        prog_attempts += 1
-                        continue
-                    choice = random.choice(track_pool)
-                    if i == 3:
-                        prog_max = intensitytable[cat][choice]
-                    else:
-                        prog_level = intensitytable[cat][choice]
-                    prog_choices[i] = (choice)
-                    temp_used_song_names.add(song_usage_id(choice))
-                    # print(f"prog: {track} - chose {choice} at intensity {prog_level} from pool {track_pool}")
-                if len(prog_choices) == len(order):
-                    break
-            # add to tracklist
-            for i, choice in prog_choices.items():
-                ok = tracklist.add_random(progression[cat][i], [choice])
-                if not ok:
-                    processing_failed = True
-                    break
-                already_added.add(progression[cat][i])
+                    already_added.add(track)
             if processing_failed:
                 break
         if processing_failed: 
             continue
         
-        # -- choose tracklist
         for category, tracks in sorted(category_tracks.items()):
             # fixed category - does not randomize, loads from static_music/ only
             if category == "fixed":
@@ -963,18 +1187,15 @@ def process_music(inrom, meta={}, f_chaos=False, f_battle=True, opera=None, even
                 continue
             elif category == "default":
                 tracks = tracks + category_tracks["ext"]
-            if tracks: #make deterministic based on seed, don't let any undefined order (from dict) sneak in
-                tracks = sorted(tracks)
-                random.shuffle(tracks)
-            for track in tracks:
+            for track in sorted(tracks):
                 if track in already_added:
                     continue
-                if track not in track_pools:
-                    track_pools[track] = []
-                ok = tracklist.add_random(track, track_pools[track])
-                if not ok:
+                if not add_chosen(track):
                     processing_failed = True
                     break
+                already_added.add(track)
+            if processing_failed:
+                break
         if processing_failed: 
             continue
             
@@ -9,6 +9,7 @@ import string
 #import pathlib
 
 from locationrandomizer import get_locations, get_location
+from randomizercontext import get_context
 from dialoguemanager import set_dialogue_var, set_pronoun, patch_dialogue, load_patch_file
 from utils import utilrandom as random, open_mei_fallback as open, custom_path as BC_CUSTOM_PATH
 
@@ -16,17 +17,50 @@ from music.jukebox import add_music_player
 from music.musicrandomizer import process_music, process_formation_music_by_table, process_map_music, get_legacy_import, \
     get_spc_memory_usage, get_music_spoiler as get_spoiler, initialize as johnnydmad_initialize, PlaylistError
 
+import music.mfvitools.insertmfvi
 from music.mfvitools.insertmfvi import byte_insert, bytes_to_int
 
 BC_MUSIC_FREESPACE = ["53C5F-9FDFF", "310000-37FFFF", "410000-4FFFFF"]
 
-opera_log = ""
-
 
 def music_init():
     johnnydmad_initialize(rng=random)
 
 
+def get_music_freespace():
+    """
+    Frees the areas set aside for music in the run's free space, then returns what is still free there
+    in the "start-end" form that insertmfvi takes.
+    """
+    free_space = get_context().free_space
+    freespace = []
+    for area in BC_MUSIC_FREESPACE:
+        area_start, area_end = [int(address, 16) for address in area.split('-')]
+        # The areas include their last byte
+        area_end += 1
+        free_space.free(area_start, area_end)
+        for start, end in free_space.get_free_ranges():
+            start, end = max(start, area_start), min(end, area_end)
+            if start < end:
+                freespace.append((start, end))
+    return freespace
+
+
+def claim_music_freespace(freespace):
+    """
+    Claims the parts of freespace that insertmfvi wrote music data to, so that nothing else is put there.
+    """
+    free_space = get_context().free_space
+    left_over = sorted(music.mfvitools.insertmfvi.freespace or [])
+    for start, end in freespace:
+        for left_start, left_end in left_over:
+            if left_end <= start or left_start >= end:
+                continue
+            free_space.claim(start, max(start, left_start), 'randomize_music')
+            start = max(start, left_end)
+        free_space.claim(start, end, 'randomize_music')
+
+
 def randomize_music(fout, Options_, playlist_path, playlist_filename, virtual_playlist=None, opera=None, form_music_overrides={}, ):
     events = ""
     if Options_.is_flag_active('christmas'):
@@ -38,8 +72,10 @@ def randomize_music(fout, Options_, playlist_path, playlist_filename, virtual_pl
     kan_mode = Options_.mode.name == 'katn'
 
     fout.seek(0)
-    data = fout.read()
+    data = bytearray(fout.read())
     metadata = {}
+    freespace = get_music_freespace()
+    insertmfvi_freespace = [f'{start:X}-{end:X}' for start, end in freespace]
     
     # Like beyondchaos, johnnydmad uses relative paths for external files when
     # _MEIPASS is set (pyinstaller) and absolute paths otherwise. However, 
@@ -72,7 +108,7 @@ def randomize_music(fout, Options_, playlist_path, playlist_filename, virtual_pl
         if not playlist_fileid:
             raise PlaylistError("Failed to load custom file")
         data = process_music(data, metadata, f_chaos=f_chaos, eventmodes=events, opera=opera, subpath=subpath,
-                             freespace=BC_MUSIC_FREESPACE, ext_rng=random,
+                             freespace=insertmfvi_freespace, ext_rng=random,
                              playlist_filename=playlist_fileid,
                              virtual_playlist=virtual_playlist, enable_exceptions=True)
     except PlaylistError:
@@ -81,7 +117,8 @@ def randomize_music(fout, Options_, playlist_path, playlist_filename, virtual_pl
         # playlist (music/default.txt) which will usually not be modified
         print("Custom playlist failed, falling back to default.")
         data = process_music(data, metadata, f_chaos=f_chaos, eventmodes=events, opera=opera, subpath=subpath,
-                             freespace=BC_MUSIC_FREESPACE, ext_rng=random)
+                             freespace=insertmfvi_freespace, ext_rng=random)
+    claim_music_freespace(freespace)
     if not Options_.is_any_flag_active(['ancientcave', 'speedcave', 'racecave']):
         data = process_map_music(data)
     data = process_formation_music_by_table(data, form_music_overrides=form_music_overrides, kan_mode=kan_mode)
@@ -100,11 +137,11 @@ def get_music_spoiler(*a, **kw):
 
 def manage_opera(fout, affect_music):
     fout.seek(0)
-    data = fout.read()
+    data = bytearray(fout.read())
 
     SAMPLE_MAX_SIZE = 3746
 
-    global opera_log
+    context = get_context()
 
     # Determine opera cast
 
@@ -192,11 +229,11 @@ def manage_opera(fout, affect_music):
         random.shuffle(charpool)
         for c in ["Maria", "Draco", "Ralse"]:
             char[c] = charpool.pop()
-            opera_log += str(str(c) + ": ").ljust(17) + string.capwords(str(char[c].name)) + "\n"
+            context.opera_log += str(str(c) + ": ").ljust(17) + string.capwords(str(char[c].name)) + "\n"
         # by sprite/name, for impresario
         charpool = [c for c in singer_options if c not in char.values()]
         char["Impresario"] = random.choice(charpool)
-        opera_log += str("Impresario: ").ljust(17) + string.capwords(str(char["Impresario"].name)) + "\n"
+        context.opera_log += str("Impresario: ").ljust(17) + string.capwords(str(char["Impresario"].name)) + "\n"
     else:
         print("\nalasdraco -- note: opera voices will not be changed unless a" +
               " random music code (johnnydmad/johnnyachaotic) is also used." +
@@ -205,7 +242,7 @@ def manage_opera(fout, affect_music):
         char = {}
         for c in ["Maria", "Draco", "Ralse", "Impresario"]:
             char[c] = cchoices.pop()
-            opera_log += str(str(c) + ": ").ljust(17) + string.capwords(str(char[c].name)) + "\n"
+            context.opera_log += str(str(c) + ": ").ljust(17) + string.capwords(str(char[c].name)) + "\n"
 
     # reassign sprites in npc data
     locations = get_locations()
@@ -274,7 +311,7 @@ def manage_opera(fout, affect_music):
             npc.palette = random.choice(range(6))
             npc.facing = item[1]
             set_dialogue_var("OperaItem", item[2])
-            opera_log += str("Opera Flowers: ").ljust(17) + string.capwords(item[2]) + "\n"
+            context.opera_log += str("Opera Flowers: ").ljust(17) + string.capwords(item[2]) + "\n"
             # print(f"opera item is {npc.graphics}, palette {npc.palette} ({item[2]})")
             # print(f"at address {npc.pointer:X}")
     # 4 ton weight
@@ -294,7 +331,7 @@ def manage_opera(fout, affect_music):
             npc.graphics = item[0]
             npc.palette = random.choice(range(6))
             npc.facing = item[1]
-            opera_log += str("Opera Rafters: ").ljust(17) + string.capwords(item[2]) + "\n"
+            context.opera_log += str("Opera Rafters: ").ljust(17) + string.capwords(item[2]) + "\n"
             # print(f"ultros item is {npc.graphics}, palette {npc.palette}")
             # print(f"at address {npc.pointer:X}")
 
@@ -375,7 +412,7 @@ def manage_opera(fout, affect_music):
     factions = random.choice(factions)
     if random.choice([False, True]):
         factions = (factions[1], factions[0])
-    opera_log += str("Opera Factions: ").ljust(17) + string.capwords(factions[0]) + " VS " + string.capwords(
+    context.opera_log += str("Opera Factions: ").ljust(17) + string.capwords(factions[0]) + " VS " + string.capwords(
         factions[1]) + "\n"
     set_dialogue_var("OperaEast", factions[0])
     set_dialogue_var("OperaWest", factions[1])
@@ -519,7 +556,7 @@ def create_sprite(sprite, extra_tiles=None):
 
 
 def get_opera_log():
-    return opera_log
+    return get_context().opera_log
 
 
 def read_opera_mml(file):
@@ -1,6 +1,6 @@
 import re
 from dataclasses import dataclass, field
-from typing import List, Set, Union
+from typing import Dict, FrozenSet, List, Set, Union
 from utils import pipe_print
 
 
@@ -338,10 +338,42 @@ def read_options_from_string(flag_string: str, mode: Union[Mode, str]):
     return flags
 
 
+def build_flag_index(flags: List[Flag], include_descriptions: bool = True) -> Dict[str, Flag]:
+    """
+    Maps the lowercased name, and optionally description, of each flag to the flag. When two flags share
+    a key, the one earlier in flags wins, just like a linear search over flags.
+    """
+    index = {}
+    for flag in flags:
+        index.setdefault(flag.name.lower(), flag)
+        if include_descriptions:
+            index.setdefault(flag.description.lower(), flag)
+    return index
+
+
 @dataclass
 class Options:
     mode: Mode
+    # Change active_flags through activate_flag and deactivate_flag, which keep the lookups below up to date
     active_flags: [Flag] = field(default_factory=list)
+    active_flags_by_key: Dict[str, Flag] = field(default_factory=dict, init=False, repr=False, compare=False)
+    active_flags_by_name: Dict[str, Flag] = field(default_factory=dict, init=False, repr=False, compare=False)
+    # A frozen snapshot of the lowercased active flag names
+    active_flag_names: FrozenSet[str] = field(default=frozenset(), init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.reindex_active_flags()
+
+    def reset(self, mode: Mode):
+        # Starts over in mode with no flags active, so a run never keeps the flags of the run before it
+        self.mode = mode
+        self.active_flags.clear()
+        self.reindex_active_flags()
+
+    def reindex_active_flags(self):
+        self.active_flags_by_key = build_flag_index(self.active_flags)
+        self.active_flags_by_name = build_flag_index(self.active_flags, include_descriptions=False)
+        self.active_flag_names = frozenset(self.active_flags_by_name)
 
     @staticmethod
     def get_flag_string():
@@ -356,46 +388,40 @@ class Options:
 
     @staticmethod
     def get_flag(flag_name: str) -> Flag:
-        for flag in ALL_FLAGS:
-            if flag.name.lower() == flag_name.lower() or flag.description.lower() == flag_name.lower():
-                return flag
+        return ALL_FLAGS_BY_KEY.get(flag_name.lower())
 
     def is_flag_active(self, flag_attribute: str):
-        for flag in self.active_flags:
-            if flag.name.lower() == flag_attribute.lower() or flag.description.lower() == flag_attribute.lower():
-                return flag
+        return self.active_flags_by_key.get(flag_attribute.lower())
 
     def is_any_flag_active(self, flag_names: List[str]):
-        for flag in self.active_flags:
-            if flag.name.lower() in [flag_name.lower() for flag_name in flag_names]:
-                return True
+        if not self.active_flag_names.isdisjoint(flag_name.lower() for flag_name in flag_names):
+            return True
 
     def get_flag_value(self, flag_name: str):
-        try:
-            for flag in self.active_flags:
-                if flag.name.lower() == flag_name.lower():
-                    if not isinstance(flag.value, bool):
-                        return flag.value
-        except KeyError:
-            return None
+        flag = self.active_flags_by_name.get(flag_name.lower())
+        if flag is not None and not isinstance(flag.value, bool):
+            return flag.value
 
     def activate_flag(self, flag_name: str, flag_value=True):
-        for flag in ALL_FLAGS:
-            if flag.name.lower() == flag_name.lower():
-                if flag in self.active_flags:
-                    return
-                flag.value = flag_value
-                self.active_flags.append(flag)
-                if flag in MAKEOVER_MODIFIER_FLAGS:
-                    self.activate_flag("makeover", True)
-                if flag in RESTRICTED_VANILLA_SPRITE_FLAGS:
-                    self.activate_flag("frenchvanilla", True)
-                return
+        flag = ALL_FLAGS_BY_NAME.get(flag_name.lower())
+        if flag is None or flag in self.active_flags:
+            return
+        flag.value = flag_value
+        self.active_flags.append(flag)
+        self.active_flags_by_key.setdefault(flag.name.lower(), flag)
+        self.active_flags_by_key.setdefault(flag.description.lower(), flag)
+        self.active_flags_by_name.setdefault(flag.name.lower(), flag)
+        self.active_flag_names = frozenset(self.active_flags_by_name)
+        if flag in MAKEOVER_MODIFIER_FLAGS:
+            self.activate_flag("makeover", True)
+        if flag in RESTRICTED_VANILLA_SPRITE_FLAGS:
+            self.activate_flag("frenchvanilla", True)
 
     def deactivate_flag(self, flag_name: str):
         for index, flag in enumerate(self.active_flags):
             if flag.name == flag_name:
                 del self.active_flags[index]
+        self.reindex_active_flags()
 
     def activate_from_string(self, flag_string):
         s = ""
@@ -1593,6 +1619,12 @@ RESTRICTED_VANILLA_SPRITE_FLAGS = []
 makeover_groups = None
 
 
+def index_all_flags():
+    global ALL_FLAGS_BY_KEY, ALL_FLAGS_BY_NAME
+    ALL_FLAGS_BY_KEY = build_flag_index(ALL_FLAGS)
+    ALL_FLAGS_BY_NAME = build_flag_index(ALL_FLAGS, include_descriptions=False)
+
+
 def get_makeover_groups():
     try:
         global makeover_groups
@@ -1638,6 +1670,7 @@ def get_makeover_groups():
 
         global ALL_FLAGS
         ALL_FLAGS = NORMAL_FLAGS + MAKEOVER_MODIFIER_FLAGS + CAVE_FLAGS + SPECIAL_FLAGS
+        index_all_flags()
     except FileNotFoundError:
         pass
     return makeover_groups
@@ -1700,6 +1733,9 @@ BETA_FLAGS = [
 ]
 
 ALL_FLAGS = NORMAL_FLAGS + MAKEOVER_MODIFIER_FLAGS + CAVE_FLAGS + SPECIAL_FLAGS
+ALL_FLAGS_BY_KEY = {}
+ALL_FLAGS_BY_NAME = {}
+index_all_flags()
 
 Options_ = Options(ALL_MODES[0])
 
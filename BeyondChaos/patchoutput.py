@@ -0,0 +1,277 @@
+"""
+Writes the difference between the vanilla ROM and a randomized ROM as an IPS or BPS patch, so a seed
+can be shipped and stored without the unchanged bulk of the ROM.
+"""
+from zlib import crc32
+
+PATCH_FORMATS = ['ips', 'bps']
+
+# Blocks of this size are compared in one go when looking for changed bytes
+DIFF_BLOCK_SIZE = 64
+# Runs of identical bytes at least this long are written as RLE records
+MIN_RLE_LENGTH = 9
+
+IPS_EOF = b'EOF'
+IPS_EOF_ADDRESS = 0x454F46
+IPS_MAX_ADDRESS = 0xFFFFFF
+IPS_MAX_RECORD_SIZE = 0xFFFF
+# An IPS record costs 5 bytes, so unchanged gaps shorter than this are cheaper to include in the record
+IPS_MERGE_DISTANCE = 6
+
+BPS_SOURCE_READ = 0
+BPS_TARGET_READ = 1
+BPS_TARGET_COPY = 3
+
+
+def get_changed_ranges(source: bytes, target: bytes, merge_distance: int = 0) -> list:
+    """
+    Returns the (start, end) ranges where target differs from source. Bytes past the end of source
+    count as zero. Ranges closer together than merge_distance are merged.
+    """
+    source = memoryview(source)
+    target = memoryview(target)
+    changed = []
+    start = None
+    for block_start in range(0, len(target), DIFF_BLOCK_SIZE):
+        block_end = min(block_start + DIFF_BLOCK_SIZE, len(target))
+        if block_end <= len(source) and source[block_start:block_end] == target[block_start:block_end]:
+            if start is not None:
+                changed.append((start, block_start))
+                start = None
+            continue
+        for address in range(block_start, block_end):
+            source_byte = source[address] if address < len(source) else 0
+            if source_byte != target[address]:
+                if start is None:
+                    start = address
+            elif start is not None:
+                changed.append((start, address))
+                start = None
+    if start is not None:
+        changed.append((start, len(target)))
+
+    merged = []
+    for start, end in changed:
+        if merged and start - merged[-1][1] < merge_distance:
+            merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def split_runs(data: bytes) -> list:
+    """
+    Splits data into (is_run, start, end) pieces, where runs are at least MIN_RLE_LENGTH copies of one byte.
+    """
+    pieces = []
+    literal_start = 0
+    position = 0
+    while position < len(data):
+        run_end = position + 1
+        while run_end < len(data) and data[run_end] == data[position]:
+            run_end += 1
+        if run_end - position >= MIN_RLE_LENGTH:
+            if literal_start < position:
+                pieces.append((False, literal_start, position))
+            pieces.append((True, position, run_end))
+            literal_start = run_end
+        position = run_end
+    if literal_start < len(data):
+        pieces.append((False, literal_start, len(data)))
+    return pieces
+
+
+def make_ips_patch(source: bytes, target: bytes) -> bytes:
+    """
+    Returns an IPS patch that turns source into target. If target is shorter than source, the patch
+    ends with the common truncation extension.
+    """
+    if len(target) > IPS_MAX_ADDRESS + 1:
+        raise ValueError('IPS patches cannot address more than 16 MiB.')
+
+    changed_ranges = get_changed_ranges(source, target, merge_distance=IPS_MERGE_DISTANCE)
+    if len(target) > len(source) and (not changed_ranges or changed_ranges[-1][1] < len(target)):
+        # Write the last byte so that the patched file grows to the full size
+        changed_ranges.append((len(target) - 1, len(target)))
+
+    patch = bytearray(b'PATCH')
+    for start, end in changed_ranges:
+        if start == IPS_EOF_ADDRESS:
+            # A record at this address would read as the end of the patch
+            start -= 1
+        data = target[start:end]
+        for is_run, piece_start, piece_end in split_runs(data):
+            while piece_start < piece_end:
+                address = start + piece_start
+                record_is_run = is_run
+                if address == IPS_EOF_ADDRESS:
+                    # Only possible when a piece or a split lands exactly here.
+                    #   Write this record as plain data starting one byte earlier.
+                    address -= 1
+                    piece_start -= 1
+                    record_is_run = False
+                record_end = min(piece_end, piece_start + IPS_MAX_RECORD_SIZE)
+                patch += address.to_bytes(3, 'big')
+                if record_is_run:
+                    patch += b'\x00\x00'
+                    patch += (record_end - piece_start).to_bytes(2, 'big')
+                    patch.append(data[piece_start])
+                else:
+                    patch += (record_end - piece_start).to_bytes(2, 'big')
+                    patch += data[piece_start:record_end]
+                piece_start = record_end
+    patch += IPS_EOF
+    if len(target) < len(source):
+        patch += len(target).to_bytes(3, 'big')
+    return bytes(patch)
+
+
+def apply_ips_patch(source: bytes, patch: bytes) -> bytes:
+    if patch[:5] != b'PATCH':
+        raise ValueError('Not an IPS patch.')
+    target = bytearray(source)
+    position = 5
+    while patch[position:position + 3] != IPS_EOF:
+        address = int.from_bytes(patch[position:position + 3], 'big')
+        size = int.from_bytes(patch[position + 3:position + 5], 'big')
+        position += 5
+        if size == 0:
+            size = int.from_bytes(patch[position:position + 2], 'big')
+            block = patch[position + 2:position + 3] * size
+            position += 3
+        else:
+            block = patch[position:position + size]
+            position += size
+        if address > len(target):
+            target.extend(bytes(address - len(target)))
+        target[address:address + size] = block
+    position += 3
+    if len(patch) >= position + 3:
+        del target[int.from_bytes(patch[position:position + 3], 'big'):]
+    return bytes(target)
+
+
+def encode_bps_number(value: int) -> bytes:
+    encoded = bytearray()
+    while True:
+        low_bits = value & 0x7F
+        value >>= 7
+        if value == 0:
+            encoded.append(0x80 | low_bits)
+            return bytes(encoded)
+        encoded.append(low_bits)
+        value -= 1
+
+
+def decode_bps_number(patch: bytes, position: int) -> (int, int):
+    value, shift = 0, 1
+    while True:
+        byte = patch[position]
+        position += 1
+        value += (byte & 0x7F) * shift
+        if byte & 0x80:
+            return value, position
+        shift <<= 7
+        value += shift
+
+
+def make_bps_patch(source: bytes, target: bytes, metadata: str = '') -> bytes:
+    """
+    Returns a BPS patch that turns source into target. Unchanged bytes are read from the source, changed
+    bytes are stored in the patch, and long runs of one byte are copied from the target as they are written.
+    """
+    metadata = metadata.encode()
+    patch = bytearray(b'BPS1')
+    patch += encode_bps_number(len(source))
+    patch += encode_bps_number(len(target))
+    patch += encode_bps_number(len(metadata))
+    patch += metadata
+
+    def add_action(action: int, length: int):
+        patch.extend(encode_bps_number(((length - 1) << 2) | action))
+
+    # Past the end of the source every byte has to come from the patch
+    changed_ranges = [(start, min(end, len(source))) for start, end in get_changed_ranges(source, target)
+                      if start < len(source)]
+    if len(target) > len(source):
+        changed_ranges.append((len(source), len(target)))
+
+    target_relative_offset = 0
+    output_offset = 0
+    for start, end in changed_ranges:
+        if output_offset < start:
+            add_action(BPS_SOURCE_READ, start - output_offset)
+            output_offset = start
+        for is_run, piece_start, piece_end in split_runs(target[start:end]):
+            piece_start += start
+            piece_end += start
+            if is_run:
+                # Write the first byte, then copy each following byte from the one before it
+                add_action(BPS_TARGET_READ, 1)
+                patch.append(target[piece_start])
+                distance = piece_start - target_relative_offset
+                add_action(BPS_TARGET_COPY, piece_end - piece_start - 1)
+                patch += encode_bps_number((abs(distance) << 1) | (1 if distance < 0 else 0))
+                target_relative_offset = piece_start + (piece_end - piece_start - 1)
+            else:
+                add_action(BPS_TARGET_READ, piece_end - piece_start)
+                patch += target[piece_start:piece_end]
+        output_offset = end
+    if output_offset < len(target):
+        add_action(BPS_SOURCE_READ, len(target) - output_offset)
+
+    patch += crc32(source).to_bytes(4, 'little')
+    patch += crc32(target).to_bytes(4, 'little')
+    patch += crc32(patch).to_bytes(4, 'little')
+    return bytes(patch)
+
+
+def apply_bps_patch(source: bytes, patch: bytes) -> bytes:
+    if patch[:4] != b'BPS1':
+        raise ValueError('Not a BPS patch.')
+    if crc32(patch[:-4]) != int.from_bytes(patch[-4:], 'little'):
+        raise ValueError('The BPS patch is damaged.')
+    if crc32(source) != int.from_bytes(patch[-12:-8], 'little'):
+        raise ValueError('The BPS patch was made for a different source file.')
+
+    position = 4
+    source_size, position = decode_bps_number(patch, position)
+    target_size, position = decode_bps_number(patch, position)
+    metadata_size, position = decode_bps_number(patch, position)
+    position += metadata_size
+
+    target = bytearray()
+    source_relative_offset = 0
+    target_relative_offset = 0
+    while position < len(patch) - 12:
+        data, position = decode_bps_number(patch, position)
+        action, length = data & 3, (data >> 2) + 1
+        if action == BPS_SOURCE_READ:
+            target += source[len(target):len(target) + length]
+        elif action == BPS_TARGET_READ:
+            target += patch[position:position + length]
+            position += length
+        else:
+            data, position = decode_bps_number(patch, position)
+            distance = -(data >> 1) if data & 1 else data >> 1
+            if action == BPS_TARGET_COPY:
+                target_relative_offset += distance
+                for _ in range(length):
+                    target.append(target[target_relative_offset])
+                    target_relative_offset += 1
+            else:
+                source_relative_offset += distance
+                target += source[source_relative_offset:source_relative_offset + length]
+                source_relative_offset += length
+
+    if len(target) != target_size or crc32(target) != int.from_bytes(patch[-8:-4], 'little'):
+        raise ValueError('Applying the BPS patch did not produce the expected file.')
+    return bytes(target)
+
+
+def make_patch(patch_format: str, source: bytes, target: bytes, metadata: str = '') -> bytes:
+    if patch_format == 'ips':
+        return make_ips_patch(source, target)
+    if patch_format == 'bps':
+        return make_bps_patch(source, target, metadata)
+    raise ValueError(f'Unknown patch format {patch_format}. Use one of {", ".join(PATCH_FORMATS)}.')
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 from hashlib import md5
+import json
 import os
 import re
 from io import BytesIO
@@ -10,7 +11,10 @@ from multiprocessing import Pipe, Process
 
 import locationrandomizer
 import options
+import romsnapshot
 from monsterrandomizer import MonsterBlock, early_bosses, solo_bosses
+from randomizercontext import activate_context, get_context
+from romimage import RomImage, RomJournal
 from randomizers.characterstats import CharacterStats
 from ancient import manage_ancient
 from appearance import manage_character_appearance, manage_coral
@@ -54,6 +58,7 @@ from patches import (
     shadow_stays, level_cap, mp_refills, item_return_buffer_fix, mastered_espers)
 from shoprandomizer import (get_shops, buy_owned_breakable_tools)
 from sillyclowns import randomize_passwords, randomize_poem
+from spoilerlog import SPOILER_SECTION_ORDER
 from skillrandomizer import (SpellBlock, CommandBlock, SpellSub, ComboSpellSub,
                              RandomSpellSub, MultipleSpellSub, ChainSpellSub,
                              get_ranked_spells, get_spell)
@@ -67,11 +72,13 @@ from utils import (COMMAND_TABLE, LOCATION_TABLE, LOCATION_PALETTE_TABLE,
                    generate_swapfunc, shift_middle, get_palette_transformer,
                    battlebg_palettes, set_randomness_multiplier,
                    mutate_index, utilrandom as random, open_mei_fallback,
-                   AutoLearnRageSub, pipe_print, set_parent_pipe)
+                   AutoLearnRageSub, pipe_print, set_parent_pipe, StageTimer, measure_stage, timed_stage)
 from wor import manage_wor_recruitment, manage_wor_skip
 from random import Random
 from patch_title import title_gfx
-from remonsterate.remonsterate import remonsterate
+from patchoutput import PATCH_FORMATS, make_patch
+from randomtools.tablereader import reset_patches
+from remonsterate.remonsterate import remonsterate, remonsterate_in_process
 
 
 NEVER_REPLACE = ['fight', 'item', 'magic', 'row', 'def', 'magitek', 'lore',
@@ -79,10 +86,13 @@ NEVER_REPLACE = ['fight', 'item', 'magic', 'row', 'def', 'magitek', 'lore',
 RESTRICTED_REPLACE = ['throw', 'steal']
 ALWAYS_REPLACE = ['leap', 'possess', 'health', 'shock']
 FORBIDDEN_COMMANDS = ['leap', 'possess']
+# Monster AI script pointers are 16-bit offsets from 0xF8700
+AI_SCRIPT_WINDOW = (0xF8700, 0xF8700 + 0x10000)
 TEK_SKILLS = (  # [0x18, 0x6E, 0x70, 0x7D, 0x7E] +
         list(range(0x86, 0x8B)) + [0xA7, 0xB1] +
         list(range(0xB4, 0xBA)) +
         [0xBF, 0xCD, 0xD1, 0xD4, 0xD7, 0xDD, 0xE3])
+# The junction patch parameters every run starts from, see RandomizerContext.junction_manager_parameters
 JUNCTION_MANAGER_PARAMETERS = {
     'morpher-index': 0x0,
     'berserker-index': 0xd,
@@ -100,57 +110,21 @@ flags = None
 # infile_rom_buffer = None
 # outfile_rom_buffer = None
 # gui_connection = None
-name_location_dict = {}
-changed_commands = set([])
-randomizer_log = {}
 
 
 def log(text: str, section: str | None):
     """
-    Helps build the randomizer_log dict by appending text to the randomizer_log[section] key.
+    Helps build the spoiler log of the current run by adding text to the given section.
     """
-    global randomizer_log
-    if section not in randomizer_log:
-        randomizer_log[section] = []
     if '\n' in text:
         text = text.split('\n')
         text = '\n'.join([line.rstrip() for line in text])
     text = text.strip()
-    randomizer_log[section].append(text)
+    get_context().randomizer_log.add(text, section)
 
 
 def get_log_string(ordering: List = None) -> str:
-    global randomizer_log
-    log_string = ''
-    if ordering is None:
-        ordering = sorted([order for order in randomizer_log if order is not None])
-    ordering = [order for order in ordering if order is not None]
-
-    for data in randomizer_log[None]:
-        log_string += data + '\n'
-
-    log_string += '\n'
-    sections_with_content = []
-    for section in ordering:
-        if section in randomizer_log:
-            sections_with_content.append(section)
-            log_string += '-{0:02d}- {1}\n'.format(len(sections_with_content),
-                                                   ' '.join(
-                                                       [word.capitalize() for word in str(section).split()]))
-    for section_num, section in enumerate(sections_with_content):
-        datas = sorted(randomizer_log[section])
-        log_string += '\n' + '=' * 60 + '\n'
-        log_string += '-{0:02d}- {1}\n'.format(section_num + 1, section.upper())
-        log_string += '-' * 60 + '\n'
-        newlines = False
-        if any('\n' in data for data in datas):
-            log_string += '\n'
-            newlines = True
-        for data in datas:
-            log_string += data.strip() + '\n'
-            if newlines:
-                log_string += '\n'
-    return log_string.strip()
+    return get_context().randomizer_log.render(ordering)
 
 
 def log_chests():
@@ -398,55 +372,6 @@ class AutoRecruitGauSub(Substitution):
         super(AutoRecruitGauSub, self).write(outfile_rom_buffer, noverify=True, patch_name='auto_recruit_gau')
 
 
-class FreeBlock:
-    def __init__(self, start: int, end: int):
-        self.start = start
-        self.end = end
-
-    @property
-    def size(self) -> int:
-        return self.end - self.start
-
-    def unfree(self, start: int, length: int) -> List:
-        end = start + length
-        if start < self.start:
-            raise Exception('Used space out of bounds (left)')
-        if end > self.end:
-            raise Exception('Used space out of bounds (right)')
-        newfree = []
-        if self.start != start:
-            newfree.append(FreeBlock(self.start, start))
-        if end != self.end:
-            newfree.append(FreeBlock(end, self.end))
-        self.start, self.end = None, None
-        return newfree
-
-
-def get_appropriate_free_space(free_spaces: List[FreeBlock],
-                               size: int,
-                               minimum_address: int = None) -> FreeBlock:
-    if minimum_address:
-        candidates = [free_space for free_space in free_spaces if
-                      free_space.size >= size and
-                      free_space.start >= minimum_address]
-    else:
-        candidates = [free_space for free_space in free_spaces if free_space.size >= size]
-
-    if not candidates:
-        raise MemoryError('Not enough free space')
-
-    candidates = sorted(candidates, key=lambda free_space: free_space.size)
-    return candidates[0]
-
-
-def determine_new_free_spaces(free_spaces: List[FreeBlock],
-                              myfs: FreeBlock, size: int) -> List:
-    free_spaces.remove(myfs)
-    fss = myfs.unfree(myfs.start, size)
-    free_spaces.extend(fss)
-    return free_spaces
-
-
 # Based on a document called Ending_Cinematic_Relocation_Notes
 def relocate_ending_cinematic_data(data_blk_dst):
     cinematic_data_addr, cinematic_data_length = 0x28A70, 7145
@@ -501,8 +426,10 @@ def relocate_ending_cinematic_data(data_blk_dst):
         copy_sub.bytestring = bytes([new_dst_bnk])
         copy_sub.write(outfile_rom_buffer, patch_name='rotate_ending_cinematic')
 
-    return FreeBlock(cinematic_data_addr,
-                     cinematic_data_addr + cinematic_data_length)
+    free_space = get_context().free_space
+    free_space.claim(data_blk_dst - 0xC00000, data_blk_dst - 0xC00000 + cinematic_data_length,
+                     'rotate_ending_cinematic')
+    free_space.free(cinematic_data_addr, cinematic_data_addr + cinematic_data_length)
 
 
 class WindowBlock:
@@ -603,6 +530,7 @@ def commands_from_table(tablefile: str) -> List:
     return commands
 
 
+@timed_stage
 def randomize_colosseum(pointer: int) -> List:
     item_objs = get_ranked_items(infile_rom_buffer)
     monster_objs = get_ranked_monsters(infile_rom_buffer, bosses=False)
@@ -655,6 +583,7 @@ def randomize_colosseum(pointer: int) -> List:
     return results
 
 
+@timed_stage
 def randomize_slots(pointer: int):
     spells = get_ranked_spells(infile_rom_buffer)
     spells = [spell for spell in spells if spell.spellid >= 0x36]
@@ -723,6 +652,7 @@ def auto_learn_rage():
     alr_sub.write(outfile_rom_buffer, patch_name='auto_learn_rage')
 
 
+@timed_stage
 def manage_commands(commands: Dict[str, CommandBlock]):
     """
     Takes in a dict of commands and randomizes them.
@@ -909,7 +839,7 @@ def manage_commands(commands: Dict[str, CommandBlock]):
                         morph_char_sub.bytestring = bytes([0xC9, character.id])
                         morph_char_sub.set_location(0x25E32)
                         morph_char_sub.write(outfile_rom_buffer, noverify=True, patch_name='morph_char')
-                        JUNCTION_MANAGER_PARAMETERS['morpher-index'] = character.id
+                        get_context().junction_manager_parameters['morpher-index'] = character.id
             for index, command in enumerate(reversed(using)):
                 character.set_battle_command(index + 1, command=command)
         else:
@@ -924,11 +854,13 @@ def manage_commands(commands: Dict[str, CommandBlock]):
     return commands
 
 
+@timed_stage
 def manage_tempchar_commands():
     if Options_.is_flag_active('metronome'):
         return
     characters = get_characters()
     char_dict = {character_mtc.id: character_mtc for character_mtc in characters}
+    changed_commands = get_context().changed_commands
     basic_pool = set(range(3, 0x1E)) - changed_commands - {0x4, 0x11, 0x14, 0x15, 0x19}
     moogle_pool, banon_pool, ghost_pool, leo_pool = list(map(set, [basic_pool] * 4))
     for key in [0, 1, 0xA]:
@@ -964,6 +896,7 @@ def manage_tempchar_commands():
         character_mtc.write_battle_commands(outfile_rom_buffer)
 
 
+@timed_stage
 def manage_commands_new(commands: Dict[str, CommandBlock]):
     """
     Takes in a dict of commands and randomizes them.
@@ -985,12 +918,10 @@ def manage_commands_new(commands: Dict[str, CommandBlock]):
     # replacing jump makes the character never come back down
     # replacing mimic screws up enemy skills too
     get_characters()
-    free_spaces = [FreeBlock(0x2A65A, 0x2A800),
-                   FreeBlock(0x2FAAC, 0x2FC6D),
-                   FreeBlock(0x28A70, 0x2A659)]
-    # NOTE: This depends on using `relocate_cinematic_data`
-    # once this is settled on, we can just prepend this to
-    # the first free block above
+    # 0x28A70-0x2A659 is freed by relocate_ending_cinematic_data()
+    free_space = get_context().free_space
+    free_space.free(0x2A65A, 0x2A800)
+    free_space.free(0x2FAAC, 0x2FC6D)
 
     allow_ultima = not Options_.is_flag_active('penultima')
     multibanned_list = [0x63, 0x58, 0x5B]
@@ -1019,7 +950,7 @@ def manage_commands_new(commands: Dict[str, CommandBlock]):
                 if random.randint(1, 100) > 50:
                     continue
 
-        changed_commands.add(command.id)
+        get_context().changed_commands.add(command.id)
         rng_value = random.randint(1, 3)
 
         if Options_.is_flag_active('nocombos'):
@@ -1348,13 +1279,11 @@ def manage_commands_new(commands: Dict[str, CommandBlock]):
                 assert False
             break
 
-        myfs = get_appropriate_free_space(free_spaces, spell.size)
-        spell.set_location(myfs.start)
+        spell.set_location(free_space.allocate(spell.size, 'manage_commands_new', bank=0x02))
         if not hasattr(spell, 'bytestring') or not spell.bytestring:
             spell.generate_bytestring()
         spell.write(outfile_rom_buffer, patch_name='manage_commands_new')
         command.setpointer(spell.location, outfile_rom_buffer)
-        free_spaces = determine_new_free_spaces(free_spaces, myfs, spell.size)
 
         if len(new_name) > 7:
             new_name = new_name.replace('-', '')
@@ -1408,13 +1337,11 @@ def manage_commands_new(commands: Dict[str, CommandBlock]):
         magitek.allow_while_confused(outfile_rom_buffer)
         magitek.allow_while_berserk(outfile_rom_buffer)
 
-        myfs = get_appropriate_free_space(free_spaces, spell.size)
-        spell.set_location(myfs.start)
+        spell.set_location(free_space.allocate(spell.size, 'manage_commands_new', bank=0x02))
         if not hasattr(spell, 'bytestring') or not spell.bytestring:
             spell.generate_bytestring()
         spell.write(outfile_rom_buffer)
         magitek.setpointer(spell.location, outfile_rom_buffer)
-        free_spaces = determine_new_free_spaces(free_spaces, myfs, spell.size)
 
     gogo_enable_all_sub = Substitution()
     gogo_enable_all_sub.bytestring = bytes([0xEA] * 2)
@@ -1426,24 +1353,24 @@ def manage_commands_new(commands: Dict[str, CommandBlock]):
     cyan_ai_sub.set_location(0xFBE85)
     cyan_ai_sub.write(outfile_rom_buffer, patch_name='cyan_ai')
 
-    return commands, free_spaces
+    return commands
 
 
+@timed_stage
 def manage_suplex(commands: Dict[str, CommandBlock], monsters: List[MonsterBlock]):
     characters = get_characters()
-    free_spaces = [FreeBlock(0x2A65A, 0x2A800), FreeBlock(0x2FAAC, 0x2FC6D)]
+    free_space = get_context().free_space
+    free_space.free(0x2A65A, 0x2A800)
+    free_space.free(0x2FAAC, 0x2FC6D)
     suplex_command = [command for command in commands.values() if command.id == 5][0]
-    chosen_free_space = free_spaces.pop()
     spell = SpellSub(spellid=0x5F)
     sb = SpellBlock(0x5F, infile_rom_buffer)
-    spell.set_location(chosen_free_space.start)
+    spell.set_location(free_space.allocate(spell.size, 'suplexwrecks', within=(0x2FAAC, 0x2FC6D)))
     spell.write(outfile_rom_buffer, patch_name='suplexwrecks')
     suplex_command.targeting = sb.targeting
     suplex_command.setpointer(spell.location, outfile_rom_buffer)
     suplex_command.newname(sb.name, outfile_rom_buffer)
     suplex_command.unsetmenu(outfile_rom_buffer)
-    fss = chosen_free_space.unfree(spell.location, spell.size)
-    free_spaces.extend(fss)
     for character_ms in characters:
         character_ms.set_battle_command(0, command_id=0)
         character_ms.set_battle_command(1, command_id=5)
@@ -1464,6 +1391,7 @@ def manage_suplex(commands: Dict[str, CommandBlock], monsters: List[MonsterBlock
     learn_blitz_sub.write(outfile_rom_buffer, patch_name='suplexwrecks')
 
 
+@timed_stage
 def manage_natural_magic(natural_magic_table):
     characters = get_characters()
 
@@ -1587,7 +1515,8 @@ def manage_natural_magic(natural_magic_table):
     write_multi(outfile_rom_buffer, new_known_lores, length=3)
 
 
-def manage_equip_umaro(freespaces: list):
+@timed_stage
+def manage_equip_umaro():
     # ship unequip - cc3510
     equip_umaro_sub = Substitution()
     equip_umaro_sub.bytestring = [0xC9, 0x0E]
@@ -1630,19 +1559,18 @@ def manage_equip_umaro(freespaces: list):
     unequip_umaro_sub.set_location(0xC351E)
     unequip_umaro_sub.write(outfile_rom_buffer, patch_name='manage_equip_umaro')
 
-    myfs = get_appropriate_free_space(freespaces, 234)
-    pointer = myfs.start
+    # 7 header bytes, 14 segments of 16 bytes and 3 footer bytes
+    pointer = get_context().free_space.allocate(234, 'manage_equip_umaro', bank=0x0C)
     unequip_umaro_sub.bytestring = generate_unequipper(pointer, not_current_party=True)
-    freespaces = determine_new_free_spaces(freespaces, myfs, unequip_umaro_sub.size)
+    assert unequip_umaro_sub.size == 234
     unequip_umaro_sub.set_location(pointer)
     unequip_umaro_sub.write(outfile_rom_buffer, patch_name='manage_equip_umaro')
     unequip_umaro_sub.bytestring = [pointer & 0xFF, (pointer >> 8) & 0xFF, (pointer >> 16) - 0xA]
     unequip_umaro_sub.set_location(0xC3514)
     unequip_umaro_sub.write(outfile_rom_buffer, patch_name='manage_equip_umaro')
 
-    return freespaces
-
 
+@timed_stage
 def manage_umaro(commands: Dict[str, CommandBlock]):
     characters = get_characters()
     candidates = [character_mu for character_mu in characters if
@@ -1675,7 +1603,7 @@ def manage_umaro(commands: Dict[str, CommandBlock]):
     umaro.battle_commands = list(umaro_risk.battle_commands)
     candidates = [0x00, 0x05, 0x06, 0x07, 0x09, 0x0A, 0x0B, 0x10,
                   0x12, 0x13, 0x16, 0x18]
-    candidates = [command for command in candidates if command not in changed_commands]
+    candidates = [command for command in candidates if command not in get_context().changed_commands]
     base_command = random.choice(candidates)
     commands = list(commands.values())
     base_command = [command for command in commands if command.id == base_command][0]
@@ -1697,7 +1625,7 @@ def manage_umaro(commands: Dict[str, CommandBlock]):
     umaro_exchange_sub.write(outfile_rom_buffer, patch_name='manage_umaro')
     umaro_exchange_sub.set_location(0x20926)
     umaro_exchange_sub.write(outfile_rom_buffer, noverify=True, patch_name='manage_umaro')
-    JUNCTION_MANAGER_PARAMETERS['berserker-index'] = umaro_risk.id
+    get_context().junction_manager_parameters['berserker-index'] = umaro_risk.id
 
     spells = get_ranked_spells(infile_rom_buffer)
     spells = [spell for spell in spells if spell.target_enemy_default]
@@ -1718,6 +1646,7 @@ def manage_umaro(commands: Dict[str, CommandBlock]):
     return umaro_risk
 
 
+@timed_stage
 def manage_sprint():
     auto_sprint = Substitution()
     auto_sprint.set_location(0x4E2D)
@@ -1749,6 +1678,7 @@ def name_swd_techs():
     repoint_jokerdoom_sub.write(outfile_rom_buffer, patch_name='swdtech_names')
 
 
+@timed_stage
 def manage_skips():
     # To identify if this cutscene skip is active in a ROM, look for the
     # bytestring:
@@ -2006,7 +1936,7 @@ def manage_skips():
                 item.write_data(outfile_rom_buffer, cutscene_skip=True)
 
 
-def activate_airship_mode(free_spaces: list):
+def activate_airship_mode():
     set_airship_sub = Substitution()
     set_airship_sub.bytestring = bytes([0x3A, 0xD2, 0xCC] +  # moving code
                                        [0xD2, 0xBA] +  # enter airship from below decks
@@ -2017,9 +1947,7 @@ def activate_airship_mode(free_spaces: list):
                                        [0xFF] +  # end map script
                                        [0xFE]  # end subroutine
                                        )
-    myfs = get_appropriate_free_space(free_spaces, set_airship_sub.size)
-    pointer = myfs.start
-    free_spaces = determine_new_free_spaces(free_spaces, myfs, set_airship_sub.size)
+    pointer = get_context().free_space.allocate(set_airship_sub.size, 'activate_airship_mode', bank=0x0C)
 
     set_airship_sub.set_location(pointer)
     set_airship_sub.write(outfile_rom_buffer, patch_name='activate_airship_mode')
@@ -2085,8 +2013,6 @@ def activate_airship_mode(free_spaces: list):
     set_airship_sub.set_location(0x41F41)
     set_airship_sub.write(outfile_rom_buffer, patch_name='activate_airship_mode')
 
-    return free_spaces
-
 
 def set_lete_river_encounters():
     # make lete river encounters consistent within a seed for katn racing
@@ -2161,6 +2087,7 @@ def set_lete_river_encounters():
             manage_lete_river_sub.write(outfile_rom_buffer, patch_name='lete_river_encounters')
 
 
+@timed_stage
 def manage_rng():
     outfile_rom_buffer.seek(0xFD00)
     if Options_.is_flag_active('norng'):
@@ -2170,6 +2097,7 @@ def manage_rng():
     random.shuffle(numbers)
     outfile_rom_buffer.write(bytes(numbers))
 
+@timed_stage
 def manage_balance(newslots: bool = True):
     manage_rng()
     if newslots:
@@ -2188,6 +2116,7 @@ def manage_balance(newslots: bool = True):
     fix_gogo_portrait(outfile_rom_buffer)
     item_return_buffer_fix(outfile_rom_buffer)
 
+@timed_stage
 def manage_magitek():
     magitek_log = ''
     spells = get_ranked_spells()
@@ -2251,12 +2180,14 @@ def manage_magitek():
         outfile_rom_buffer.write(bytes([spell.spellid - 0x83]))
 
 
-def manage_final_boss(freespaces: list):
+@timed_stage
+def manage_final_boss():
+    free_space = get_context().free_space
     kefka1 = get_monster(0x12a)
     kefka2 = get_monster(0x11a)  # dummied kefka
     for kefka in [kefka1, kefka2]:
-        pointer = kefka.ai + 0xF8700
-        freespaces.append(FreeBlock(pointer, pointer + kefka.aiscriptsize))
+        pointer = kefka.ai + AI_SCRIPT_WINDOW[0]
+        free_space.free(pointer, pointer + kefka.aiscriptsize)
     aiscripts = read_ai_table(FINAL_BOSS_AI_TABLE)
 
     aiscript = aiscripts['KEFKA 1']
@@ -2293,16 +2224,14 @@ def manage_final_boss(freespaces: list):
     k2formation.lookup_enemies()
 
     for kefka in [kefka1, kefka2]:
-        myfs = get_appropriate_free_space(freespaces, kefka.aiscriptsize)
-        pointer = myfs.start
+        pointer = free_space.allocate(kefka.aiscriptsize, 'manage_final_boss', within=AI_SCRIPT_WINDOW)
         kefka.set_relative_ai(pointer)
-        freespaces = determine_new_free_spaces(freespaces, myfs, kefka.aiscriptsize)
 
     kefka1.write_stats(outfile_rom_buffer)
     kefka2.write_stats(outfile_rom_buffer)
-    return freespaces
 
 
+@timed_stage
 def manage_monsters(web_custom_moves=None) -> List[MonsterBlock]:
     monsters = get_monsters(infile_rom_buffer)
     safe_solo_terra = not Options_.is_flag_active('ancientcave')
@@ -2366,6 +2295,7 @@ def manage_monsters(web_custom_moves=None) -> List[MonsterBlock]:
     return monsters
 
 
+@timed_stage
 def manage_monster_appearance(monsters: List[MonsterBlock], preserve_graphics: bool = False) -> (
         List)[MonsterGraphicBlock]:
     monster_graphic_blocks = [monster.graphics for monster in monsters]
@@ -2433,6 +2363,7 @@ def manage_monster_appearance(monsters: List[MonsterBlock], preserve_graphics: b
     return monster_graphic_blocks
 
 
+@timed_stage
 def manage_colorize_animations():
     palettes = []
     for index in range(240):
@@ -2450,6 +2381,7 @@ def manage_colorize_animations():
             write_multi(outfile_rom_buffer, color, length=2)
 
 
+@timed_stage
 def manage_items(items: List[ItemBlock], changed_commands_mi: Set[int] = None) -> List[ItemBlock]:
     from itemrandomizer import (set_item_changed_commands, extend_item_breaks)
     always_break = Options_.is_flag_active('collateraldamage')
@@ -2526,6 +2458,7 @@ def manage_items(items: List[ItemBlock], changed_commands_mi: Set[int] = None) -
     return items
 
 
+@timed_stage
 def manage_equipment(items: List[ItemBlock]) -> List[ItemBlock]:
     characters = get_characters()
     reset_equippable(items, characters=characters, equip_anything=Options_.is_flag_active('equipanything'))
@@ -2594,6 +2527,7 @@ def manage_equipment(items: List[ItemBlock]) -> List[ItemBlock]:
     return items
 
 
+@timed_stage
 def manage_reorder_rages(rage_order_table):
     pointer = rage_order_table
 
@@ -2611,7 +2545,8 @@ def manage_reorder_rages(rage_order_table):
     return
 
 
-def manage_esper_boosts(free_spaces: List[FreeBlock]) -> List[FreeBlock]:
+@timed_stage
+def manage_esper_boosts():
     boost_subs = []
     esper_boost_sub = Substitution()
     # experience: $1611,X - $1613,X
@@ -2710,9 +2645,7 @@ def manage_esper_boosts(free_spaces: List[FreeBlock]) -> List[FreeBlock]:
     assert esper_boost_sub.bytestring.count(0x60) == 3
     boost_subs.append(esper_boost_sub)
     for boost_sub in boost_subs:
-        myfs = get_appropriate_free_space(free_spaces, boost_sub.size)
-        pointer = myfs.start
-        free_spaces = determine_new_free_spaces(free_spaces, myfs, boost_sub.size)
+        pointer = get_context().free_space.allocate(boost_sub.size, 'manage_esper_boosts', bank=0x02)
         boost_sub.set_location(pointer)
 
         if None in boost_sub.bytestring:
@@ -2746,10 +2679,9 @@ def manage_esper_boosts(free_spaces: List[FreeBlock]) -> List[FreeBlock]:
 
     death_abuse(outfile_rom_buffer)
 
-    return free_spaces
 
-
-def manage_espers(free_spaces: List[FreeBlock], replacements: dict = None) -> List[FreeBlock]:
+@timed_stage
+def manage_espers(replacements: dict = None):
     espers = get_espers(infile_rom_buffer)
     random.shuffle(espers)
     for esper in espers:
@@ -2796,14 +2728,13 @@ def manage_espers(free_spaces: List[FreeBlock], replacements: dict = None) -> Li
                                      0xFE, ])
     ragnarok_sub.write(outfile_rom_buffer, patch_name='manage_esper_ragnarok')
 
-    free_spaces = manage_esper_boosts(free_spaces)
+    manage_esper_boosts()
 
     for esper in espers:
         log(str(esper), section='espers')
 
-    return free_spaces
-
 
+@timed_stage
 def manage_treasure(monsters: List[MonsterBlock], shops=True, no_charm_drops=False, katn_flag=False,
                     guarantee_hidon_drop=False):
     for treasure_metamorph in get_metamorphs():
@@ -2896,10 +2827,11 @@ def manage_treasure(monsters: List[MonsterBlock], shops=True, no_charm_drops=Fal
         chosen_shop.items = new_items
         chosen_shop.write_data(outfile_rom_buffer)
         # Look in spoiler log and find the shop that was changed and update spoiler log
-        for index, shop in enumerate(randomizer_log['shops']):
+        shop_log = get_context().randomizer_log
+        for index, shop in enumerate(shop_log['shops']):
             if not shop.split('\n')[0] == str(chosen_shop).split('\n')[0]:
                 continue
-            randomizer_log['shops'][index] = str(chosen_shop)
+            shop_log.replace('shops', index, str(chosen_shop))
 
     for wager_obj, opponent_obj, win_obj, hidden in results:
         if wager_obj == striker_wager:
@@ -2915,12 +2847,14 @@ def manage_treasure(monsters: List[MonsterBlock], shops=True, no_charm_drops=Fal
         log(log_string, section='colosseum')
 
 
+@timed_stage
 def manage_doom_gaze():
     # patch is actually 98 bytes, but just in case
     patch_doom_gaze(outfile_rom_buffer)
     set_dialogue(0x60, '<choice> (Lift-off)<line><choice> (Find Doom Gaze)<line><choice> (Not just yet)')
 
 
+@timed_stage
 def manage_chests():
     crazy_prices = Options_.is_flag_active('madworld')
     no_monsters = Options_.is_flag_active('nomiabs')
@@ -2997,6 +2931,7 @@ def write_all_entrances():
         write_multi(outfile_rom_buffer, (long_next_pointer - 0x2df480), length=2)
 
 
+@timed_stage
 def manage_blitz():
     blitz_spec_pointer = 0x47a40
     # 3: X
@@ -3084,6 +3019,7 @@ def manage_blitz():
         outfile_rom_buffer.write(bytes(new_cmd))
 
 
+@timed_stage
 def manage_dragons():
     dragon_pointers = [0xab6df, 0xc18f3, 0xc1920, 0xc2048,
                        0xc205b, 0xc36df, 0xc43cd, 0xc558b]
@@ -3097,6 +3033,7 @@ def manage_dragons():
         outfile_rom_buffer.write(bytes([dragon]))
 
 
+@timed_stage
 def manage_formations(formations: List[Formation], formation_sets: List[FormationSet]) -> (
                                                                                                   List)[
                                                                                               Formation] | tuple:
@@ -3179,8 +3116,8 @@ def manage_formations(formations: List[Formation], formation_sets: List[Formatio
     return formations, formation_sets
 
 
+@timed_stage
 def manage_formations_hidden(formations: List[Formation],
-                             free_spaces: List[FreeBlock],
                              form_music_overrides: dict = None,
                              no_special_events=True):
     if not form_music_overrides:
@@ -3295,7 +3232,8 @@ def manage_formations_hidden(formations: List[Formation],
                 raise OverflowError('Double mutation detected.')
 
             try:
-                myfs = get_appropriate_free_space(free_spaces, unused_enemy.aiscriptsize)
+                pointer = get_context().free_space.allocate(unused_enemy.aiscriptsize, 'manage_formations_hidden',
+                                                            within=AI_SCRIPT_WINDOW)
             except MemoryError:
                 continue
 
@@ -3303,9 +3241,7 @@ def manage_formations_hidden(formations: List[Formation],
         else:
             continue
 
-        pointer = myfs.start
         unused_enemy.set_relative_ai(pointer)
-        free_spaces = determine_new_free_spaces(free_spaces, myfs, unused_enemy.aiscriptsize)
 
         katn = Options_.mode.name == 'katn'
         unused_enemy.auxloc = 'Missing (Boss)'
@@ -3428,6 +3364,7 @@ def assign_unused_enemy_formations():
         add_orphaned_formation(unused_formation)
 
 
+@timed_stage
 def manage_shops() -> Set[int]:
     buyables = set([])
     descriptions = []
@@ -3448,6 +3385,7 @@ def manage_shops() -> Set[int]:
 
 
 def get_namelocdict():
+    name_location_dict = get_context().name_location_dict
     if name_location_dict:
         return name_location_dict
 
@@ -3463,9 +3401,10 @@ def get_namelocdict():
     return name_location_dict
 
 
+@timed_stage
 def manage_colorize_dungeons(locations=None):
     locations = locations or get_locations()
-    get_namelocdict()
+    name_location_dict = get_namelocdict()
     pal_dict = {}
     for location in locations:
         if location.setid in name_location_dict:
@@ -3567,6 +3506,7 @@ def manage_colorize_dungeons(locations=None):
         manage_colorize_esper_world()
 
 
+@timed_stage
 def manage_colorize_wor():
     transformer = get_palette_transformer(always=True)
     outfile_rom_buffer.seek(0x12ed00)
@@ -3621,6 +3561,7 @@ def manage_colorize_wor():
             write_multi(outfile_rom_buffer, color, length=2)
 
 
+@timed_stage
 def manage_colorize_esper_world():
     location = get_location(217)
     chosen = random.choice([1, 22, 25, 28, 34, 38, 43])
@@ -3628,6 +3569,7 @@ def manage_colorize_esper_world():
     location.write_data(outfile_rom_buffer)
 
 
+@timed_stage
 def manage_encounter_rate() -> None:
     # There's a series of encounter incrementors at C0/C92F (for the overworld) and C0/C2BF (for dungeons).
     #   These get added to a counter that has been running since the last encounter.
@@ -3656,7 +3598,7 @@ def manage_encounter_rate() -> None:
         encrate_sub.write(outfile_rom_buffer, patch_name='manage_encounter_rate')
         return
 
-    get_namelocdict()
+    name_location_dict = get_namelocdict()
     encrates = {}
     change_dungeons = ['floating continent', 'veldt cave', 'fanatics tower',
                        'ancient castle', 'mt zozo', "yeti's cave",
@@ -3750,6 +3692,7 @@ def manage_encounter_rate() -> None:
     encrate_sub.write(outfile_rom_buffer, patch_name='manage_encounter_rate')
 
 
+@timed_stage
 def manage_tower():
     locations = get_locations()
     randomize_tower(morefanatical=Options_.is_flag_active('morefanatical'))
@@ -3960,6 +3903,7 @@ def create_dimensional_vortex():
         write_multi(outfile_rom_buffer, (long_next_pointer - 0x2df480), length=2)
 
 
+@timed_stage
 def randomize_final_party_order():
     code = bytes([0x20, 0x99, 0xAA,  # JSR $AA99
                   0xA9, 0x00,  # LDA #00
@@ -4012,6 +3956,7 @@ def dummy_item(item: ItemBlock) -> bool:
     return dummied
 
 
+@timed_stage
 def manage_equip_anything():
     equip_anything_sub = Substitution()
     equip_anything_sub.set_location(0x39b8b)
@@ -4022,6 +3967,7 @@ def manage_equip_anything():
     equip_anything_sub.write(outfile_rom_buffer, patch_name='equipanything')
 
 
+@timed_stage
 def manage_full_umaro():
     full_umaro_sub = Substitution()
     full_umaro_sub.bytestring = bytes([0x80])
@@ -4032,6 +3978,7 @@ def manage_full_umaro():
         full_umaro_sub.write(outfile_rom_buffer, patch_name='random_zerker')
 
 
+@timed_stage
 def manage_opening():
     decompressor = Decompressor(0x2686C, fakeaddress=0x5000, maxaddress=0x28A60)
     decompressor.read_data(infile_rom_buffer)
@@ -4153,6 +4100,7 @@ def manage_opening():
     decompressor.compress_and_write(outfile_rom_buffer)
 
 
+@timed_stage
 def manage_ending():
     ending_sync_sub = Substitution()
     ending_sync_sub.bytestring = bytes([0xC0, 0x07])
@@ -4160,6 +4108,7 @@ def manage_ending():
     ending_sync_sub.write(outfile_rom_buffer, patch_name='manage_ending')
 
 
+@timed_stage
 def manage_auction_house():
     new_format = {
         0x4ea4: [0x5312],  # Entry Point
@@ -4246,6 +4195,7 @@ def manage_auction_house():
         set_dialogue(auction_item[3], f'<line>        “<item>”!<page><line>Do I hear {opening_bid} GP?!')
 
 
+@timed_stage
 def manage_bingo(bingo_flags, size=5, difficulty='', num_cards=1, target_score=200.0):
     skills = get_ranked_spells()
     spells = [spell for spell in skills if spell.spellid <= 0x35]
@@ -4472,6 +4422,7 @@ def chocobo_merchant():
     baren_falls.npcs.append(chocobo_merchant_block)
 
 
+@timed_stage
 def manage_clock():
     hour = random.randint(0, 5)
     minute = random.randint(0, 4)
@@ -4564,6 +4515,7 @@ def manage_clock():
     set_dialogue(0x425, text)
 
 
+@timed_stage
 def manage_santa():
     for index in [0x72, 0x75, 0x7c, 0x8e, 0x17e, 0x1e1, 0x1e7, 0x1eb, 0x20f, 0x35c, 0x36d, 0x36e, 0x36f, 0x372, 0x3a9,
                   0x53a, 0x53f, 0x53f, 0x57c, 0x580, 0x5e9, 0x5ec, 0x5ee, 0x67e, 0x684, 0x686, 0x6aa, 0x6b3, 0x6b7,
@@ -4612,6 +4564,7 @@ def manage_santa():
         battle_santa_sub.write(outfile_rom_buffer)
 
 
+@timed_stage
 def manage_spookiness():
     n_o_e_s_c_a_p_e_sub = Substitution()
     n_o_e_s_c_a_p_e_sub.bytestring = bytes([0x4B, 0xAE, 0x42])
@@ -4647,6 +4600,7 @@ def manage_spookiness():
         nowhere_to_run_bottom_sub.write(outfile_rom_buffer)
 
 
+@timed_stage
 def manage_dances(dance_names=None):
     if Options_.is_flag_active('madworld'):
         spells = get_ranked_spells(infile_rom_buffer)
@@ -4770,6 +4724,7 @@ def manage_dances(dance_names=None):
     outfile_rom_buffer.write(bytes([3]))
 
 
+@timed_stage
 def manage_cursed_encounters(formations: List[Formation], formation_sets: List[FormationSet]):
     # event formation sets that can be shuffled with cursedencounters
     good_event_formation_sets = [263, 264, 275, 276, 277, 278, 279,
@@ -5019,10 +4974,11 @@ def initialize_esper_allocation_table():
     num_espers = 27
     data = b'\xff' * num_espers * 2
     outfile_rom_buffer.seek(
-        JUNCTION_MANAGER_PARAMETERS['esper-allocations-address'])
+        get_context().junction_manager_parameters['esper-allocations-address'])
     outfile_rom_buffer.write(data)
 
 
+@timed_stage
 def junction_everything(jm: JunctionManager,
                         commands: Dict[str, CommandBlock]):
     jm.set_seed(seed)
@@ -5160,8 +5116,9 @@ def junction_everything(jm: JunctionManager,
                 for effect_index in jm.equip_whitelist[index]:
                     jm.add_junction(monster.id, effect_index, 'blacklist',
                                     force_category='monster')
-        JUNCTION_MANAGER_PARAMETERS['monster-equip-steal-enabled'] = 1
-        JUNCTION_MANAGER_PARAMETERS['monster-equip-drop-enabled'] = 1
+        junction_manager_parameters = get_context().junction_manager_parameters
+        junction_manager_parameters['monster-equip-steal-enabled'] = 1
+        junction_manager_parameters['monster-equip-drop-enabled'] = 1
 
     if Options_.is_flag_active('jejentojori'):
         #Ensure merchants die to mp in case of Astral being innate on Locke
@@ -5183,7 +5140,7 @@ def junction_everything(jm: JunctionManager,
     if jm.activated:
         jm.match_esper_monster_junctions()
 
-    jm.set_parameters(JUNCTION_MANAGER_PARAMETERS)
+    jm.set_parameters(get_context().junction_manager_parameters)
 
 
 def randomize(connection: Pipe = None, **kwargs) -> str | None:
@@ -5198,7 +5155,20 @@ def randomize(connection: Pipe = None, **kwargs) -> str | None:
             infile_rom_buffer, outfile_rom_buffer, \
             ALWAYS_REPLACE, NEVER_REPLACE, gui_connection
 
+        # Every run starts with a fresh context, unless the caller supplies one to inspect afterwards
+        context = activate_context(kwargs.get('context', None))
+        context.junction_manager_parameters = dict(JUNCTION_MANAGER_PARAMETERS)
+        reset_patches()
+        if kwargs.get('stage_report', False):
+            context.stage_timer = StageTimer()
+            context.stage_timer.start()
+
         application = kwargs.get('application', None)
+        # 'rom' writes the whole randomized ROM. 'ips' and 'bps' write only its difference from the input ROM.
+        output_format = kwargs.get('output_format', 'rom')
+        if output_format != 'rom' and output_format not in PATCH_FORMATS:
+            raise ValueError(f'Unknown output format {output_format}. '
+                             f'Use rom, {", ".join(PATCH_FORMATS)}.')
 
         if not application:
             # The console should supply these kwargs
@@ -5385,7 +5355,7 @@ def randomize(connection: Pipe = None, **kwargs) -> str | None:
 
         if mode_num not in range(len(ALL_MODES)):
             raise Exception('Invalid mode specified')
-        Options_.mode = ALL_MODES[mode_num]
+        Options_.reset(ALL_MODES[mode_num])
 
         seed = seed.strip()
         if not seed:
@@ -5403,6 +5373,8 @@ def randomize(connection: Pipe = None, **kwargs) -> str | None:
                 tempname = os.path.basename(infile_rom_path).rsplit('.', 1)
             else:
                 tempname = [os.path.basename(infile_rom_path), 'smc']
+            if output_format != 'rom':
+                tempname[1] = output_format
 
             outfile_rom_path = os.path.join(outfile_rom_path,
                                             '.'.join([os.path.basename(tempname[0]),
@@ -5415,15 +5387,20 @@ def randomize(connection: Pipe = None, **kwargs) -> str | None:
                 set_config_value('Settings', 'input_path', str(infile_rom_path))
                 set_config_value('Settings', 'output_path', str(os.path.dirname(outfile_rom_path)))
 
-            infile_rom_buffer = BytesIO(open(infile_rom_path, 'rb').read())
-            outfile_rom_buffer = BytesIO(open(infile_rom_path, 'rb').read())
+            # Seed generation workers pass in the ROM they already have in memory
+            infile_rom_buffer = kwargs.get('infile_rom_buffer')
+            if infile_rom_buffer is None:
+                infile_rom_buffer = RomImage.from_file(infile_rom_path)
+            elif not isinstance(infile_rom_buffer, RomImage):
+                infile_rom_buffer = RomImage(infile_rom_buffer.getbuffer())
 
-            if len(outfile_rom_buffer.read()) % 0x400 == 0x200:
+            if len(infile_rom_buffer) % 0x400 == 0x200:
                 pipe_print('NOTICE: Headered ROM detected. Output file will have no header.')
-                outfile_rom_buffer = outfile_rom_buffer[0x200:]
+                infile_rom_buffer = RomImage(infile_rom_buffer.read_bytes(0x200, len(infile_rom_buffer) - 0x200))
                 # infile_rom_path = '.'.join([tempname[0], 'unheadered', tempname[1]])
                 # with open(infile_rom_path, 'w+b') as f:
                 #     f.write(data)
+            outfile_rom_buffer = infile_rom_buffer.copy()
 
             rom_hash = md5(outfile_rom_buffer.getbuffer()).hexdigest()
             if rom_hash not in [MD5HASHNORMAL, MD5HASHTEXTLESS, MD5HASHTEXTLESS2] and \
@@ -5444,6 +5421,11 @@ def randomize(connection: Pipe = None, **kwargs) -> str | None:
                     raise PermissionError('The randomizer does not have write permissions '
                                           'to the given ROM output directory.')
 
+        vanilla_snapshot = kwargs.get('vanilla_snapshot', None)
+        if vanilla_snapshot is None:
+            vanilla_snapshot = romsnapshot.get_cached_snapshot(infile_rom_buffer.getbuffer())
+        romsnapshot.activate_snapshot(vanilla_snapshot, infile_rom_buffer)
+
         flags = flags.lower()
         activation_string = Options_.activate_from_string(flags)
 
@@ -5556,6 +5538,8 @@ def randomize(connection: Pipe = None, **kwargs) -> str | None:
                 pipe_print('thescenarionottaken flag is incompatible with strangejourney')
             else:
                 diverge()
+                # Locations are read from the diverged outfile, not the vanilla rom
+                romsnapshot.skip_category('locations')
 
         read_dialogue(outfile_rom_buffer)  # Uses outfile instead of infile for TheScenarioNotTaken compatibility
         read_location_names(outfile_rom_buffer)  # Uses outfile instead of infile for TheScenarioNotTaken compatibility
@@ -5576,7 +5560,7 @@ def randomize(connection: Pipe = None, **kwargs) -> str | None:
         reseed()
 
         if Options_.is_flag_active('random_dances'):
-            if 0x13 not in changed_commands:
+            if 0x13 not in context.changed_commands:
                 manage_dances(kwargs.get('web_custom_dance_names', None))
 
         spells = get_ranked_spells(infile_rom_buffer)
@@ -5590,7 +5574,7 @@ def randomize(connection: Pipe = None, **kwargs) -> str | None:
                 ALWAYS_REPLACE += ['rage']
             if Options_.is_flag_active('sketch'):
                 NEVER_REPLACE += ['sketch']
-            _, freespaces = manage_commands_new(commands)
+            manage_commands_new(commands)
 
         if Options_.is_flag_active('lessfanatical'):  # remove the magic only tile when entering fanatic's tower
             fanatics_fix_sub = Substitution()
@@ -5620,11 +5604,9 @@ def randomize(connection: Pipe = None, **kwargs) -> str | None:
         get_zones(infile_rom_buffer)
         get_metamorphs(infile_rom_buffer)
 
-        aispaces = [
-            FreeBlock(0xFCF50, 0xFCF50 + 384),
-            FreeBlock(0xFFF47, 0xFFF47 + 87),
-            FreeBlock(0xFFFBE, 0xFFFBE + 66)
-        ]
+        context.free_space.free(0xFCF50, 0xFCF50 + 384)
+        context.free_space.free(0xFFF47, 0xFFF47 + 87)
+        context.free_space.free(0xFFFBE, 0xFFFBE + 66)
 
         if Options_.is_flag_active('random_final_dungeon') or Options_.is_flag_active('ancientcave'):
             # do this before treasure
@@ -5679,13 +5661,13 @@ def randomize(connection: Pipe = None, **kwargs) -> str | None:
 
         items = get_ranked_items()
         if Options_.is_flag_active('random_items'):
-            manage_items(items, changed_commands_mi=changed_commands)
+            manage_items(items, changed_commands_mi=context.changed_commands)
             buy_owned_breakable_tools(outfile_rom_buffer)
 
         reseed()
 
         if Options_.is_flag_active('random_enemy_stats'):
-            aispaces = manage_final_boss(aispaces)
+            manage_final_boss()
             monsters = manage_monsters(
                 web_custom_moves=kwargs.get('web_custom_monster_attack_names', None)
             )
@@ -5721,7 +5703,7 @@ def randomize(connection: Pipe = None, **kwargs) -> str | None:
         esper_replacements = {}
         if Options_.is_flag_active('randomize_magicite'):
             esper_replacements = randomize_magicite(outfile_rom_buffer, infile_rom_buffer)
-            JUNCTION_MANAGER_PARAMETERS['esper_replacements'] = esper_replacements
+            context.junction_manager_parameters['esper_replacements'] = esper_replacements
         reseed()
 
         if Options_.is_flag_active('random_palettes_and_names') and \
@@ -5751,7 +5733,7 @@ def randomize(connection: Pipe = None, **kwargs) -> str | None:
             manage_equipment(items)
         reseed()
 
-        esperrage_spaces = [FreeBlock(0x26469, 0x26469 + 919)]
+        context.free_space.free(0x26469, 0x26469 + 919)
 
         # Even if we don't enable dancingmaduin, we must construct an
         # esper allocation table for other modules that rely on it
@@ -5768,11 +5750,11 @@ def randomize(connection: Pipe = None, **kwargs) -> str | None:
                 esper_replacements
             )
             nerf_paladin_shield()
-            verify = JUNCTION_MANAGER_PARAMETERS['esper-allocations-address']
+            verify = context.junction_manager_parameters['esper-allocations-address']
             assert esper_allocations_address == verify
 
         if Options_.is_flag_active('random_espers'):
-            manage_espers(esperrage_spaces, esper_replacements)
+            manage_espers(esper_replacements)
 
         reseed()
         myself_locations = myself_patches(outfile_rom_buffer)
@@ -5823,7 +5805,7 @@ def randomize(connection: Pipe = None, **kwargs) -> str | None:
         if Options_.is_flag_active('random_character_stats'):
             # do this after swapping berserk
             from itemrandomizer import set_item_changed_commands
-            set_item_changed_commands(changed_commands)
+            set_item_changed_commands(context.changed_commands)
             loglist = reset_special_relics(items, characters, outfile_rom_buffer)
             log_string = 'COMMAND CHANGERS\n---------------------------\n'
             loglist.sort(key=lambda log_item: log_item[0])
@@ -5881,7 +5863,7 @@ def randomize(connection: Pipe = None, **kwargs) -> str | None:
         form_music = {}
         if Options_.is_flag_active('random_formations'):
             no_special_events = not Options_.is_flag_active('bsiab')
-            manage_formations_hidden(formations, free_spaces=aispaces, form_music_overrides=form_music,
+            manage_formations_hidden(formations, form_music_overrides=form_music,
                                      no_special_events=no_special_events)
             for monster in get_monsters():
                 monster.write_stats(outfile_rom_buffer)
@@ -5922,7 +5904,7 @@ def randomize(connection: Pipe = None, **kwargs) -> str | None:
 
         if Options_.is_flag_active('ancientcave'):
             manage_ancient(Options_, outfile_rom_buffer, infile_rom_buffer, form_music_overrides=form_music,
-                           randlog=randomizer_log, shadowstays=Options_.is_flag_active('shadowstays'), noenc=Options_.is_flag_active('dearestmolulu'))
+                           randlog=context.randomizer_log, shadowstays=Options_.is_flag_active('shadowstays'), noenc=Options_.is_flag_active('dearestmolulu'))
         reseed()
 
         if Options_.is_flag_active('shuffle_commands') or \
@@ -5932,7 +5914,7 @@ def randomize(connection: Pipe = None, **kwargs) -> str | None:
         reseed()
 
         if Options_.is_flag_active('random_blitz'):
-            if 0x0A not in changed_commands:
+            if 0x0A not in context.changed_commands:
                 manage_blitz()
         reseed()
 
@@ -6015,60 +5997,80 @@ def randomize(connection: Pipe = None, **kwargs) -> str | None:
         reseed()
 
         if Options_.is_flag_active('remonsterate'):
-            outfile_backup = BytesIO(outfile_rom_buffer.getbuffer().tobytes())
+            with measure_stage('remonsterate'):
+                attempt_number = 0
+                remonsterate_results = None
+                # Remonsterate normally works on outfile_rom_buffer directly. When asked to, it runs in a child
+                #   process instead, to keep its state apart from the randomizer's, which costs sending the
+                #   whole ROM to the child and back on every attempt.
+                isolate_remonsterate = kwargs.get('isolate_remonsterate', False)
+                if isolate_remonsterate:
+                    outfile_backup = RomImage(outfile_rom_buffer.getbuffer())
+                    randomize_connection, remonsterate_connection = Pipe()
 
-            attempt_number = 0
-            remonsterate_results = None
-            randomize_connection, remonsterate_connection = Pipe()
+                while True:
+                    try:
+                        if not isolate_remonsterate:
+                            # Records what every write replaces, so that a failed attempt can be undone
+                            rom_journal = RomJournal(outfile_rom_buffer)
+                            remonsterate_results = remonsterate_in_process(
+                                pipe_print,
+                                outfile_rom_buffer=rom_journal,
+                                seed=(seed + attempt_number),
+                                rom_type='1.0',
+                                list_of_monsters=get_monsters(outfile_rom_buffer)
+                            )
+                            break
 
-            while True:
-                try:
-                    remonsterate_kwargs = {
-                        'outfile_rom_buffer': outfile_rom_buffer,
-                        'seed': (seed + attempt_number),
-                        'rom_type': '1.0',
-                        'list_of_monsters': get_monsters(outfile_rom_buffer)
-                    }
-                    remonsterate_process = Process(
-                        target=remonsterate,
-                        args=(remonsterate_connection, pipe_print),
-                        kwargs=remonsterate_kwargs
-                    )
-                    remonsterate_process.start()
-                    while True:
-                        try:
-                            if not remonsterate_process.is_alive():
-                                raise RuntimeError('Unexpected error: The process handling remonsteration died.')
-                            if randomize_connection.poll(timeout=5):
-                                child_output = randomize_connection.recv()
+                        remonsterate_kwargs = {
+                            'outfile_rom_buffer': outfile_rom_buffer,
+                            'seed': (seed + attempt_number),
+                            'rom_type': '1.0',
+                            'list_of_monsters': get_monsters(outfile_rom_buffer)
+                        }
+                        remonsterate_process = Process(
+                            target=remonsterate,
+                            args=(remonsterate_connection, pipe_print),
+                            kwargs=remonsterate_kwargs
+                        )
+                        remonsterate_process.start()
+                        while True:
+                            try:
+                                if not remonsterate_process.is_alive():
+                                    raise RuntimeError('Unexpected error: The process handling remonsteration died.')
+                                if randomize_connection.poll(timeout=5):
+                                    child_output = randomize_connection.recv()
+                                else:
+                                    child_output = None
+                                if child_output:
+                                    if isinstance(child_output, str):
+                                        pipe_print(child_output)
+                                    elif isinstance(child_output, tuple):
+                                        outfile_rom_buffer, remonsterate_results = child_output
+                                        break
+                                    elif isinstance(child_output, Exception):
+                                        raise child_output
+                            except EOFError:
+                                break
+                    except Exception as remonsterate_exception:
+                        if isinstance(remonsterate_exception, OverflowError) or \
+                                isinstance(remonsterate_exception, ReferenceError):
+                            pipe_print('Remonsterate: An error occurred attempting to remonsterate. Trying again...')
+                            if isolate_remonsterate:
+                                # Replace backup file
+                                outfile_rom_buffer = outfile_backup
                             else:
-                                child_output = None
-                            if child_output:
-                                if isinstance(child_output, str):
-                                    pipe_print(child_output)
-                                elif isinstance(child_output, tuple):
-                                    outfile_rom_buffer, remonsterate_results = child_output
-                                    break
-                                elif isinstance(child_output, Exception):
-                                    raise child_output
-                        except EOFError:
-                            break
-                except Exception as remonsterate_exception:
-                    if isinstance(remonsterate_exception, OverflowError) or \
-                            isinstance(remonsterate_exception, ReferenceError):
-                        pipe_print('Remonsterate: An error occurred attempting to remonsterate. Trying again...')
-                        # Replace backup file
-                        outfile_rom_buffer = outfile_backup
-                        attempt_number = attempt_number + 1
-                        continue
-                    else:
-                        raise remonsterate_exception
-                break
+                                rom_journal.rollback()
+                            attempt_number = attempt_number + 1
+                            continue
+                        else:
+                            raise remonsterate_exception
+                    break
 
-            # Remonsterate finished
-            if remonsterate_results:
-                for result in remonsterate_results:
-                    log(str(result) + '\n', section='remonsterate')
+                # Remonsterate finished
+                if remonsterate_results:
+                    for result in remonsterate_results:
+                        log(str(result) + '\n', section='remonsterate')
 
         if not Options_.is_flag_active('sketch') or Options_.is_flag_active('remonsterate'):
             # Original C2 sketch fix by Assassin, prevents bad pointers
@@ -6149,10 +6151,11 @@ def randomize(connection: Pipe = None, **kwargs) -> str | None:
 
         if has_music:
             from utils import custom_path
-            randomize_music(outfile_rom_buffer, Options_, playlist_path=custom_path,
-                            playlist_filename='songs.txt',
-                            virtual_playlist=kwargs.get('web_custom_playlist', None),
-                            opera=opera, form_music_overrides=form_music)
+            with measure_stage('randomize_music'):
+                randomize_music(outfile_rom_buffer, Options_, playlist_path=custom_path,
+                                playlist_filename='songs.txt',
+                                virtual_playlist=kwargs.get('web_custom_playlist', None),
+                                opera=opera, form_music_overrides=form_music)
             log(get_music_spoiler(), section='music')
         reseed()
 
@@ -6188,12 +6191,12 @@ def randomize(connection: Pipe = None, **kwargs) -> str | None:
 
         # This needs to be after write_all_locations_misc()
         # so the changes to Daryl don't get stomped.
-        event_freespaces = [FreeBlock(0xCFE2A, 0xCFE2a + 470)]
+        context.free_space.free(0xCFE2A, 0xCFE2A + 470)
         if Options_.is_flag_active('airship'):
-            event_freespaces = activate_airship_mode(event_freespaces)
+            activate_airship_mode()
 
         if Options_.is_flag_active('random_zerker') or Options_.is_flag_active('random_character_stats'):
-            manage_equip_umaro(event_freespaces)
+            manage_equip_umaro()
 
         # Write easymodo, expboost, and gpboost stat changes to each monster
         if Options_.is_flag_active('easymodo') or Options_.is_flag_active('expboost') or \
@@ -6389,19 +6392,31 @@ def randomize(connection: Pipe = None, **kwargs) -> str | None:
 
             if Options_.is_flag_active('playsitself'):
                 jm.patch_blacklist.add('patch_junction_focus_umaro.txt')
-            jm.execute()
-            jm.verify()
+            with measure_stage('junction_manager'):
+                jm.execute()
+                for start, end, table_name in jm.claimed_ranges:
+                    context.free_space.claim(start, end, f'junction_manager {table_name}')
+                jm.verify()
             log(jm.report, section='junctions')
 
         rewrite_title(text='FF6 BCCE %s' % seed)
         validate_rom_expansion()
         rewrite_checksum()
-        verify_randomtools_patches(outfile_rom_buffer)
-        Substitution.verify_all_writes(outfile_rom_buffer)
+        with measure_stage('verify_writes'):
+            verify_randomtools_patches(outfile_rom_buffer)
+            Substitution.verify_all_writes(outfile_rom_buffer)
+
+        output_patch = None
+        if output_format != 'rom' and kwargs.get('generate_output_rom', True):
+            output_patch = make_patch(output_format, infile_rom_buffer.getbuffer(), outfile_rom_buffer.getbuffer(),
+                                      metadata=f'Beyond Chaos {VERSION} seed {seed}')
 
         if not application == 'web' and kwargs.get('generate_output_rom', True):
             with open(outfile_rom_path, 'wb+') as rom_file:
-                rom_file.write(outfile_rom_buffer.getvalue())
+                if output_patch is None:
+                    rom_file.write(outfile_rom_buffer.getbuffer())
+                else:
+                    rom_file.write(output_patch)
             outfile_rom_buffer.close()
 
         if kwargs.get('generate_output_rom', True):
@@ -6420,33 +6435,30 @@ def randomize(connection: Pipe = None, **kwargs) -> str | None:
 
             for monster in sorted(get_monsters(), key=lambda log_monster: log_monster.display_name):
                 if monster.display_name:
-                    log(monster.get_description(changed_commands=changed_commands),
+                    log(monster.get_description(changed_commands=context.changed_commands),
                         section='monsters')
 
             if not Options_.is_flag_active('ancientcave'):
                 log_chests()
             log_item_mutations()
 
+            for rom_map_line in context.free_space.get_rom_map():
+                log(rom_map_line, section='rom map')
+
             if not application == 'web':
                 try:
                     with open(outlog, 'w+') as log_file:
-                        log_file.write(get_log_string(
-                            ['characters', 'stats', 'aesthetics', 'commands', 'blitz inputs', 'magitek',
-                             'slots', 'dances', 'espers', 'item magic', 'item effects',
-                             'command-change relics', 'colosseum', 'monsters', 'music', 'remonsterate',
-                             'shops', 'treasure chests', 'junctions', 'zozo clock', 'secret items']))
+                        log_file.write(get_log_string(SPOILER_SECTION_ORDER))
                 except UnicodeEncodeError:
                     # Computer's locale does not support all unicode characters being written. Try again with UTF-8.
                     try:
                         with open(outlog, 'w', encoding='UTF-8') as log_file:
-                            log_file.write(get_log_string(
-                                ['characters', 'stats', 'aesthetics', 'commands', 'blitz inputs', 'magitek',
-                                 'slots', 'dances', 'espers', 'item magic', 'item effects',
-                                 'command-change relics', 'colosseum', 'monsters', 'music', 'remonsterate',
-                                 'shops', 'treasure chests', 'junctions', 'zozo clock', 'secret items']))
+                            log_file.write(get_log_string(SPOILER_SECTION_ORDER))
                     except Exception as ex:
                         pipe_print("ERROR: The randomizer encountered an error generating the spoiler log. No "
                                    "spoiler log was generated. Error text: " + str(ex))
+                if kwargs.get('spoiler_json', False):
+                    context.randomizer_log.write_json(os.path.splitext(outlog)[0] + '.json', SPOILER_SECTION_ORDER)
 
         if Options_.is_flag_active('bingoboingo'):
             target_score = 200.0
@@ -6462,6 +6474,15 @@ def randomize(connection: Pipe = None, **kwargs) -> str | None:
                          target_score=target_score)
             pipe_print('Bingo cards generated.')
 
+        stage_report = None
+        if context.stage_timer is not None:
+            context.stage_timer.stop()
+            stage_report = context.stage_timer.get_report(version=VERSION, mode=Options_.mode.name,
+                                                          flags=flags, seed=seed)
+            if outlog:
+                with open(os.path.splitext(outlog)[0] + '.stages.json', 'w') as report_file:
+                    json.dump(stage_report, report_file, indent=2)
+
         if application == 'tester':
             pipe_print('Randomization successful.')
             pipe_print(True)
@@ -6470,20 +6491,30 @@ def randomize(connection: Pipe = None, **kwargs) -> str | None:
             pipe_print(True)
         elif application == 'web':
             pipe_print('Randomization successful.')
-            pipe_print({
+            web_output = {
                 # ord = output rom data
                 # os = output seed
                 # osl = output spoiler log
-                'ord': outfile_rom_buffer,
+                'ord': outfile_rom_buffer if output_patch is None else None,
                 'os': seed,
-                'osl': get_log_string(
-                    ['characters', 'stats', 'aesthetics', 'commands', 'blitz inputs', 'magitek', 'slots', 'dances',
-                     'espers',
-                     'item magic', 'item effects', 'command-change relics', 'colosseum', 'monsters', 'music',
-                     'remonsterate', 'shops', 'treasure chests', 'junctions', 'zozo clock', 'secret items'])
-            })
+                'osl': get_log_string(SPOILER_SECTION_ORDER)
+            }
+            if kwargs.get('spoiler_json', False):
+                # osj = output spoiler log as JSON
+                web_output['osj'] = context.randomizer_log.to_dict(SPOILER_SECTION_ORDER)
+            if output_patch is not None:
+                # op = output patch, opf = output patch format
+                web_output['op'] = output_patch
+                web_output['opf'] = output_format
+            if stage_report is not None:
+                # osr = output stage report
+                web_output['osr'] = stage_report
+            pipe_print(web_output)
         return outfile_rom_path
     except Exception as exc_r:
+        stage_timer = get_context().stage_timer
+        if stage_timer is not None and stage_timer.started_tracing:
+            stage_timer.stop()
         # pipe_print(type(exc)(traceback.print_exc()))
         pipe_print(exc_r)
         raise exc_r
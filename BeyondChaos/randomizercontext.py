@@ -0,0 +1,135 @@
+from contextvars import ContextVar
+
+from freespace import FreeSpace
+from spoilerlog import SpoilerLog
+from writejournal import WriteJournal
+
+
+class RandomizerContext:
+    """
+    The per-run state of one randomize() call: the game object lookups, the spoiler log, the
+    record of every patch write and the free space of the output ROM.
+
+    randomize() activates a new context when it starts, so a run never sees the state of the run
+    before it, and runs can follow one another in one process. That does not make runs at the same
+    time in threads safe: the flags, the random number generator and the seed are still module state.
+    Run seeds at the same time in processes instead, as SeedWorkerPool does.
+    """
+    def __init__(self):
+        # Game objects by id, filled by get_monsters(), get_items() and get_ranked_spells()
+        self.monsterdict = {}
+        self.itemdict = {}
+        self.spelldict = {}
+
+        # The game objects read by get_formations(), get_fsets(), get_locations(), get_zones(),
+        #   get_metamorphs(), get_espers() and get_shops(), and what is worked out from them
+        self.formdict = {}
+        self.fsetdict = {}
+        self.locations = None
+        self.locdict = {}
+        self.unused_locations = None
+        self.chest_id_counts = None
+        self.zones = None
+        self.metamorphs = None
+        self.espers = None
+        self.shops = None
+
+        # The valid spells items can cast, the spells monster AI is mutated with, and the (level, xp) and
+        #   (level, gp) of every monster read
+        self.item_spells = None
+        self.all_spells = None
+        self.monster_xps = []
+        self.monster_gps = []
+
+        # The spells item breaks already cast, the custom items that items can become, and how many
+        #   characters have been put into each vanilla item name
+        self.break_effects_used = []
+        self.custom_items = {}
+        self.mutated_item_names = {}
+
+        # The weights and averages monsters are ranked with, the palettes read for each monster graphic,
+        #   and the spells of the Wild spellset
+        self.monster_rank_weights = None
+        self.monster_rank_averages = {}
+        self.palette_pools = {}
+        self.wild_spells = None
+
+        # Chest ids not yet taken, the monster-in-a-box formations that are banned, extra, orphaned, used
+        #   and appropriate, the items chests already hold, and the event items of this run
+        self.valid_chest_ids = list(range(1, 0x200))
+        self.miab_banned_formids = [0, 0x1d7]
+        self.extra_miabs = []
+        self.orphaned_formations = None
+        self.miab_used_formations = []
+        self.done_chest_items = []
+        self.miab_appropriate_formations = None
+        self.event_items = None
+
+        # The maps the tower randomizer copies each cluster of entrances to, the formation sets it made
+        #   for each area, and the clusters read from the entrance reachability table
+        self.tower_location_exchange = {}
+        self.tower_formation_sets = {}
+        self.tower_clusters = None
+
+        # The opera cast, props and factions chosen by musicinterface.manage_opera()
+        self.opera_log = ""
+
+        # Dialogue variables, flags and patches, and whether any line of the script was replaced
+        self.dialogue_vars = {}
+        self.dialogue_flags = set()
+        self.dialogue_patches = {}
+        self.dialogue_patches_battle = {}
+        self.script_edited = False
+
+        # The spells espers teach and the bonuses they give, and which of them are already taken
+        self.esper_spells = None
+        self.used_esper_spells = set()
+        self.used_esper_bonuses = set()
+
+        # The parameters the junction patches are written with, see randomizer.junction_everything()
+        self.junction_manager_parameters = {}
+
+        # The spoiler log, by section. See randomizer.log().
+        self.randomizer_log = SpoilerLog()
+
+        # Commands replaced by randomize_commands(), and the copy of them the item randomizer works with
+        self.changed_commands = set()
+        self.item_changed_commands = set()
+
+        # Names of the areas that formation sets are encountered in, see get_namelocdict()
+        self.name_location_dict = {}
+
+        # Every Substitution.write() and the patch that made it, for Substitution.verify_all_writes()
+        self.write_journal = WriteJournal()
+
+        # The free space of the output ROM, and what has been put where. See freespace.FreeSpace.
+        self.free_space = FreeSpace()
+
+        # The StageTimer measuring this run, if stage reporting was requested
+        self.stage_timer = None
+
+
+_current_context: ContextVar[RandomizerContext] = ContextVar('randomizer_context')
+
+
+def get_context() -> RandomizerContext:
+    """
+    Returns the context of the current run. Outside a run, e.g. in tools that only read the ROM,
+    a context is created on first use.
+    """
+    try:
+        return _current_context.get()
+    except LookupError:
+        context = RandomizerContext()
+        _current_context.set(context)
+        return context
+
+
+def activate_context(context: RandomizerContext = None) -> RandomizerContext:
+    """
+    Makes context, or a brand-new context, the current one and returns it.
+    """
+    if context is None:
+        context = RandomizerContext()
+    _current_context.set(context)
+    return context
@@ -4,7 +4,7 @@ from .utils import (read_multi, write_multi, classproperty,
                     ips_patch, map_to_snes, read_lines_nocomment)
 from _io import BytesIO, BufferedRandom
 from functools import total_ordering
-from os import path
+from os import path, getpid, makedirs, remove, replace
 from hashlib import md5
 import re
 from sys import stdout
@@ -47,6 +47,11 @@ ADDRESSING_MODE = None
 MAPPINGS = {}
 PATCH_PARAMETERS = {}
 FULL_PATCH_CHANGELIST = {}
+# Raise this whenever patch_filename_to_bytecode() changes its output, so older cache files are not used
+PATCH_CACHE_VERSION = 1
+PATCH_CACHE_MAGIC = b'PBC'
+PATCH_CACHE_DIRECTORY = None
+COMPILED_PATCHES = {}
 
 
 def get_open_file(filepath, sandbox=False):
@@ -256,6 +261,19 @@ def patch_filename_to_bytecode(patchfilename, mapping=None, parameters=None):
         mapping = MAPPINGS[patchfilename]
     if mapping is not None:
         MAPPINGS[patchfilename] = mapping
+
+    cache_key = get_patch_cache_key(patchfilename, mapping)
+    compiled = get_compiled_patch(cache_key)
+    if compiled is not None:
+        patch, validation, required_parameters = compiled
+        if parameters is not None:
+            for name, value in required_parameters:
+                if name not in parameters or parameters[name] != value:
+                    raise Exception('Parameter %s does not equal %s.'
+                                    % (name, value))
+        return patch, validation
+
+    if mapping is not None:
         temp = {}
         for line in read_lines_nocomment(mapping):
             start, finish, offset = line.strip().split()
@@ -281,6 +299,10 @@ def patch_filename_to_bytecode(patchfilename, mapping=None, parameters=None):
     definitions = {}
     code_addresses = {}
     labels = {}
+    required_parameters = []
+    # Longest first, so that no name is replaced inside a longer one
+    sorted_definitions = []
+    sorted_code_addresses = []
     next_address = None
     filename = None
     read_into = patch
@@ -300,6 +322,7 @@ def patch_filename_to_bytecode(patchfilename, mapping=None, parameters=None):
 
         valparmatches = valparmatcher.findall(line)
         for to_replace, name, value in valparmatches:
+            required_parameters.append((name, value))
             if parameters is not None:
                 try:
                     assert name in parameters
@@ -341,6 +364,8 @@ def patch_filename_to_bytecode(patchfilename, mapping=None, parameters=None):
         if line.startswith(".def"):
             _, name, value = line.split(' ', 2)
             definitions[name] = value
+            sorted_definitions = sorted(definitions,
+                                        key=lambda d: (-len(d), d))
             continue
 
         if line.startswith(".addr"):
@@ -352,6 +377,8 @@ def patch_filename_to_bytecode(patchfilename, mapping=None, parameters=None):
             name = name.lstrip('$')
             address = int(value, 0x10)
             code_addresses[name] = (address, int(length))
+            sorted_code_addresses = sorted(code_addresses,
+                                           key=lambda a: (-len(a), a))
             continue
 
         if line.startswith(".label"):
@@ -367,7 +394,7 @@ def patch_filename_to_bytecode(patchfilename, mapping=None, parameters=None):
                     labels[name_with_length] = None
             continue
 
-        for name in sorted(code_addresses, key=lambda a: (-len(a), a)):
+        for name in sorted_code_addresses:
             to_replace = '${0}'.format(name)
             if to_replace in line:
                 if ':' not in line:
@@ -393,7 +420,7 @@ def patch_filename_to_bytecode(patchfilename, mapping=None, parameters=None):
                         line = line.replace(length_replace, length_replacement)
                 line = line.replace(to_replace, replacement)
 
-        for name in sorted(definitions, key=lambda d: (-len(d), d)):
+        for name in sorted_definitions:
             if name in line and not line.strip().startswith('.'):
                 line = line.replace(name, definitions[name])
 
@@ -445,10 +472,11 @@ def patch_filename_to_bytecode(patchfilename, mapping=None, parameters=None):
                 raise Exception('Label "%s" cannot contain '
                                 'definition "%s".' % (lname, defname))
 
+    sorted_labels = sorted(labels, key=lambda l: (-len(l), l))
     for read_into in (patch, validation):
         for (address, filename) in sorted(read_into):
             code = read_into[address, filename]
-            for name in sorted(labels, key=lambda l: (-len(l), l)):
+            for name in sorted_labels:
                 if name in code:
                     direct = '@%s' % name
                     if direct in code:
@@ -505,9 +533,142 @@ def patch_filename_to_bytecode(patchfilename, mapping=None, parameters=None):
             read_into[address, filename] = code
 
     f.close()
+    put_compiled_patch(cache_key, patch, validation, required_parameters)
     return patch, validation
 
 
+def get_patch_cache_key(patchfilename, mapping=None):
+    '''
+    Everything the bytecode of a patch depends on: the patch and mapping
+    files, the patch parameters set so far and the addressing mode.
+    '''
+    key = md5()
+    key.update(b'%d' % PATCH_CACHE_VERSION)
+    for filename in (patchfilename, mapping):
+        if filename is None:
+            key.update(b'\x00')
+            continue
+        with open(filename, 'rb') as f:
+            data = f.read()
+        key.update(b'%d:' % len(data))
+        key.update(data)
+    key.update(repr(sorted((name, repr(value)) for (name, value)
+                           in PATCH_PARAMETERS.items())).encode())
+    key.update(repr(ADDRESSING_MODE).encode())
+    return key.hexdigest()
+
+
+def compiled_patch_to_bytes(patch, validation, required_parameters):
+    def write_string(s):
+        s = s.encode('utf8')
+        data.extend(len(s).to_bytes(length=2, byteorder='little'))
+        data.extend(s)
+
+    data = bytearray(PATCH_CACHE_MAGIC)
+    data.append(PATCH_CACHE_VERSION)
+    for patchdict in (patch, validation):
+        data.extend(len(patchdict).to_bytes(length=4, byteorder='little'))
+        for (address, filename), code in sorted(
+                patchdict.items(), key=lambda item: (item[0][0],
+                                                     item[0][1] or '')):
+            data.extend(address.to_bytes(length=4, byteorder='little'))
+            if filename is None:
+                data.append(0)
+            else:
+                data.append(1)
+                write_string(filename)
+            data.extend(len(code).to_bytes(length=4, byteorder='little'))
+            data.extend(code)
+    data.extend(len(required_parameters).to_bytes(length=2,
+                                                  byteorder='little'))
+    for name, value in required_parameters:
+        write_string(name)
+        write_string(value)
+    return bytes(data)
+
+
+def bytes_to_compiled_patch(data):
+    f = BytesIO(data)
+    if (f.read(len(PATCH_CACHE_MAGIC)) != PATCH_CACHE_MAGIC
+            or ord(f.read(1)) != PATCH_CACHE_VERSION):
+        raise ValueError('Not a compiled patch.')
+
+    def read_number(length):
+        number = f.read(length)
+        if len(number) != length:
+            raise ValueError('Compiled patch is truncated.')
+        return int.from_bytes(number, byteorder='little')
+
+    def read_string():
+        return f.read(read_number(2)).decode('utf8')
+
+    patchdicts = []
+    for _ in range(2):
+        patchdict = {}
+        for _ in range(read_number(4)):
+            address = read_number(4)
+            filename = read_string() if read_number(1) else None
+            length = read_number(4)
+            code = bytearray(f.read(length))
+            if len(code) != length:
+                raise ValueError('Compiled patch is truncated.')
+            patchdict[address, filename] = code
+        patchdicts.append(patchdict)
+    required_parameters = [(read_string(), read_string())
+                           for _ in range(read_number(2))]
+    if f.read():
+        raise ValueError('Compiled patch has trailing data.')
+    patch, validation = patchdicts
+    return patch, validation, required_parameters
+
+
+def get_compiled_patch(cache_key):
+    '''
+    Returns fresh copies of the patch and validation bytecode stored under
+    cache_key, with the parameters the patch text requires, or None.
+    '''
+    data = COMPILED_PATCHES.get(cache_key)
+    if data is None and PATCH_CACHE_DIRECTORY is not None:
+        try:
+            with open(path.join(PATCH_CACHE_DIRECTORY,
+                                '%s.pbc' % cache_key), 'rb') as f:
+                data = f.read()
+            bytes_to_compiled_patch(data)
+        except (OSError, ValueError, TypeError, UnicodeDecodeError):
+            data = None
+        if data is not None:
+            COMPILED_PATCHES[cache_key] = data
+    if data is None:
+        return None
+    return bytes_to_compiled_patch(data)
+
+
+def put_compiled_patch(cache_key, patch, validation, required_parameters):
+    data = compiled_patch_to_bytes(patch, validation, required_parameters)
+    COMPILED_PATCHES[cache_key] = data
+    if PATCH_CACHE_DIRECTORY is None:
+        return
+    cache_path = path.join(PATCH_CACHE_DIRECTORY, '%s.pbc' % cache_key)
+    temp_path = '%s.%s.tmp' % (cache_path, getpid())
+    try:
+        makedirs(PATCH_CACHE_DIRECTORY, exist_ok=True)
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        replace(temp_path, cache_path)
+    except OSError:
+        # The cache is only an optimization, so a read-only directory is fine
+        if path.exists(temp_path):
+            try:
+                remove(temp_path)
+            except OSError:
+                pass
+
+
+def set_patch_cache_directory(directory):
+    global PATCH_CACHE_DIRECTORY
+    PATCH_CACHE_DIRECTORY = directory
+
+
 def select_patches():
     if not OPTION_FILENAMES:
         return
@@ -718,6 +879,17 @@ def get_activated_patches():
     return list(PATCH_FILENAMES)
 
 
+def reset_patches():
+    # Forget the patches written so far, their parameters and their changes,
+    # so that the next run writes every patch to its own output buffer again
+    ALREADY_PATCHED.clear()
+    PATCH_PARAMETERS.clear()
+    FULL_PATCH_CHANGELIST.clear()
+    for filenames in [PATCH_FILENAMES, OPTION_FILENAMES, NOVERIFY_PATCHES,
+                      CMP_PATCH_FILENAMES]:
+        del filenames[:]
+
+
 def sort_good_order(objects):
     objects = sorted(objects, key=lambda o: o.__name__)
     objects = [o for o in objects if o.__name__ in TABLE_SPECS]
@@ -1,17 +1,20 @@
 import os
+import struct
 import traceback
+from heapq import merge
 from .tools.tablereader import (
     set_global_label, set_global_table_filename, determine_global_table,
     set_table_specs, set_global_output_file_buffer, sort_good_order,
-    get_open_file, TableObject, addresses, write_patches)
+    get_open_file, TableObject, addresses, write_patches, reset_table_objects)
 from .tools.utils import cached_property, get_transparency, utilrandom as random
 from .tools.interface import get_outfile, set_seed, get_seed
 from hashlib import md5
-from PIL import Image, ImageOps
+from PIL import Image, ImageOps, __version__ as pillow_version
 from math import ceil
 from time import time
 from multiprocessing import Pipe
 from io import BytesIO
+from collections import Counter, defaultdict
 from collections.abc import Callable
 
 VERSION = '5.3'
@@ -24,18 +27,228 @@ outfile_rom_buffer = None
 seed = None
 pipe_print = lambda output, connection: print(output)
 
+# Raise this whenever prepare_image changes its output, so that sprites prepared by older versions are rebuilt
+SPRITE_CACHE_VERSION = 1
+SPRITE_CACHE_MAGIC = b'RMSC'
+# mtime in nanoseconds, file size, md5 of the file, width, height, 8-color flag
+SPRITE_CACHE_RECORD = struct.Struct('<qQ16sHHB')
+
+# Set to check every tile conversion by converting the result back, which is slow
+DEBUG_TILE_CODEC = False
+# A tile is kept as 64 palette indexes, row by row
+BLANK_TILE = bytes(64)
+# Byte j of PLANE_SPREAD[v], as 8 big-endian bytes, is bit 7 - j of the bitplane byte v: one bitplane of a row
+#   of 8 pixels. PLANE_GATHER turns a row of pixels masked with PLANE_MASK back into its bitplane byte.
+PLANE_SPREAD = [sum(((v >> b) & 1) << (8 * b) for b in range(8)) for v in range(0x100)]
+PLANE_GATHER = {spread: v for v, spread in enumerate(PLANE_SPREAD)}
+PLANE_MASK = 0x0101010101010101
+
 
 def sig_func(c):
     s = '%s%s' % (c.filename, get_seed())
     return md5(s.encode()).hexdigest(), c.filename
 
 
+def _deinterleave_tiles(data, is_8color):
+    spread = PLANE_SPREAD
+    tile_size = 24 if is_8color else 32
+    tiles = []
+    for offset in range(0, len(data) - tile_size + 1, tile_size):
+        tile = data[offset:offset + tile_size]
+        pixels = 0
+        for i in range(8):
+            row = spread[tile[i * 2]] | (spread[tile[(i * 2) + 1]] << 1)
+            if is_8color:
+                row |= spread[tile[i + 16]] << 2
+            else:
+                row |= (spread[tile[(i * 2) + 16]] << 2) | (spread[tile[(i * 2) + 17]] << 3)
+            pixels = (pixels << 64) | row
+        tiles.append(pixels.to_bytes(64, 'big'))
+    return tiles
+
+
+def _interleave_tiles(tiles, is_8color):
+    gather = PLANE_GATHER
+    tile_size = 24 if is_8color else 32
+    data = bytearray(tile_size * len(tiles))
+    for offset, tile in zip(range(0, len(data), tile_size), tiles):
+        for i in range(8):
+            row = int.from_bytes(tile[i * 8:(i * 8) + 8], 'big')
+            data[offset + (i * 2)] = gather[row & PLANE_MASK]
+            data[offset + (i * 2) + 1] = gather[(row >> 1) & PLANE_MASK]
+            if is_8color:
+                data[offset + i + 16] = gather[(row >> 2) & PLANE_MASK]
+            else:
+                data[offset + (i * 2) + 16] = gather[(row >> 2) & PLANE_MASK]
+                data[offset + (i * 2) + 17] = gather[(row >> 3) & PLANE_MASK]
+    return bytes(data)
+
+
+def deinterleave_tiles(data: bytes, is_8color: bool) -> list:
+    """
+    Converts SNES planar graphics, 3bpp if is_8color and 4bpp otherwise, into tiles of 64 palette indexes each.
+    """
+    tiles = _deinterleave_tiles(data, is_8color)
+    if DEBUG_TILE_CODEC:
+        tile_size = 24 if is_8color else 32
+        assert _interleave_tiles(tiles, is_8color) == bytes(data[:len(tiles) * tile_size])
+    return tiles
+
+
+def interleave_tiles(tiles: list, is_8color: bool) -> bytes:
+    """
+    Converts tiles of 64 palette indexes each into SNES planar graphics, 3bpp if is_8color and 4bpp otherwise.
+    Palette indexes that do not fit are cut to their lowest bits.
+    """
+    data = _interleave_tiles(tiles, is_8color)
+    if DEBUG_TILE_CODEC:
+        assert all(len(tile) == 64 and max(tile) <= (7 if is_8color else 0xf) for tile in tiles)
+        assert _deinterleave_tiles(data, is_8color) == [bytes(tile) for tile in tiles]
+    return data
+
+
+def split_tiles(pixels: bytes, width_tiles: int) -> list:
+    # Cuts an image width_tiles tiles wide into its tiles, row by row
+    row_size = width_tiles * 8
+    tiles = []
+    for top in range(0, len(pixels), row_size * 8):
+        for left in range(top, top + row_size, 8):
+            tiles.append(b''.join(pixels[start:start + 8]
+                                  for start in range(left, left + (row_size * 8), row_size)))
+    return tiles
+
+
+def join_tiles(tiles: list, width_tiles: int) -> bytes:
+    # Puts tiles together, row by row, into an image width_tiles tiles wide
+    rows = []
+    for first in range(0, len(tiles), width_tiles):
+        row_tiles = tiles[first:first + width_tiles]
+        for i in range(0, 64, 8):
+            rows.extend(tile[i:i + 8] for tile in row_tiles)
+    return b''.join(rows)
+
+
 def reseed(s):
     s = '%s%s' % (get_seed(), s)
     value = int(md5(s.encode('ascii')).hexdigest(), 0x10)
     random.seed(value)
 
 
+class SpriteIndex:
+    """
+    The imported images bucketed by their size in tiles, with the images of every tag and the images already
+    used, so that choosing an image for a monster looks at a few buckets instead of every image.
+
+    A monster's candidates are the unused images of the buckets that fit it, in the order select_image has
+    always used: by size compatibility, then by sig_func. The buckets are merged into that order once per
+    monster size, and every whitelist and blacklist in use keeps a count of the unused images it allows in
+    each bucket. The candidate at an index is found by walking back from the best fit, where the choice
+    almost always lands.
+    """
+    def __init__(self, images):
+        self.images = images
+        self.signatures = {image.filename: sig_func(image) for image in images}
+        # (width in tiles, height in tiles, is big) -> images sorted by sig_func
+        self.buckets = {}
+        for image in images:
+            width, height = ceil(image.width / 8), ceil(image.height / 8)
+            self.buckets.setdefault((width, height, image.width > 64 or image.height > 64), []).append(image)
+        for bucket in self.buckets.values():
+            bucket.sort(key=lambda image: self.signatures[image.filename])
+        # filename -> bucket -> how many of its images have that filename
+        self.filename_buckets = defaultdict(Counter)
+        self.tag_filenames = defaultdict(set)
+        for key, bucket in self.buckets.items():
+            for image in bucket:
+                self.filename_buckets[image.filename][key] += 1
+                for tag in image.tags:
+                    self.tag_filenames[tag].add(image.filename)
+        self.used = set()
+        self.groups = {}
+        self.filters = {}
+
+    def use(self, filename):
+        if filename in self.used:
+            return
+        self.used.add(filename)
+        for whitelisted, blacklisted, available in self.filters.values():
+            if (whitelisted is None or filename in whitelisted) and filename not in blacklisted:
+                for key, count in self.filename_buckets[filename].items():
+                    available[key] -= count
+
+    def get_filter(self, whitelist=None, blacklist=None):
+        """
+        Returns the filter for the images with every tag in whitelist and no tag in blacklist, as the whitelisted
+        filenames (None for all of them), the blacklisted filenames and how many unused images it allows in
+        each bucket.
+        """
+        key = (frozenset(whitelist or ()), frozenset(blacklist or ()))
+        if key not in self.filters:
+            whitelisted = None
+            if whitelist:
+                tags = sorted(whitelist, key=lambda tag: len(self.tag_filenames.get(tag, ())))
+                whitelisted = set(self.tag_filenames.get(tags[0], ())).intersection(
+                    *[self.tag_filenames.get(tag, ()) for tag in tags[1:]])
+            blacklisted = set().union(*[self.tag_filenames.get(tag, ()) for tag in blacklist or ()])
+            available = Counter()
+            if whitelisted is None:
+                for image_key, bucket in self.buckets.items():
+                    available[image_key] = len(bucket)
+                filenames, sign = blacklisted, -1
+            else:
+                filenames, sign = whitelisted - blacklisted, 1
+            for filename in filenames:
+                for image_key, count in self.filename_buckets[filename].items():
+                    available[image_key] += sign * count
+            for filename in self.used:
+                if (whitelisted is None or filename in whitelisted) and filename not in blacklisted:
+                    for image_key, count in self.filename_buckets[filename].items():
+                        available[image_key] -= count
+            self.filters[key] = (whitelisted, blacklisted, available)
+        return self.filters[key]
+
+    def get_groups(self, mso, big_only=False):
+        """
+        Returns the buckets that fit mso as (bucket keys, images) groups, one per size compatibility from
+        worst to best, with the images of each group merged in sig_func order.
+        """
+        key = (mso.max_width_tiles, mso.max_height_tiles, mso.width_tiles, mso.height_tiles, big_only)
+        if key not in self.groups:
+            scores = {}
+            for width, height, is_big in self.buckets:
+                if width > mso.max_width_tiles or height > mso.max_height_tiles or (big_only and not is_big):
+                    continue
+                scores.setdefault(mso.get_size_score(width, height), []).append((width, height, is_big))
+            self.groups[key] = [
+                (keys, list(merge(*[self.buckets[k] for k in keys],
+                                  key=lambda image: self.signatures[image.filename])))
+                for _, keys in sorted(scores.items())]
+        return self.groups[key]
+
+    @staticmethod
+    def count(groups, image_filter):
+        # How many unused images that image_filter allows are in each group
+        available = image_filter[2]
+        return [sum(available[key] for key in keys) for keys, _ in groups]
+
+    def get(self, groups, counts, index, image_filter):
+        # The image at index among the images that count() counted, in group order
+        whitelisted, blacklisted, _ = image_filter
+        from_end = sum(counts) - 1 - index
+        for (_, images), count in zip(reversed(groups), reversed(counts)):
+            if from_end >= count:
+                from_end -= count
+                continue
+            for image in reversed(images):
+                if (image.filename in self.used or image.filename in blacklisted
+                        or (whitelisted is not None and image.filename not in whitelisted)):
+                    continue
+                if not from_end:
+                    return image
+                from_end -= 1
+        raise IndexError(index)
+
+
 class MouldObject(TableObject):
     # Moulds are templates for what enemy sizes are allowed
     # in an enemy formation. Enemies are generally 4, 8, 12, or 16
@@ -76,7 +289,7 @@ class FormationObject(TableObject):
 class MonsterSpriteObject(TableObject):
     SUPER_PROTECTED_INDEXES = [0x106]
     PROTECTED_INDEXES = list(range(0x180, 0x1a0)) + [0x12a]
-    DONE_IMAGES = []
+    sprite_index = None
 
     def __repr__(self):
         if hasattr(self, 'image') and hasattr(self.image, 'filename'):
@@ -165,69 +378,6 @@ class MonsterSpriteObject(TableObject):
             return True
         return False
 
-    def deinterleave_tile(self, tile):
-        rows = []
-        old_bit_count = sum([bin(v).count('1') for v in tile])
-        for i in range(8):
-            if self.is_8color:
-                interleaved = (tile[i * 2], tile[(i * 2) + 1],
-                               tile[i + 16])
-            else:
-                interleaved = (tile[i * 2], tile[(i * 2) + 1],
-                               tile[(i * 2) + 16], tile[(i * 2) + 17])
-            row = []
-            for j in range(7, -1, -1):
-                pixel = 0
-                mask = 1 << j
-                for k, v in enumerate(interleaved):
-                    pixel |= bool(v & mask) << k
-
-                if self.is_8color:
-                    assert 0 <= pixel <= 7
-                else:
-                    assert 0 <= pixel <= 0xf
-                row.append(pixel)
-
-            assert len(row) == 8
-            rows.append(row)
-
-        assert len(rows) == 8
-        # assert self.interleave_tile(rows) == tile
-        new_bit_count = sum([bin(v).count('1') for vs in rows for v in vs])
-        assert old_bit_count == new_bit_count
-        return rows
-
-    def interleave_tile(self, old_tile):
-        if self.is_8color:
-            new_tile = [0] * 24
-        else:
-            new_tile = [0] * 32
-
-        old_bit_count = sum([bin(v).count('1') for vs in old_tile for v in vs])
-        assert len(old_tile) == 8
-        for (j, old_row) in enumerate(old_tile):
-            assert len(old_row) == 8
-            for (i, pixel) in enumerate(old_row):
-                i = 7 - i
-                a = bool(pixel & 1)
-                b = bool(pixel & 2)
-                c = bool(pixel & 4)
-                d = bool(pixel & 8)
-
-                new_tile[(j * 2)] |= (a << i)
-                new_tile[(j * 2) + 1] |= (b << i)
-                if self.is_8color:
-                    new_tile[j + 16] |= (c << i)
-                else:
-                    new_tile[(j * 2) + 16] |= (c << i)
-                    new_tile[(j * 2) + 17] |= (d << i)
-
-        new_bit_count = sum([bin(v).count('1') for v in new_tile])
-
-        assert old_bit_count == new_bit_count
-        assert self.deinterleave_tile(new_tile) == old_tile
-        return bytes(new_tile)
-
     @property
     def tiles(self):
         if hasattr(self, '_tiles'):
@@ -238,48 +388,33 @@ class MonsterSpriteObject(TableObject):
         else:
             num_bytes = 32
 
-        tiles = []
-        for i in range(self.num_tiles):
-            outfile_rom_buffer.seek(self.sprite_pointer + (num_bytes * i))
-            tiles.append(self.deinterleave_tile(outfile_rom_buffer.read(num_bytes)))
-
-        self._tiles = tiles
+        outfile_rom_buffer.seek(self.sprite_pointer)
+        self._tiles = deinterleave_tiles(outfile_rom_buffer.read(num_bytes * self.num_tiles), self.is_8color)
         return self.tiles
 
     @property
     def all_pixels(self):
-        tiles = list(self.tiles)
+        tiles = iter(self.tiles)
         if self.is_big:
             width = 16
         else:
             width = 8
 
-        blank_tile = [[0] * 8] * 8
-
         height = width
-        rows = []
+        grid = []
         for y in range(height):
-            row = []
+            stencil_value = self.stencil[y]
+            if self.is_big:
+                stencil_value = ((stencil_value >> 8) |
+                                 ((stencil_value & 0xff) << 8))
             for x in range(width):
-                stencil_value = self.stencil[y]
-                if self.is_big:
-                    stencil_value = ((stencil_value >> 8) |
-                                     ((stencil_value & 0xff) << 8))
                 to_tile = stencil_value & (1 << (width - (x + 1)))
                 if to_tile:
-                    row.append(tiles.pop(0))
+                    grid.append(next(tiles))
                 else:
-                    row.append(blank_tile)
-            rows.append(row)
-
-        all_pixels = []
-        for row in rows:
-            for i in range(8):
-                for tile in row:
-                    tile_row = tile[i]
-                    all_pixels.extend(tile_row)
+                    grid.append(BLANK_TILE)
 
-        return all_pixels
+        return join_tiles(grid, width)
 
     @property
     def palette_indexes(self):
@@ -354,17 +489,20 @@ class MonsterSpriteObject(TableObject):
         if width > self.max_width_tiles or height > self.max_height_tiles:
             return None
 
+        score = self.get_size_score(width, height)
+        self._image_scores[image.filename] = score
+
+        return self.get_size_compatibility(image)
+
+    def get_size_score(self, width, height):
         a, b = max(width, self.width_tiles), min(width, self.width_tiles)
         width_score = b / a
         a, b = max(height, self.height_tiles), min(height, self.height_tiles)
         height_score = b / a
 
-        score = width_score * height_score
-        self._image_scores[image.filename] = score
-
-        return self.get_size_compatibility(image)
+        return width_score * height_score
 
-    def select_image(self, list_of_monsters, images=None):
+    def select_image(self, list_of_monsters, big_only=None):
         monster_original_name = None
         if self.get_index() < len(list_of_monsters):
             monster_original_name = list_of_monsters[self.get_index()].name.strip("_")
@@ -378,24 +516,27 @@ class MonsterSpriteObject(TableObject):
             self.load_image(self.image)
             return True
 
-        if images is None:
-            images = MonsterSpriteObject.import_images
-            if len(images) == len(self.DONE_IMAGES):
+        sprite_index = MonsterSpriteObject.sprite_index
+        # big_only is None on the first attempt, and on a retry whether the first attempt
+        #   kept to big images
+        is_retry = big_only is not None
+        if not is_retry:
+            if len(sprite_index.images) == len(sprite_index.used):
                 return False
+            big_only = False
 
-        candidates = [i for i in images if
-                      i.filename not in self.DONE_IMAGES and
-                      self.get_size_compatibility(i) is not None
-                      ]
+        whitelist = self.whitelist if hasattr(self, 'whitelist') else None
+        blacklist = self.blacklist if hasattr(self, 'blacklist') else None
+        image_filter = sprite_index.get_filter(whitelist, blacklist)
 
-        if self.is_actually_big and random.random() > 0.1:
-            temp = [c for c in candidates if c.width > 64 or c.height > 64]
-            candidates = temp or candidates
+        if self.is_actually_big and random.random() > 0.1 and not big_only:
+            # A retry only picks from the images the first attempt allowed, so the tags count there
+            big_filter = image_filter if is_retry else sprite_index.get_filter()
+            big_only = sum(sprite_index.count(sprite_index.get_groups(self, True), big_filter)) > 0
+        groups = sprite_index.get_groups(self, big_only)
 
-        if hasattr(self, 'whitelist') and self.whitelist:
-            candidates = [c for c in candidates
-                          if hasattr(c, 'tags') and c.tags >= self.whitelist]
-            if not candidates:
+        if whitelist:
+            if not sum(sprite_index.count(groups, sprite_index.get_filter(whitelist))):
                 # There were no eligible sprites matching the whitelistd tags
                 if monster_original_name:
                     pipe_print(
@@ -407,10 +548,9 @@ class MonsterSpriteObject(TableObject):
                 self.load_image(self.image)
                 return True
 
-        if hasattr(self, 'blacklist') and self.blacklist:
-            candidates = [c for c in candidates if not
-            (hasattr(c, 'tags') and c.tags & self.blacklist)]
-            if not candidates:
+        counts = sprite_index.count(groups, image_filter)
+        if blacklist:
+            if not sum(counts):
                 if monster_original_name:
                     pipe_print(
                         output="Remonsterate: " + monster_original_name + " was not sprite randomized: " +
@@ -421,7 +561,7 @@ class MonsterSpriteObject(TableObject):
                 self.load_image(self.image)
                 return True
 
-        if not candidates:
+        if not sum(counts):
             self.load_image(self.image)
             if monster_original_name:
                 pipe_print(
@@ -431,21 +571,17 @@ class MonsterSpriteObject(TableObject):
                 )
             return True
 
-        def sort_func(c):
-            return self.get_size_compatibility(c), sig_func(c)
-
-        candidates = sorted(candidates, key=sort_func)
-        max_index = len(candidates) - 1
+        max_index = sum(counts) - 1
         index = random.randint(
             random.randint(random.randint(0, max_index), max_index), max_index)
 
-        chosen = candidates[index]
+        chosen = sprite_index.get(groups, counts, index, image_filter)
 
-        self.DONE_IMAGES.append(chosen.filename)
+        sprite_index.use(chosen.filename)
 
         result = self.load_image(chosen)
         if not result:
-            self.select_image(images=candidates, list_of_monsters=list_of_monsters)
+            self.select_image(list_of_monsters=list_of_monsters, big_only=big_only)
         return True
 
     def remap_palette(self, data, rgb_palette):
@@ -558,7 +694,6 @@ class MonsterSpriteObject(TableObject):
                     new_height = self.image.height
                     assert height == new_height + 8
 
-        blank_tile = [[0] * 8] * 8
         new_tiles = []
         stencil = []
         if self.is_big:
@@ -571,24 +706,20 @@ class MonsterSpriteObject(TableObject):
         if not preserve_palette_order:
             data, self._palette = remapped
 
+        # Place the image in the top left corner of the full sprite area and cut that into tiles
+        side = num_tiles_width * 8
+        image_width = self.image.width
+        canvas = bytearray(side * side)
+        for y in range(min(len(data) // image_width, side)):
+            row = data[y * image_width:(y * image_width) + min(image_width, side)]
+            canvas[y * side:(y * side) + len(row)] = row
+        all_tiles = split_tiles(canvas, num_tiles_width)
+
         for jj in range(num_tiles_width):
             stencil_value = 0
             for ii in range(num_tiles_width):
-                tile = []
-                for j in range(8):
-                    row = []
-                    y = (jj * 8) + j
-                    for i in range(8):
-                        x = (ii * 8) + i
-                        if x >= self.image.width:
-                            row.append(0)
-                            continue
-                        try:
-                            row.append(int(data[(y * self.image.width) + x]))
-                        except IndexError:
-                            row.append(0)
-                    tile.append(row)
-                if tile == blank_tile:
+                tile = all_tiles[(jj * num_tiles_width) + ii]
+                if tile == BLANK_TILE:
                     pass
                 else:
                     new_tiles.append(tile)
@@ -616,76 +747,66 @@ class MonsterSpriteObject(TableObject):
         self.low_palette_index = chosen_palette.index & 0xff
         assert self.palette_index == chosen_palette.index
 
-        for mso in MonsterSpriteObject.every:
-            if self.pair_protected:
-                break
-            if (hasattr(mso, 'written') and mso.written
-                    and mso.stencil == self.stencil):
-                self.stencil_index = mso.stencil_index
-                break
-        else:
-            assert self.pair_protected is None
-            if self.is_big:
-                mco = MonsterComp16Object.create_new()
+        if not hasattr(MonsterSpriteObject, 'free_space'):
+            MonsterSpriteObject.free_space = addresses.new_monster_graphics
+            # Stencils and graphics already in the ROM, so that identical ones are written only once
+            MonsterSpriteObject.stencil_indexes = {}
+            MonsterSpriteObject.graphics_pointers = {}
+
+        stencil_key = (self.is_big, tuple(self.stencil))
+        if self.pair_protected is None:
+            if stencil_key in MonsterSpriteObject.stencil_indexes:
+                self.stencil_index = MonsterSpriteObject.stencil_indexes[stencil_key]
             else:
-                mco = MonsterComp8Object.create_new()
-            mco.stencil = self.stencil
-            self.stencil_index = mco.new_index
+                if self.is_big:
+                    mco = MonsterComp16Object.create_new()
+                else:
+                    mco = MonsterComp8Object.create_new()
+                mco.stencil = self.stencil
+                self.stencil_index = mco.new_index
         if not self.stencil_index <= 0xff:
             raise OverflowError()
         #assert self.stencil_index <= 0xff
 
-        if not hasattr(MonsterSpriteObject, 'free_space'):
-            MonsterSpriteObject.free_space = addresses.new_monster_graphics
-
-        for mso in MonsterSpriteObject.every:
-            if self.pair_protected:
-                break
-            if (hasattr(mso, 'written') and mso.written
-                    and mso.stencil == self.stencil
-                    and mso.tiles == self.tiles):
-                self.misc_sprite_pointer = mso.misc_sprite_pointer
-                break
-        else:
-            assert self.pair_protected is None
-            DIVISION_FACTOR = 16
-            remainder = MonsterSpriteObject.free_space % DIVISION_FACTOR
-            if remainder:
-                MonsterSpriteObject.free_space += (DIVISION_FACTOR - remainder)
-            assert not MonsterSpriteObject.free_space % DIVISION_FACTOR
-
-            pointer = (MonsterSpriteObject.free_space -
-                       addresses.new_monster_graphics)
-            pointer //= DIVISION_FACTOR
-            assert 0 <= pointer <= 0x7fff
-
+        data = interleave_tiles(self.tiles, self.is_8color)
+        if self.pair_protected is None:
+            # The pointer only locates the graphics, so any sprite with the same bytes can share them,
+            #   whatever its stencil. The 8-color flag is the sprite's own.
             self.misc_sprite_pointer &= 0x8000
-            self.misc_sprite_pointer |= pointer
-            check = (((self.misc_sprite_pointer & 0x7FFF) * DIVISION_FACTOR)
-                     + addresses.new_monster_graphics)
-            assert check == MonsterSpriteObject.free_space
-            remainder = MonsterSpriteObject.free_space % DIVISION_FACTOR
-            if remainder:
-                MonsterSpriteObject.free_space += (DIVISION_FACTOR - remainder)
-
-            outfile_rom_buffer.seek(MonsterSpriteObject.free_space)
-            data = bytes([v for tile in self.tiles
-                          for v in self.interleave_tile(tile)])
-            outfile_rom_buffer.write(data)
-
-            if self.is_8color:
-                MonsterSpriteObject.free_space += (len(self.tiles) * 24)
+            if data in MonsterSpriteObject.graphics_pointers:
+                self.misc_sprite_pointer |= MonsterSpriteObject.graphics_pointers[data]
             else:
-                MonsterSpriteObject.free_space += (len(self.tiles) * 32)
+                DIVISION_FACTOR = 16
+                remainder = MonsterSpriteObject.free_space % DIVISION_FACTOR
+                if remainder:
+                    MonsterSpriteObject.free_space += (DIVISION_FACTOR - remainder)
+                assert not MonsterSpriteObject.free_space % DIVISION_FACTOR
+
+                pointer = (MonsterSpriteObject.free_space -
+                           addresses.new_monster_graphics)
+                pointer //= DIVISION_FACTOR
+                assert 0 <= pointer <= 0x7fff
+
+                self.misc_sprite_pointer |= pointer
+                check = (((self.misc_sprite_pointer & 0x7FFF) * DIVISION_FACTOR)
+                         + addresses.new_monster_graphics)
+                assert check == MonsterSpriteObject.free_space
+
+                outfile_rom_buffer.seek(MonsterSpriteObject.free_space)
+                outfile_rom_buffer.write(data)
+                MonsterSpriteObject.free_space += len(data)
 
-            assert outfile_rom_buffer.tell() == MonsterSpriteObject.free_space
-            assert MonsterSpriteObject.free_space < addresses.new_comp8_pointer
+                assert outfile_rom_buffer.tell() == MonsterSpriteObject.free_space
+                assert MonsterSpriteObject.free_space < addresses.new_comp8_pointer
 
         if self.pair_protected is not None:
             assert self.pair_protected.written
             for attr in ['misc_sprite_pointer', 'stencil_index',
                          'misc_palette_index', 'low_palette_index']:
                 setattr(self, attr, getattr(self.pair_protected, attr))
+        else:
+            MonsterSpriteObject.stencil_indexes.setdefault(stencil_key, self.stencil_index)
+            MonsterSpriteObject.graphics_pointers.setdefault(data, self.misc_sprite_pointer & 0x7FFF)
 
         super().write_data()
         self.written = True
@@ -902,12 +1023,187 @@ def prepare_image(image: Image) -> Image:
     return image
 
 
+def read_sprite_cache(cache_filename: str) -> dict:
+    """
+    Reads the prepared sprites stored in cache_filename, keyed by their path in images_and_tags.txt. Returns
+    an empty cache if the file is missing, damaged, or was written by another cache version or Pillow version,
+    since a different Pillow can quantize images differently.
+    """
+    try:
+        with open(cache_filename, 'rb') as cache_file:
+            data = cache_file.read()
+    except OSError:
+        return {}
+
+    position = 0
+
+    def read(length):
+        nonlocal position
+        if position + length > len(data):
+            raise ValueError('Sprite cache is truncated.')
+        position += length
+        return data[position - length:position]
+
+    def read_number(length):
+        return int.from_bytes(read(length), byteorder='little')
+
+    def read_string():
+        return read(read_number(2)).decode('utf8')
+
+    try:
+        if read(len(SPRITE_CACHE_MAGIC)) != SPRITE_CACHE_MAGIC or read_number(1) != SPRITE_CACHE_VERSION:
+            return {}
+        if read_string() != pillow_version:
+            return {}
+        sprites = {}
+        for _ in range(read_number(4)):
+            image_filename = read_string()
+            mtime, size, file_hash, width, height, is_8color = SPRITE_CACHE_RECORD.unpack(
+                read(SPRITE_CACHE_RECORD.size))
+            palette = list(read(read_number(2)))
+            tags = {read_string() for _ in range(read_number(2))}
+            pixels = read(read_number(4))
+            if len(pixels) != width * height:
+                raise ValueError('Sprite cache has a damaged image.')
+            sprites[image_filename] = {'mtime': mtime, 'size': size, 'hash': file_hash, 'width': width,
+                                       'height': height, 'is_8color': bool(is_8color), 'palette': palette,
+                                       'tags': tags, 'pixels': pixels}
+        return sprites
+    except (ValueError, UnicodeDecodeError):
+        return {}
+
+
+def write_sprite_cache(cache_filename: str, sprites: dict):
+    def write_string(string):
+        string = string.encode('utf8')
+        data.extend(len(string).to_bytes(length=2, byteorder='little'))
+        data.extend(string)
+
+    data = bytearray(SPRITE_CACHE_MAGIC)
+    data.append(SPRITE_CACHE_VERSION)
+    write_string(pillow_version)
+    data.extend(len(sprites).to_bytes(length=4, byteorder='little'))
+    for image_filename, sprite in sorted(sprites.items()):
+        write_string(image_filename)
+        data.extend(SPRITE_CACHE_RECORD.pack(sprite['mtime'], sprite['size'], sprite['hash'], sprite['width'],
+                                             sprite['height'], sprite['is_8color']))
+        data.extend(len(sprite['palette']).to_bytes(length=2, byteorder='little'))
+        data.extend(bytes(sprite['palette']))
+        data.extend(len(sprite['tags']).to_bytes(length=2, byteorder='little'))
+        for tag in sorted(sprite['tags']):
+            write_string(tag)
+        data.extend(len(sprite['pixels']).to_bytes(length=4, byteorder='little'))
+        data.extend(sprite['pixels'])
+
+    temp_filename = '%s.%d.tmp' % (cache_filename, os.getpid())
+    try:
+        with open(temp_filename, 'wb') as cache_file:
+            cache_file.write(data)
+        # Replacing the file in one step means other runs never read a half-written cache
+        os.replace(temp_filename, cache_filename)
+    except OSError:
+        # The cache is only an optimization. A read-only directory should not stop remonsterate.
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+
+
+def get_prepared_sprite(image_filename: str, tags: set, sprites: dict) -> bool:
+    """
+    Makes sure sprites holds the prepared version of the image at image_filename in the sprites directory,
+    tagged with tags. An image is only prepared again if its size or modification time changed and its
+    contents did too. Returns whether sprites was changed.
+    """
+    image_path = os.path.join(sprite_paths, image_filename)
+    stat = os.stat(image_path)
+    sprite = sprites.get(image_filename)
+    changed = False
+    if sprite is None or (sprite['mtime'], sprite['size']) != (stat.st_mtime_ns, stat.st_size):
+        with open(image_path, 'rb') as image_file:
+            file_hash = md5(image_file.read()).digest()
+        if sprite is None or sprite['hash'] != file_hash:
+            with Image.open(image_path) as image:
+                image = prepare_image(image)
+                if image.mode != 'P':
+                    image = image.convert(mode='P')
+                pixels = image.tobytes()
+                sprite = {'hash': file_hash, 'width': image.width, 'height': image.height,
+                          'is_8color': max(pixels) <= 7, 'palette': image.getpalette(), 'pixels': pixels}
+        sprite['mtime'] = stat.st_mtime_ns
+        sprite['size'] = stat.st_size
+        sprites[image_filename] = sprite
+        changed = True
+    if sprite.get('tags') != tags:
+        sprite['tags'] = set(tags)
+        changed = True
+    return changed
+
+
+def sprite_to_image(image_filename: str, sprite: dict) -> Image:
+    image = Image.frombytes(mode='P', size=(sprite['width'], sprite['height']), data=sprite['pixels'])
+    image.putpalette(sprite['palette'])
+    image.filename = os.path.join(sprite_paths, image_filename)
+    image.tags = set(sprite['tags'])
+    image.is_8color = sprite['is_8color']
+    return image
+
+
 def remonsterate(connection: Pipe, print_method: Callable, **kwargs):
     global randomize_connection
     global pipe_print
     randomize_connection = connection
     pipe_print = print_method
 
+    try:
+        results = run_remonsterate(**kwargs)
+        if results is not None:
+            pipe_print(
+                output=(outfile_rom_buffer, results),
+                connection=randomize_connection
+            )
+    except Exception as exc:
+        # connection.send(type(exc)(traceback.format_exc()))
+        pipe_print(
+            output=exc,
+            connection=randomize_connection
+        )
+
+
+def remonsterate_in_process(print_method: Callable, **kwargs):
+    """
+    Runs remonsterate in this process, straight on the outfile_rom_buffer it is given, instead of in a
+    child process that is sent a copy of the ROM and sends one back. Returns the spoiler lines, or None
+    if there was nothing to do, and raises any error instead of sending it. Whatever an earlier run left
+    behind is cleared first and again afterwards, so a failed attempt can simply be run again.
+    """
+    global randomize_connection
+    global pipe_print
+    randomize_connection = None
+    pipe_print = print_method
+
+    reset_remonsterate()
+    try:
+        return run_remonsterate(**kwargs)
+    finally:
+        reset_remonsterate()
+
+
+def reset_remonsterate():
+    global ALL_OBJECTS
+    if ALL_OBJECTS:
+        reset_table_objects(ALL_OBJECTS)
+    ALL_OBJECTS = None
+    for attr in ['free_space', 'stencil_indexes', 'graphics_pointers', 'import_images']:
+        if attr in MonsterSpriteObject.__dict__:
+            delattr(MonsterSpriteObject, attr)
+    MonsterSpriteObject.sprite_index = None
+    MonsterPaletteObject.new_palettes = []
+    if 'last_index' in MonsterPaletteObject.__dict__:
+        del MonsterPaletteObject.last_index
+    if 'new_base_address' in MonsterComp16Object.__dict__:
+        del MonsterComp16Object.new_base_address
+
+
+def run_remonsterate(**kwargs):
     try:
         if "outfile_rom_buffer" not in kwargs.keys():
             pipe_print(
@@ -921,9 +1217,16 @@ def remonsterate(connection: Pipe, print_method: Callable, **kwargs):
         seed = kwargs.get("seed", int(time()))
         images_tags_filename = kwargs.get("images_tags_filename", "images_and_tags.txt")
         monsters_tags_filename = kwargs.get("monsters_tags_filename", "monsters_and_tags.txt")
+        sprite_cache_filename = kwargs.get("sprite_cache_filename", "sprite_cache.bin")
         rom_type = kwargs.get("rom_type", None)
         list_of_monsters = kwargs.get("list_of_monsters")
         images = []
+        if sprite_cache_filename is not None:
+            sprite_cache_filename = os.path.join(file_paths, sprite_cache_filename)
+            sprites = read_sprite_cache(sprite_cache_filename)
+        else:
+            sprites = {}
+        sprites_changed = False
         try:
             for line in open(os.path.join(file_paths, images_tags_filename)):
                 if '#' in line:
@@ -938,10 +1241,9 @@ def remonsterate(connection: Pipe, print_method: Callable, **kwargs):
                 else:
                     image_filename, tags = line, set([])
                 try:
-                    image = prepare_image(Image.open(os.path.join(sprite_paths, image_filename)))
-                    image.tags = tags
-                    # image.close()
-                    images.append(image)
+                    if get_prepared_sprite(image_filename, tags, sprites):
+                        sprites_changed = True
+                    images.append(sprite_to_image(image_filename, sprites[image_filename]))
                 except FileNotFoundError:
                     pipe_print(
                         output='Remonsterate: %s was listed in images_and_tags.txt, '
@@ -956,6 +1258,8 @@ def remonsterate(connection: Pipe, print_method: Callable, **kwargs):
                     connection=randomize_connection
                 )
                 return
+            if sprites_changed and sprite_cache_filename is not None:
+                write_sprite_cache(sprite_cache_filename, sprites)
         except FileNotFoundError as e:
             pipe_print(
                 output=e,
@@ -988,6 +1292,7 @@ def remonsterate(connection: Pipe, print_method: Callable, **kwargs):
             )
         MonsterSpriteObject.import_images = sorted(images,
                                                    key=lambda i: i.filename)
+        MonsterSpriteObject.sprite_index = SpriteIndex(MonsterSpriteObject.import_images)
 
         msos = list(MonsterSpriteObject.every)
         random.shuffle(msos)
@@ -1000,18 +1305,8 @@ def remonsterate(connection: Pipe, print_method: Callable, **kwargs):
                 )
                 break
 
-        # Wrapped in a try/except/finally block so that even if finish_remonsterate errors, the images are closed
-        results = finish_remonsterate(list_of_monsters)
-        pipe_print(
-            output=(outfile_rom_buffer, results),
-            connection=randomize_connection
-        )
-    except Exception as exc:
-        # connection.send(type(exc)(traceback.format_exc()))
-        pipe_print(
-            output=exc,
-            connection=randomize_connection
-        )
+        # Wrapped in a try/finally block so that even if finish_remonsterate errors, the images are closed
+        return finish_remonsterate(list_of_monsters)
     finally:
         try:
             if images:
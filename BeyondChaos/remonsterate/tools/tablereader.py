@@ -1740,6 +1740,22 @@ def get_table_objects(objtype, filename=None):
     return get_table_objects(objtype, filename=filename)
 
 
+def reset_table_objects(objects):
+    # Forget the objects read so far and the patches listed and written, so
+    # that the next run reads everything from the output buffer again
+    GRAND_OBJECT_DICT.clear()
+    already_gotten.clear()
+    ALREADY_PATCHED.clear()
+    for filenames in [PATCH_FILENAMES, OPTION_FILENAMES, NOVERIFY_PATCHES,
+                      CMP_PATCH_FILENAMES]:
+        del filenames[:]
+    for objtype in objects:
+        for attr in ['_every', '_class_property_cache',
+                     'precleaned', 'cleaned', 'randomized']:
+            if attr in objtype.__dict__:
+                delattr(objtype, attr)
+
+
 def set_table_specs(objects, filename=None):
     if filename is None:
         filename = GLOBAL_TABLE
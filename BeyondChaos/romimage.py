@@ -0,0 +1,136 @@
+import struct
+from io import BytesIO
+from typing import List, Tuple
+
+
+def read_struct(rom_buffer: BytesIO, fmt: str | struct.Struct, address: int) -> tuple:
+    """
+    Unpacks fmt at address straight out of rom_buffer's memory, without moving its position.
+    Works with any BytesIO, not only RomImage.
+    """
+    with rom_buffer.getbuffer() as rom_data:
+        if isinstance(fmt, struct.Struct):
+            return fmt.unpack_from(rom_data, address)
+        return struct.unpack_from(fmt, rom_data, address)
+
+
+class RomImage(BytesIO):
+    """
+    An in-memory ROM image.
+
+    It is a BytesIO, so every existing seek/read/write caller keeps working, with typed accessors on top
+    that read and write at an address directly, without moving the position and without a Python call
+    per byte. The data is never copied unless asked to with copy() or getvalue().
+    """
+    @classmethod
+    def from_file(cls, filename: str, strip_header: bool = False) -> 'RomImage':
+        with open(filename, 'rb') as rom_file:
+            rom_data = rom_file.read()
+        if strip_header and len(rom_data) % 0x400 == 0x200:
+            return cls(memoryview(rom_data)[0x200:])
+        return cls(rom_data)
+
+    def __len__(self) -> int:
+        with self.getbuffer() as rom_data:
+            return rom_data.nbytes
+
+    def copy(self) -> 'RomImage':
+        with self.getbuffer() as rom_data:
+            return RomImage(rom_data)
+
+    def u8(self, address: int) -> int:
+        with self.getbuffer() as rom_data:
+            return rom_data[address]
+
+    def u16le(self, address: int) -> int:
+        with self.getbuffer() as rom_data:
+            return rom_data[address] | (rom_data[address + 1] << 8)
+
+    def u24le(self, address: int) -> int:
+        with self.getbuffer() as rom_data:
+            return rom_data[address] | (rom_data[address + 1] << 8) | (rom_data[address + 2] << 16)
+
+    def read_bytes(self, address: int, length: int) -> bytes:
+        with self.getbuffer() as rom_data:
+            return bytes(rom_data[address:address + length])
+
+    def unpack(self, fmt: str | struct.Struct, address: int) -> tuple:
+        return read_struct(self, fmt, address)
+
+    def write_bytes(self, address: int, data: bytes):
+        """
+        Writes data at address without moving the position. Writing past the end grows the image,
+        padding with zeroes, just like seek() and write().
+        """
+        end = address + len(data)
+        if end > len(self):
+            position = self.tell()
+            self.seek(address)
+            self.write(data)
+            self.seek(position)
+            return
+        with self.getbuffer() as rom_data:
+            rom_data[address:end] = data
+
+    def write_u8(self, address: int, value: int):
+        self.write_bytes(address, bytes([value & 0xFF]))
+
+    def write_u16le(self, address: int, value: int):
+        self.write_bytes(address, (value & 0xFFFF).to_bytes(2, 'little'))
+
+    def write_u24le(self, address: int, value: int):
+        self.write_bytes(address, (value & 0xFFFFFF).to_bytes(3, 'little'))
+
+
+class RomJournal:
+    """
+    A file-like view of a ROM buffer for code that may have to be undone, such as an attempt that can fail
+    and be retried. Like read_struct, it works with any BytesIO, not only RomImage.
+
+    Every write() first records the bytes it replaces, so rollback() can put back only the ranges that were
+    written, newest first, and cut off anything written past the old end, instead of restoring a copy of
+    the whole image. Writes go through write(), so the buffer given out by getbuffer() is read-only.
+    """
+    def __init__(self, rom: BytesIO):
+        self.rom = rom
+        self.size = self.get_size()
+        # (address, replaced bytes) of every write, oldest first
+        self.entries: List[Tuple[int, bytes]] = []
+
+    def get_size(self) -> int:
+        with self.rom.getbuffer() as rom_data:
+            return rom_data.nbytes
+
+    def seek(self, position: int, whence: int = 0) -> int:
+        return self.rom.seek(position, whence)
+
+    def tell(self) -> int:
+        return self.rom.tell()
+
+    def read(self, size: int = -1) -> bytes:
+        return self.rom.read(size)
+
+    def getbuffer(self) -> memoryview:
+        return self.rom.getbuffer().toreadonly()
+
+    def write(self, data: bytes) -> int:
+        position = self.rom.tell()
+        with self.rom.getbuffer() as rom_data:
+            self.entries.append((position, bytes(rom_data[position:position + len(data)])))
+        return self.rom.write(data)
+
+    def commit(self):
+        """
+        Keeps every write so far. Later rollbacks only undo what is written after this.
+        """
+        self.entries.clear()
+        self.size = self.get_size()
+
+    def rollback(self):
+        position = self.rom.tell()
+        for address, replaced in reversed(self.entries):
+            self.rom.seek(address)
+            self.rom.write(replaced)
+        self.entries.clear()
+        self.rom.truncate(self.size)
+        self.rom.seek(min(position, self.size))
@@ -0,0 +1,207 @@
+import os
+import pickle
+import zlib
+from hashlib import md5
+from io import BytesIO
+from multiprocessing import Pipe, Process
+from pathlib import Path
+from typing import Callable
+
+from config import CONFIG_PATH, VERSION, MD5HASHNORMAL, MD5HASHTEXTLESS, MD5HASHTEXTLESS2
+from utils import get_directory_hash, tblpath
+
+# The order matters: later categories are read with the earlier ones already loaded, just like
+#   the first calls to their get_* functions in randomize().
+SNAPSHOT_CATEGORIES = ['spells', 'items', 'monsters', 'formations', 'fsets', 'locations', 'zones', 'metamorphs',
+                       'espers', 'shops']
+
+# Snapshots of the supported ROMs are cached on disk next to config.ini, one file per ROM
+SNAPSHOT_CACHE_HASHES = [MD5HASHNORMAL, MD5HASHTEXTLESS, MD5HASHTEXTLESS2]
+SNAPSHOT_CACHE_DIRECTORY = CONFIG_PATH.parent
+
+active_snapshot = None
+skipped_categories = set()
+
+
+class VanillaSnapshot:
+    """
+    Pre-parsed copies of the vanilla game objects of one ROM.
+
+    Every category is stored pickled, so each load() hands out brand-new objects that the
+    randomizer is free to mutate.
+    """
+    def __init__(self, rom_hash: str, categories: dict = None):
+        self.rom_hash = rom_hash
+        self.categories = categories or {}
+
+    def add(self, category: str, objects):
+        self.categories[category] = pickle.dumps(objects, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def load(self, category: str):
+        if category not in self.categories:
+            return None
+        return pickle.loads(self.categories[category])
+
+
+def activate_snapshot(snapshot: VanillaSnapshot | None, infile_rom_buffer: BytesIO = None):
+    """
+    Makes snapshot the source of vanilla game objects for the next run. A snapshot taken from
+    a different ROM than infile_rom_buffer is ignored.
+    """
+    global active_snapshot
+    if snapshot and infile_rom_buffer is not None and \
+            md5(infile_rom_buffer.getbuffer()).hexdigest() != snapshot.rom_hash:
+        snapshot = None
+    active_snapshot = snapshot
+    skipped_categories.clear()
+
+
+def skip_category(category: str):
+    """
+    Forces category to be read from the ROM for the rest of this run, e.g. because the buffer
+    it is read from no longer holds vanilla data.
+    """
+    skipped_categories.add(category)
+
+
+def restore(category: str):
+    """
+    Returns fresh vanilla objects for category from the active snapshot, or None if they have
+    to be read from the ROM.
+    """
+    if active_snapshot and category not in skipped_categories:
+        return active_snapshot.load(category)
+    return None
+
+
+def load(category: str, read_function: Callable, rom_file_buffer: BytesIO):
+    """
+    Returns fresh vanilla objects for category, using the active snapshot if there is one and
+    read_function(rom_file_buffer) otherwise.
+    """
+    objects = restore(category)
+    if objects is None:
+        objects = read_function(rom_file_buffer)
+    return objects
+
+
+def build_snapshot(rom_data: bytes) -> VanillaSnapshot:
+    """
+    Parses every snapshot category out of rom_data. This fills the current RandomizerContext and
+    some module-level state, so it should run in a process that will not randomize afterwards.
+    Use capture_snapshot() instead.
+    """
+    from esperrandomizer import read_espers, get_espers
+    from formationrandomizer import read_formations, read_fsets, get_formations, get_fsets
+    from itemrandomizer import read_items, get_items
+    from locationrandomizer import read_locations, read_zones, get_locations, get_zones
+    from monsterrandomizer import read_monsters, read_metamorphs, get_monsters, get_metamorphs
+    from shoprandomizer import read_shops, get_shops
+    from skillrandomizer import read_spells, get_ranked_spells
+
+    # Each category is pickled straight from its reader, before anything links it to other
+    #   objects. The getter then loads it again so that later readers find what they depend on.
+    readers_and_getters = {
+        'spells': (read_spells, get_ranked_spells),
+        'items': (read_items, get_items),
+        'monsters': (read_monsters, get_monsters),
+        'formations': (read_formations, get_formations),
+        'fsets': (read_fsets, get_fsets),
+        'locations': (read_locations, get_locations),
+        'zones': (read_zones, get_zones),
+        'metamorphs': (read_metamorphs, get_metamorphs),
+        'espers': (read_espers, get_espers),
+        'shops': (read_shops, get_shops),
+    }
+    activate_snapshot(None)
+    rom_file_buffer = BytesIO(rom_data)
+    snapshot = VanillaSnapshot(md5(rom_data).hexdigest())
+    for category in SNAPSHOT_CATEGORIES:
+        read_function, get_function = readers_and_getters[category]
+        snapshot.add(category, read_function(rom_file_buffer))
+        get_function(rom_file_buffer)
+    return snapshot
+
+
+def _capture_snapshot_process(connection: Pipe, rom_data: bytes):
+    try:
+        connection.send(build_snapshot(rom_data))
+    except Exception as e:
+        connection.send(e)
+
+
+def capture_snapshot(rom_data: bytes) -> VanillaSnapshot:
+    """
+    Builds a VanillaSnapshot of rom_data in a child process, leaving this process's module-level
+    caches untouched.
+    """
+    parent_connection, child_connection = Pipe()
+    capture_process = Process(
+        target=_capture_snapshot_process,
+        args=(child_connection, rom_data)
+    )
+    capture_process.start()
+    result = parent_connection.recv()
+    capture_process.join()
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+def get_cache_path(rom_hash: str) -> Path:
+    return SNAPSHOT_CACHE_DIRECTORY / f'snapshot_{rom_hash}.bin'
+
+
+def read_cached_snapshot(rom_hash: str, tables_hash: str) -> VanillaSnapshot | None:
+    """
+    Returns the cached snapshot of the ROM with rom_hash, or None if there is none or it was made by
+    another version of the randomizer or from other tables.
+    """
+    try:
+        with open(get_cache_path(rom_hash), 'rb') as cache_file:
+            cached = pickle.loads(zlib.decompress(cache_file.read()))
+    except (OSError, zlib.error, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        return None
+    if not isinstance(cached, dict) or \
+            (cached.get('version'), cached.get('tables_hash')) != (VERSION, tables_hash):
+        return None
+    snapshot = cached.get('snapshot')
+    if not isinstance(snapshot, VanillaSnapshot) or snapshot.rom_hash != rom_hash or \
+            set(snapshot.categories) != set(SNAPSHOT_CATEGORIES):
+        return None
+    return snapshot
+
+
+def write_cached_snapshot(snapshot: VanillaSnapshot, tables_hash: str):
+    cache_path = get_cache_path(snapshot.rom_hash)
+    temp_path = cache_path.with_name(f'{cache_path.name}.{os.getpid()}.tmp')
+    cached = {
+        'version': VERSION,
+        'tables_hash': tables_hash,
+        'snapshot': snapshot
+    }
+    try:
+        with open(temp_path, 'wb') as cache_file:
+            cache_file.write(zlib.compress(pickle.dumps(cached, protocol=pickle.HIGHEST_PROTOCOL)))
+        # Replacing the file in one step means other runs never read a half-written cache
+        os.replace(temp_path, cache_path)
+    except OSError:
+        # The cache is only an optimization. A read-only directory should not stop the randomizer.
+        if temp_path.exists():
+            temp_path.unlink()
+
+
+def get_cached_snapshot(rom_data: bytes | memoryview) -> VanillaSnapshot | None:
+    """
+    Returns a VanillaSnapshot of rom_data from the disk cache, capturing and caching it first if
+    needed. Returns None for ROMs other than the supported ones.
+    """
+    rom_hash = md5(rom_data).hexdigest()
+    if rom_hash not in SNAPSHOT_CACHE_HASHES:
+        return None
+    tables_hash = get_directory_hash(tblpath).hexdigest()
+    snapshot = read_cached_snapshot(rom_hash, tables_hash)
+    if snapshot is None:
+        snapshot = capture_snapshot(bytes(rom_data))
+        write_cached_snapshot(snapshot, tables_hash)
+    return snapshot
@@ -0,0 +1,116 @@
+"""
+A pool of long-lived seed generation workers, for running the randomizer as a service.
+
+The vanilla ROM is read and parsed into a VanillaSnapshot once, when the pool starts, and handed to
+every worker. Each seed is then generated in a short-lived child of a worker, so all module-level
+state starts out pristine for every seed while the ROM data and the snapshot are already in memory.
+"""
+from multiprocessing import Pipe, Process, cpu_count
+from multiprocessing.pool import AsyncResult
+from typing import List
+
+from customthreadpool import NonDaemonPool
+from romimage import RomImage
+from romsnapshot import VanillaSnapshot, capture_snapshot, get_cached_snapshot
+
+worker_rom_data = None
+worker_snapshot = None
+
+
+def initialize_worker(rom_data: bytes, snapshot: VanillaSnapshot):
+    global worker_rom_data, worker_snapshot
+    worker_rom_data = rom_data
+    worker_snapshot = snapshot
+
+
+def generate_seed(seed: str, kwargs: dict) -> dict:
+    """
+    Runs randomize() for seed in a child of this worker and collects everything it sends back.
+    Returns a dict with the seed, the printed messages and, for the web application, the
+    output payload.
+    """
+    from randomizer import randomize
+
+    kwargs = dict(kwargs)
+    kwargs['seed'] = seed
+    kwargs['infile_rom_buffer'] = RomImage(worker_rom_data)
+    kwargs['vanilla_snapshot'] = worker_snapshot
+    if kwargs['application'] == 'web':
+        kwargs['outfile_rom_buffer'] = RomImage(worker_rom_data)
+
+    parent_connection, child_connection = Pipe()
+    randomize_process = Process(
+        target=randomize,
+        args=(child_connection,),
+        kwargs=kwargs
+    )
+    randomize_process.start()
+
+    messages = []
+    output = None
+    while True:
+        if parent_connection.poll(timeout=5):
+            child_output = parent_connection.recv()
+        elif not randomize_process.is_alive():
+            raise RuntimeError('Unexpected error: The randomize child process died.')
+        else:
+            continue
+
+        if isinstance(child_output, str):
+            messages.append(child_output)
+        elif isinstance(child_output, Exception):
+            randomize_process.join()
+            raise child_output
+        elif isinstance(child_output, bool):
+            break
+        elif isinstance(child_output, dict):
+            # The web application finishes by sending its output instead of True
+            output = child_output
+            break
+    randomize_process.join()
+
+    return {
+        'seed': seed,
+        'messages': messages,
+        'output': output
+    }
+
+
+class SeedWorkerPool:
+    """
+    Generates seeds in parallel on a pool of workers that share one parsed copy of the vanilla ROM.
+
+    Keyword arguments given to submit() and generate() are passed on to randomize(). The default
+    application is 'web', which returns the output ROM and spoiler log instead of writing files.
+    """
+    def __init__(self, infile_rom_path: str, processes: int = None):
+        with open(infile_rom_path, 'rb') as infile:
+            rom_data = infile.read()
+        if len(rom_data) % 0x400 == 0x200:
+            rom_data = rom_data[0x200:]
+
+        self.rom_data = rom_data
+        self.snapshot = get_cached_snapshot(rom_data) or capture_snapshot(rom_data)
+        self.pool = NonDaemonPool(
+            processes=processes or cpu_count(),
+            initializer=initialize_worker,
+            initargs=(self.rom_data, self.snapshot)
+        )
+
+    def submit(self, seed: str, **kwargs) -> AsyncResult:
+        kwargs.setdefault('application', 'web')
+        return self.pool.apply_async(generate_seed, (seed, kwargs))
+
+    def generate(self, seeds: List[str], **kwargs) -> List[dict]:
+        results = [self.submit(seed, **kwargs) for seed in seeds]
+        return [result.get() for result in results]
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
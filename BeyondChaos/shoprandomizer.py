@@ -1,6 +1,8 @@
 from io import BytesIO
+import romsnapshot
 from utils import SHOP_TABLE, utilrandom as random, Substitution
 from itemrandomizer import get_ranked_items, get_item
+from randomizercontext import get_context
 
 # Despite documentation, these are the only pricings available.
 # 0 x1 price
@@ -183,16 +185,9 @@ def buy_owned_breakable_tools(outfile_rom_buffer: BytesIO):
     bobt_sub.write(outfile_rom_buffer, patch_name='buy_owned_breakable_tools')
 
 
-all_shops = None
-
-
-def get_shops(sourcefile):
-    global all_shops
-    if all_shops:
-        return all_shops
-
+def read_shops(sourcefile):
     shop_names = [line.strip() for line in open(SHOP_TABLE).readlines()]
-    all_shops = []
+    shops = []
     for i, name in zip(range(0x80), shop_names):
         if "unused" in name.lower():
             continue
@@ -200,6 +195,14 @@ def get_shops(sourcefile):
         s = ShopBlock(pointer, name)
         s.set_id(i)
         s.read_data(sourcefile)
-        all_shops.append(s)
+        shops.append(s)
+    return shops
+
+
+def get_shops(sourcefile):
+    context = get_context()
+    if context.shops:
+        return context.shops
 
+    context.shops = romsnapshot.load('shops', read_shops, sourcefile)
     return get_shops(sourcefile)
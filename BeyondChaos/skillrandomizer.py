@@ -1,8 +1,9 @@
 from io import BytesIO
+import romsnapshot
+from randomizercontext import get_context
 from utils import (hex2int, int2bytes, Substitution, SPELL_TABLE,
                    SPELLBANS_TABLE, name_to_bytes, utilrandom as random)
 
-spelldict = {}
 spellnames = {}
 try:
     f = open(SPELL_TABLE)
@@ -310,11 +311,16 @@ class CommandBlock:
         self.set_bit(0x204D4, fout, unset=True)
 
 
+def read_spells(rom_file_buffer: BytesIO):
+    return [SpellBlock(i, rom_file_buffer) for i in range(0xFF)]
+
+
 def get_ranked_spells(rom_file_buffer: BytesIO = None, magic_only=False):
+    spelldict = get_context().spelldict
     if spelldict:
         spells = sorted(list(spelldict.values()), key=lambda s: s.spellid)
     else:
-        spells = [SpellBlock(i, rom_file_buffer) for i in range(0xFF)]
+        spells = romsnapshot.load('spells', read_spells, rom_file_buffer)
         for s in spells:
             spelldict[s.spellid] = s
 
@@ -327,7 +333,7 @@ def get_ranked_spells(rom_file_buffer: BytesIO = None, magic_only=False):
 
 
 def get_spell(spellid):
-    return spelldict[spellid]
+    return get_context().spelldict[spellid]
 
 
 class SpellSub(Substitution):
@@ -340,12 +346,9 @@ class SpellSub(Substitution):
         return "Use the skill '{0}'".format(spellnames[self.spellid])
 
 
-wildspells = None
-
-
 def get_spellsets(spells=None, outfile_rom_buffer: BytesIO = None):
     """Create various thematic groups of spells."""
-    global wildspells
+    context = get_context()
     spellsets = {}
     spellset_bans = []
     spells = [s for s in spells if s.spellid not in spellset_bans]
@@ -363,9 +366,9 @@ def get_spellsets(spells=None, outfile_rom_buffer: BytesIO = None):
                      s.name == "ShadowFang"]
     # Each spellset is a tuple of (description, spell list)
     spellsets['Chaos'] = ('skill (including broken and glitchy skills)', [])
-    if wildspells is None:
-        wildspells = random.sample(spells, 8)
-    spellsets['Wild'] = ('random set of spells', wildspells)
+    if context.wild_spells is None:
+        context.wild_spells = random.sample(spells, 8)
+    spellsets['Wild'] = ('random set of spells', context.wild_spells)
     spellsets['Magic'] = ('magic spell', list(range(0, 0x36)))
     spellsets['Black'] = ('black magic spell', list(range(0, 0x18)))
     spellsets['White'] = ('white magic spell', list(range(0x2D, 0x36)))
@@ -0,0 +1,93 @@
+import json
+from io import StringIO
+from typing import Dict, List, TextIO
+
+# The order the sections appear in the spoiler log
+SPOILER_SECTION_ORDER = ['characters', 'stats', 'aesthetics', 'commands', 'blitz inputs', 'magitek', 'slots',
+                         'dances', 'espers', 'item magic', 'item effects', 'command-change relics', 'colosseum',
+                         'monsters', 'music', 'remonsterate', 'shops', 'treasure chests', 'junctions', 'zozo clock',
+                         'secret items', 'rom map']
+
+
+class SpoilerLog:
+    """
+    The spoiler log of a run, kept as a list of entries per section. Entries without a section form
+    the header at the top of the log.
+
+    The log is rendered once per ordering and the text is kept until another entry is added, so the
+    spoiler file and the web payload share the same rendering.
+    """
+    def __init__(self):
+        self.sections: Dict[str | None, List[str]] = {}
+        self.rendered = {}
+
+    def __contains__(self, section: str | None) -> bool:
+        return section in self.sections
+
+    def __getitem__(self, section: str | None) -> List[str]:
+        return self.sections[section]
+
+    def add(self, text: str, section: str | None):
+        self.sections.setdefault(section, []).append(text)
+        self.rendered.clear()
+
+    def replace(self, section: str, index: int, text: str):
+        self.sections[section][index] = text
+        self.rendered.clear()
+
+    def get_ordering(self, ordering: List[str] = None) -> List[str]:
+        """
+        Returns the sections of ordering that have entries. Without an ordering, every section is used
+        in alphabetical order.
+        """
+        if ordering is None:
+            ordering = sorted(section for section in self.sections if section is not None)
+        return [section for section in ordering if section is not None and section in self.sections]
+
+    def render(self, ordering: List[str] = None) -> str:
+        key = None if ordering is None else tuple(ordering)
+        if key not in self.rendered:
+            log_buffer = StringIO()
+            self.write_text(log_buffer, ordering)
+            self.rendered[key] = log_buffer.getvalue().strip()
+        return self.rendered[key]
+
+    def write_text(self, log_file: TextIO, ordering: List[str] = None):
+        """
+        Writes the spoiler log to log_file: the header, a table of contents, then each section with its
+        entries sorted.
+        """
+        for data in self.sections.get(None, []):
+            log_file.write(data + '\n')
+        log_file.write('\n')
+
+        sections = self.get_ordering(ordering)
+        for section_num, section in enumerate(sections):
+            log_file.write('-{0:02d}- {1}\n'.format(section_num + 1,
+                                                   ' '.join([word.capitalize() for word in str(section).split()])))
+        for section_num, section in enumerate(sections):
+            datas = sorted(self.sections[section])
+            log_file.write('\n' + '=' * 60 + '\n')
+            log_file.write('-{0:02d}- {1}\n'.format(section_num + 1, section.upper()))
+            log_file.write('-' * 60 + '\n')
+            newlines = any('\n' in data for data in datas)
+            if newlines:
+                log_file.write('\n')
+            for data in datas:
+                log_file.write(data.strip() + '\n')
+                if newlines:
+                    log_file.write('\n')
+
+    def to_dict(self, ordering: List[str] = None) -> dict:
+        """
+        Returns the same sections as the text log, in a form that can be stored as JSON.
+        """
+        return {
+            'header': list(self.sections.get(None, [])),
+            'sections': [{'name': section, 'entries': [data.strip() for data in sorted(self.sections[section])]}
+                         for section in self.get_ordering(ordering)]
+        }
+
+    def write_json(self, filename: str, ordering: List[str] = None):
+        with open(filename, 'w', encoding='UTF-8') as json_file:
+            json.dump(self.to_dict(ordering), json_file, indent=2, ensure_ascii=False)
@@ -1,6 +1,8 @@
+import json
 import os
+import sys
 from randomizer import VERSION
-from time import time
+from time import time, perf_counter
 from utils import extract_archive, get_directory_hash, md5_update_from_file
 from options import Flag
 
@@ -10,6 +12,8 @@ OUTPUT_PATH = ''
 TEST_SEED = ''
 SKIP_FLAGS = ['remonsterate', 'bingoboingo']
 INCLUDE_FLAGS = {}
+BENCHMARK_FIRST_SEED = 1000
+BENCHMARK_BASELINE_PATH = 'benchmark_baseline.json'
 
 
 def get_random_flag_value(flag: Flag):
@@ -55,6 +59,15 @@ def apply_included_flags(flag_string: str):
     return flag_string
 
 
+def remove_skipped_flags(flag_string: str):
+    # Split to remove both the flag and any value it has. Eg. Randomboost:2.00 - Randomboost = :2.00
+    for skip_flag in SKIP_FLAGS:
+        for active_flag_and_value in flag_string.split(' '):
+            if str(active_flag_and_value).startswith(skip_flag):
+                flag_string = flag_string.replace(active_flag_and_value, '')
+    return flag_string
+
+
 # Test a single generation, just like using TEST = True previously in randomizer.py
 def test_generation(iterations: int = 1, generate_output_rom=True):
     global TEST_SEED
@@ -114,6 +127,63 @@ def test_generation(iterations: int = 1, generate_output_rom=True):
                     break
 
 
+# Test generating a batch of seeds on a SeedWorkerPool, which parses the source rom only once for the whole batch.
+def test_pool_generation(iterations: int = 4, processes: int = None):
+    from seedworker import SeedWorkerPool
+
+    test_bundle = TEST_SEED.split('|')
+    test_bundle[2] = remove_skipped_flags(apply_included_flags(test_bundle[2]))
+    if len(test_bundle) == 3:
+        test_bundle.append(str(int(time())))
+
+    seeds = ['|'.join(test_bundle[:3] + [str(int(test_bundle[3]) + batch_number)])
+             for batch_number in range(iterations)]
+    start_time = time()
+    with SeedWorkerPool(SOURCE_FILE, processes=processes) as pool:
+        results = pool.generate(seeds, application='tester', outfile_rom_path=OUTPUT_PATH,
+                                generate_output_rom=False)
+    for result in results:
+        print('\n'.join(result['messages']))
+    print(f'Generated {iterations} seeds in {round(time() - start_time, 2)} seconds.')
+
+
+# Generate one seed twice, one run after the other in this process. Both runs have to make the same ROM and spoiler
+#   log, so nothing one run leaves behind may change the next.
+def test_same_seed_in_process():
+    from io import BytesIO
+    from randomizer import randomize
+    from romimage import RomImage
+
+    class OutputCollector:
+        # Stands in for the pipe randomize() reports to, and keeps the web output
+        def __init__(self):
+            self.output = None
+
+        def send(self, output):
+            if isinstance(output, dict) and 'ord' in output:
+                self.output = output
+
+    test_bundle = TEST_SEED.split('|')
+    test_bundle[2] = remove_skipped_flags(apply_included_flags(test_bundle[2]))
+    if len(test_bundle) == 3:
+        test_bundle.append(str(int(time())))
+    source_rom = RomImage.from_file(SOURCE_FILE, strip_header=True)
+
+    outputs = []
+    for _ in range(2):
+        collector = OutputCollector()
+        randomize(collector, seed='|'.join(test_bundle), application='web',
+                  infile_rom_buffer=source_rom.copy(), outfile_rom_buffer=BytesIO(source_rom.getbuffer()))
+        outputs.append((collector.output['ord'].getvalue(), collector.output['osl']))
+    if outputs[0][0] != outputs[1][0]:
+        print('The second run of the seed made a different ROM.')
+        return False
+    if outputs[0][1] != outputs[1][1]:
+        print('The second run of the seed made a different spoiler log.')
+        return False
+    return True
+
+
 # Test multiple generations. Choose a number of seeds to generate and a number of random flags those seeds should have.
 # The selected mode is random too.
 # Note that this method does not write any of the generated roms to disk.
@@ -369,9 +439,595 @@ def test_rng_distribution():
     pyplot.show()
 
 
+def test_patch_output(iterations: int = 200):
+    # Applies IPS and BPS patches made from random edits of random data and checks the result
+    from patchoutput import PATCH_FORMATS, apply_bps_patch, apply_ips_patch, make_patch
+    from random import Random
+    random = Random(0)
+
+    for iteration in range(iterations):
+        source = random.randbytes(random.randint(0, 0x4000))
+        target_size = random.choice([len(source), len(source) + random.randint(1, 0x800),
+                                     max(0, len(source) - random.randint(1, 0x800))])
+        target = bytearray(source[:target_size].ljust(target_size, b'\x00'))
+        for _ in range(random.randint(0, 30)):
+            address = random.randint(0, target_size)
+            length = random.randint(1, 100)
+            if random.random() < .5:
+                data = bytes([random.randint(0, 0xFF)]) * length
+            else:
+                data = random.randbytes(length)
+            target[address:address + length] = data[:max(0, target_size - address)]
+        target = bytes(target)
+
+        for patch_format in PATCH_FORMATS:
+            patch = make_patch(patch_format, source, target)
+            if patch_format == 'ips':
+                patched = apply_ips_patch(source, patch)
+            else:
+                patched = apply_bps_patch(source, patch)
+            if patched != target:
+                print(f'Iteration {iteration}: the {patch_format} patch did not reproduce the target.')
+                return False
+    print(f'{iterations} patches of each format applied correctly.')
+    return True
+
+
+# The LZSS codec that decompress.py used before its rewrite, kept to check the new one against
+def legacy_decompress(bytestring, simple=False, complicated=True):
+    result = bytearray([])
+    buff = bytearray(2048)
+    buffaddr = 0x7DE
+
+    while bytestring:
+        flags, bytestring = bytestring[0], bytestring[1:]
+        for i in range(8):
+            if not bytestring:
+                break
+
+            if flags & (1 << i):
+                byte, bytestring = bytestring[0], bytestring[1:]
+                result.append(byte)
+                buff[buffaddr] = byte
+                buffaddr += 1
+                if buffaddr == 0x800:
+                    buffaddr = 0
+            else:
+                low, high, bytestring = (
+                    bytestring[0], bytestring[1], bytestring[2:])
+                seekaddr = low | ((high & 0x07) << 8)
+                length = ((high & 0xF8) >> 3) + 3
+                if simple:
+                    copied = [buff[seekaddr]] * length
+                elif complicated:
+                    if buffaddr == seekaddr:
+                        raise Exception("buffaddr equals seekaddr")
+                    cycle = buffaddr - seekaddr
+                    if cycle < 0:
+                        cycle += 0x800
+                    subbuff = (buff+buff)[seekaddr:seekaddr+cycle]
+                    while len(subbuff) < length:
+                        subbuff = subbuff + subbuff
+                    copied = subbuff[:length]
+                else:
+                    copied = (buff+buff)[seekaddr:seekaddr+length]
+                assert len(copied) == length
+                result += copied
+                while copied:
+                    byte, copied = copied[0], copied[1:]
+                    buff[buffaddr] = byte
+                    buffaddr += 1
+                    if buffaddr == 0x800:
+                        buffaddr = 0
+    return result
+
+
+def legacy_recompress(bytestring):
+    global buffaddr
+    bytestring = bytearray([c if isinstance(c, int) else ord(c) for c in bytestring])
+    result = bytearray()
+    buff = bytearray(2048)
+    buffaddr = 0x7DE
+
+    def add_buff(c):
+        global buffaddr
+        buff[buffaddr] = c
+        buffaddr += 1
+        buffaddr = buffaddr % 0x800
+
+    while bytestring:
+        control = 0x00
+        subresult = bytearray()
+        for i in range(8):
+            searchbuff = (buff + buff)
+            for j in range(3, 35):
+                searchstr = bytestring[:j]
+                if searchstr not in searchbuff:
+                    break
+                location = searchbuff.find(searchstr)
+                if location == buffaddr:
+                    location = searchbuff[location+1:].find(searchstr)
+                    if location < 0:
+                        break
+                    location = buffaddr + location + 1
+                    if location % 0x800 == buffaddr:
+                        break
+            else:
+                j = 0
+            j = j - 1
+            goodloop = None
+            loopbuff = buff[:buffaddr]
+            #if len(loopbuff) < 35:
+            #    loopbuff = "".join(buff) + loopbuff
+            for k in range(j+1, 35):
+                searchstr = bytestring[:k]
+                for h in range(1, len(searchstr)+1):
+                    loopstr = searchstr[:h]
+                    mult = (len(searchstr) // len(loopstr)) + 1
+                    if searchstr == (loopstr * mult)[:len(searchstr)]:
+                        if loopbuff.endswith(loopstr):
+                            j = k
+                            goodloop = loopstr
+            if len(bytestring) <= 8:
+                j = 0
+            if j >= 3:
+                substr = bytestring[:j]
+                bytestring = bytestring[j:]
+                if not goodloop:
+                    index = searchbuff.find(substr)
+                    if index % 0x800 == buffaddr:
+                        index = searchbuff[index+1:].find(substr)
+                        index += buffaddr + 1
+                        assert index >= 0
+                        assert index % 0x800 != buffaddr
+                else:
+                    index = len(loopbuff) - len(goodloop)
+                if index < 0:
+                    index += 0x800
+                index = index % 0x800
+
+                if not (0 <= index < 0x800 and (j-3) & 0xFFE0 == 0):
+                    raise ValueError('Back reference to %x of length %s is out of range.' % (index, j))
+                value = index << 5
+                value = value | (j - 3)
+                while substr:
+                    c = substr[0]
+                    substr = substr[1:]
+                    add_buff(c)
+                byte1 = index & 0xFF
+                byte2 = (index >> 8) | ((j-3) << 3)
+                assert byte1 | ((byte2 & 0x07) << 8) == index
+                assert ((byte2 & 0xF8) >> 3) + 3 == j
+                subresult += bytes([byte1, byte2])
+            else:
+                control |= (1 << i)
+                if bytestring:
+                    c, bytestring = bytestring[0], bytestring[1:]
+                else:
+                    c = 0
+                subresult.append(c)
+                add_buff(c)
+        result += bytes([control]) + subresult
+        if not bytestring and (
+                control != 0xFF
+                or not subresult.endswith(bytes([0, 0]))):
+            result += b'\xFF' + bytes(8)
+    return result
+
+
+def generate_lzss_test_data(random, size: int) -> bytes:
+    # Mixes runs, repeats of earlier data and noise, roughly like the graphics and scripts the ROM compresses
+    data = bytearray()
+    while len(data) < size:
+        kind = random.random()
+        if kind < .3:
+            data += bytes([random.randint(0, 0xFF)]) * random.randint(1, 60)
+        elif kind < .6 and data:
+            start = random.randint(0, len(data) - 1)
+            data += data[start:start + random.randint(1, 40)]
+        else:
+            data += bytes(random.randint(0, random.choice([3, 0xFF])) for _ in range(random.randint(1, 20)))
+    return bytes(data[:size])
+
+
+def test_lzss_round_trip(iterations: int = 500):
+    # Checks that recompress() output decompresses to its input and is never larger than the old encoder's
+    from decompress import decompress, recompress
+    from random import Random
+    random = Random(0)
+
+    legacy_failures = 0
+    for iteration in range(iterations):
+        data = generate_lzss_test_data(random, random.choice([0, 1, 2, 8, 9, 10, 17, 50, 300, 1500]))
+        compressed = recompress(data)
+        if decompress(compressed)[:len(data)] != data or legacy_decompress(compressed) != decompress(compressed):
+            print(f'Iteration {iteration}: recompress() did not round trip {data.hex()}')
+            return False
+        legacy_compressed = legacy_recompress(data)
+        if legacy_decompress(legacy_compressed)[:len(data)] != data:
+            # The old encoder's repeating matches sometimes copied the wrong bytes
+            legacy_failures += 1
+        elif len(compressed) > len(legacy_compressed):
+            print(f'Iteration {iteration}: {len(compressed)} bytes, the old encoder needed {len(legacy_compressed)}')
+            return False
+    print(f'{iterations} round trips correct. The old encoder was wrong in {legacy_failures} of them.')
+    return True
+
+
+def benchmark_lzss(sizes: tuple = (0x1000, 0x4000)):
+    from decompress import decompress, recompress
+    from random import Random
+    random = Random(0)
+
+    for size in sizes:
+        data = generate_lzss_test_data(random, size)
+        timings = {}
+        for name, compress_function, decompress_function in [('new', recompress, decompress),
+                                                               ('old', legacy_recompress, legacy_decompress)]:
+            start = perf_counter()
+            compressed = compress_function(data)
+            compress_time = perf_counter() - start
+            start = perf_counter()
+            decompress_function(compressed)
+            timings[name] = (len(compressed), compress_time, perf_counter() - start)
+        for name, (compressed_size, compress_time, decompress_time) in timings.items():
+            print(f'{size:>6} bytes {name}: {compressed_size:>6} compressed, '
+                  f'compress {compress_time:.3f}s, decompress {decompress_time:.4f}s')
+
+
+def test_patch_bytecode_cache():
+    # Checks that cached patch bytecode, from memory and from disk, matches a fresh compile of every patch
+    from io import BytesIO
+    from tempfile import TemporaryDirectory
+    from bcg_junction import JunctionManager
+    from randomizer import JUNCTION_MANAGER_PARAMETERS
+    from randomtools import tablereader
+    from randomtools.tablereader import patch_filename_to_bytecode, set_patch_cache_directory, tblpath
+
+    # The junction patches refer to {{jun-global-...}} and {{jun-index-...}} parameters, so set those up the way
+    #   the randomizer does before it writes them
+    jm = JunctionManager(BytesIO(bytes(0x400000)), 'bcg_junction_manifest.json')
+    jm.set_parameters(JUNCTION_MANAGER_PARAMETERS)
+    patch_paths = sorted(os.path.join(tblpath, filename) for filename in os.listdir(tblpath)
+                         if filename.startswith('patch_') and filename.endswith('.txt'))
+    patch_parameters = dict(tablereader.PATCH_PARAMETERS)
+    with TemporaryDirectory() as directory:
+        set_patch_cache_directory(directory)
+        try:
+            for cache in ['fresh', 'memory', 'disk']:
+                if cache == 'disk':
+                    tablereader.COMPILED_PATCHES.clear()
+                start = perf_counter()
+                results = []
+                for patch_path in patch_paths:
+                    try:
+                        results.append(patch_filename_to_bytecode(patch_path, mapping=jm.address_mapping,
+                                                                  parameters=jm.patch_parameters))
+                    except Exception as e:
+                        print(f'{os.path.basename(patch_path)} does not compile from the {cache} cache: {e!r}')
+                        return False
+                print(f'{len(patch_paths)} patches, {cache}: {perf_counter() - start:.3f}s')
+                if cache == 'fresh':
+                    expected = results
+                elif results != expected:
+                    print(f'Patches compiled from the {cache} cache differ from a fresh compile.')
+                    return False
+        finally:
+            set_patch_cache_directory(None)
+            tablereader.COMPILED_PATCHES.clear()
+            tablereader.PATCH_PARAMETERS.clear()
+            tablereader.PATCH_PARAMETERS.update(patch_parameters)
+    return True
+
+
+def test_remonsterate_rollback(sprite_count: int = 40):
+    # Fails a remonsterate attempt partway through its writes, rolls it back and retries it. The ROM has to be
+    #   back to its old bytes after the rollback, and the retry has to match a clean run. The ROM is a plain
+    #   BytesIO, like the one the web application passes in.
+    from io import BytesIO
+    from random import Random
+    from tempfile import TemporaryDirectory
+    from PIL import Image
+    from remonsterate import remonsterate
+    from remonsterate.tools import tablereader
+    from romimage import RomJournal
+
+    class FailingJournal(RomJournal):
+        def __init__(self, rom, writes):
+            super().__init__(rom)
+            self.writes = writes
+
+        def write(self, data):
+            self.writes -= 1
+            if self.writes < 0:
+                raise OverflowError()
+            return super().write(data)
+
+    random = Random(0)
+    table_objects = [g for g in vars(remonsterate).values() if isinstance(g, type)
+                     and issubclass(g, tablereader.TableObject) and g is not tablereader.TableObject]
+    with TemporaryDirectory() as directory:
+        os.mkdir(os.path.join(directory, 'sprites'))
+        image_filenames = []
+        for index in range(sprite_count):
+            width, height = random.choice([(32, 32), (64, 64), (48, 40), (96, 80)])
+            image = Image.new('P', (width, height))
+            image.putpalette([random.randint(0, 0xFF) for _ in range(48)])
+            image.putdata([random.randint(1, 15) if random.random() < .5 else 0 for _ in range(width * height)])
+            image_filenames.append(f'sprite{index}.png')
+            image.save(os.path.join(directory, 'sprites', image_filenames[-1]))
+        with open(os.path.join(directory, 'images_and_tags.txt'), 'w') as tags_file:
+            tags_file.write('\n'.join(image_filenames))
+
+        # A blank ROM that passes the patch validation, with a different sprite for every monster
+        rom_data = bytearray(0x400000)
+        tablereader.set_global_table_filename('tables_list.txt')
+        tablereader.set_table_specs(table_objects)
+        for patch_filename in tablereader.PATCH_FILENAMES:
+            _, validation = tablereader.patch_filename_to_bytecode(os.path.join(tablereader.tblpath, patch_filename))
+            for (address, _), code in validation.items():
+                rom_data[address:address + len(code)] = code
+        tablereader.reset_table_objects(table_objects)
+        for index in range(remonsterate.MonsterSpriteObject.specs.count):
+            address = remonsterate.MonsterSpriteObject.specs.pointer + (index * 5)
+            rom_data[address:address + 5] = (index * 4).to_bytes(2, 'little') + bytes([0, 0, index & 0x7F])
+        rom_data = bytes(rom_data)
+
+        old_file_paths, old_sprite_paths = remonsterate.file_paths, remonsterate.sprite_paths
+        remonsterate.file_paths = directory
+        remonsterate.sprite_paths = os.path.join(directory, 'sprites')
+        try:
+            def run(journal, seed):
+                return remonsterate.remonsterate_in_process(
+                    lambda output='', connection=None: None, outfile_rom_buffer=journal, seed=seed,
+                    rom_type='1.0', list_of_monsters=[], sprite_cache_filename=None, monsters_tags_filename=None)
+
+            clean_rom = BytesIO(rom_data)
+            run(RomJournal(clean_rom), 1)
+
+            rom = BytesIO(rom_data)
+            journal = FailingJournal(rom, 500)
+            try:
+                run(journal, 0)
+                print('The failing attempt did not fail.')
+                return False
+            except OverflowError:
+                journal.rollback()
+            if rom.getvalue() != rom_data:
+                print('Rolling back the failed attempt did not restore the ROM.')
+                return False
+            run(RomJournal(rom), 1)
+            if rom.getvalue() != clean_rom.getvalue():
+                print('The retry after a rollback differs from a clean run.')
+                return False
+        finally:
+            remonsterate.file_paths, remonsterate.sprite_paths = old_file_paths, old_sprite_paths
+    return True
+
+
+def test_tracklist_intensity_chains(songs_per_track: int = 60):
+    # A boss progression that can't be kept in order must be given up on by itself, without searching through
+    #   every choice of battle songs first. The battle progression must still be kept in order.
+    from random import Random
+    from music import musicrandomizer
+    from music.musicrandomizer import solve_tracklist
+
+    musicrandomizer.initialize(Random(0))
+    battle_order = ['battle', 'bat2', 'bat3', 'bat4']
+    boss_order = ['mboss', 'boss', 'atma', 'dmad5']
+    pools = {}
+    intensities = {'battle': {}, 'boss': {}}
+    for category, order in [('battle', battle_order), ('boss', boss_order)]:
+        for tier, track in enumerate(order):
+            pools[track] = [f'{track}_song{index}' for index in range(songs_per_track)]
+            for index, song in enumerate(pools[track]):
+                # The boss tiers get lower as they go, so no choice keeps them in order
+                intensities[category][song] = tier * 10 + index if category == 'battle' else (3 - tier) * 1000 + index
+    tracks = [battle_order[i] for i in (0, 3, 1, 2)] + [boss_order[i] for i in (0, 3, 1, 2)]
+    chains = [(battle_order, intensities['battle']), (boss_order, intensities['boss'])]
+
+    start = perf_counter()
+    assignment = solve_tracklist(tracks, pools, chains)
+    elapsed = perf_counter() - start
+    print(f'{songs_per_track} songs per track: {elapsed:.3f}s')
+    if sorted(assignment) != sorted(tracks):
+        print('Not every track got a song.')
+        return False
+    battle_levels = [intensities['battle'][assignment[track]] for track in battle_order]
+    if battle_levels != sorted(battle_levels):
+        print(f'The battle progression is out of order: {battle_levels}')
+        return False
+    return elapsed < 1
+
+
+
+def test_tracklist_competing_chains(songs_per_track: int = 20):
+    # The battle and boss progressions can each be kept in order, but not both: bat3's only song is also the
+    #   only atma song that keeps the boss progression in order. The boss progression must be given up on by
+    #   itself, quickly, and the battle progression must still be kept in order.
+    from random import Random
+    from music import musicrandomizer
+    from music.musicrandomizer import solve_tracklist
+
+    musicrandomizer.initialize(Random(0))
+    battle_order = ['battle', 'bat2', 'bat3', 'bat4']
+    boss_order = ['mboss', 'boss', 'atma', 'dmad5']
+    pools = {}
+    intensities = {'battle': {'shared_song': 2500}, 'boss': {'shared_song': 2500}}
+    for category, order in [('battle', battle_order), ('boss', boss_order)]:
+        for tier, track in enumerate(order):
+            pools[track] = [f'{track}_song{index}' for index in range(songs_per_track)]
+            for index, song in enumerate(pools[track]):
+                # The atma songs are all too quiet to follow the boss songs
+                level = 0 if track == 'atma' else tier * 1000
+                intensities[category][song] = level + index
+    pools['bat3'] = ['shared_song']
+    pools['atma'].append('shared_song')
+    tracks = [battle_order[i] for i in (0, 3, 1, 2)] + [boss_order[i] for i in (0, 3, 1, 2)]
+    chains = [(battle_order, intensities['battle']), (boss_order, intensities['boss'])]
+
+    start = perf_counter()
+    assignment = solve_tracklist(tracks, pools, chains)
+    elapsed = perf_counter() - start
+    print(f'{songs_per_track} songs per track: {elapsed:.3f}s')
+    if sorted(assignment) != sorted(tracks) or len(set(assignment.values())) != len(tracks):
+        print('Not every track got a song of its own.')
+        return False
+    battle_levels = [intensities['battle'][assignment[track]] for track in battle_order]
+    if battle_levels != sorted(battle_levels):
+        print(f'The battle progression is out of order: {battle_levels}')
+        return False
+    return elapsed < 1
+
+def get_peak_rss() -> int:
+    # Peak resident set size of this process, in bytes
+    try:
+        import resource
+    except ImportError:
+        # Windows
+        import psutil
+        return psutil.Process().memory_info().peak_wset
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss if sys.platform == 'darwin' else peak_rss * 1024
+
+
+def benchmark_randomize(connection, **kwargs):
+    # Runs randomize() and then reports the peak memory use of the process it ran in
+    from randomizer import randomize
+    randomize(connection, **kwargs)
+    connection.send({'peak_rss': get_peak_rss()})
+
+
+def benchmark_generation(seed: str):
+    # Generates one seed without writing it to disk. Returns the seconds it took and the peak RSS in bytes.
+    from multiprocessing import Pipe, Process
+    kwargs = {
+        'infile_rom_path': SOURCE_FILE,
+        'outfile_rom_path': OUTPUT_PATH,
+        'seed': seed,
+        'application': 'tester',
+        'generate_output_rom': False
+    }
+    parent_connection, child_connection = Pipe()
+    start_time = perf_counter()
+    randomize_process = Process(
+        target=benchmark_randomize,
+        args=(child_connection,),
+        kwargs=kwargs
+    )
+    randomize_process.start()
+    elapsed_time = None
+    while True:
+        if parent_connection.poll(timeout=5):
+            child_output = parent_connection.recv()
+        elif not randomize_process.is_alive():
+            raise RuntimeError('Unexpected error: The randomize child process died.')
+        else:
+            continue
+        if isinstance(child_output, Exception):
+            randomize_process.join()
+            raise child_output
+        elif isinstance(child_output, bool):
+            elapsed_time = perf_counter() - start_time
+        elif isinstance(child_output, dict):
+            randomize_process.join()
+            return elapsed_time, child_output['peak_rss']
+
+
+def get_percentile(values: list, percentile: float):
+    # Nearest-rank percentile of a list of numbers
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * percentile // 100))
+    return ordered[int(rank) - 1]
+
+
+# Generate the same seeds for every supported preset in every mode and compare the timings to a stored baseline,
+#   one (preset, mode) pair at a time. A pair whose seeds per second dropped by more than regression_threshold percent,
+#   or that failed any of its seeds, is reported as a regression. A baseline is only compared against when it was made
+#   with the same seeds.
+def benchmark_presets(seeds_per_mode: int = 3, regression_threshold: float = 10.0,
+                      baseline_path: str = BENCHMARK_BASELINE_PATH, update_baseline: bool = False):
+    from config import SUPPORTED_PRESETS
+    from options import ALL_MODES
+
+    baseline = None
+    if os.path.isfile(baseline_path) and not update_baseline:
+        with open(baseline_path) as baseline_file:
+            baseline = json.load(baseline_file)
+        if (baseline.get('seeds_per_mode'), baseline.get('first_seed')) != (seeds_per_mode, BENCHMARK_FIRST_SEED):
+            raise ValueError(f'The baseline in {baseline_path} was made with {baseline.get("seeds_per_mode")} seeds '
+                             f'per mode from seed {baseline.get("first_seed")}, not {seeds_per_mode} from seed '
+                             f'{BENCHMARK_FIRST_SEED}. Make a new baseline with update_baseline=True.')
+
+    results = {}
+    for preset_name, preset_flags in SUPPORTED_PRESETS.items():
+        flag_string = remove_skipped_flags(apply_included_flags(preset_flags))
+        results[preset_name] = {}
+        for mode in ALL_MODES:
+            latencies = []
+            peak_rss = 0
+            failures = 0
+            for seed_number in range(BENCHMARK_FIRST_SEED, BENCHMARK_FIRST_SEED + seeds_per_mode):
+                seed = '|'.join([VERSION, mode.name, flag_string, str(seed_number)])
+                try:
+                    elapsed_time, seed_peak_rss = benchmark_generation(seed)
+                except Exception as e:
+                    print(f'{preset_name} failed on seed {seed}: {e}')
+                    failures += 1
+                    continue
+                latencies.append(elapsed_time)
+                peak_rss = max(peak_rss, seed_peak_rss)
+
+            # The timings of a pair that failed a seed leave that seed out, so they are not reported at all
+            timed = latencies and not failures
+            results[preset_name][mode.name] = {
+                'seeds': len(latencies),
+                'failures': failures,
+                'seeds_per_second': round(len(latencies) / sum(latencies), 4) if timed else None,
+                'p50': round(get_percentile(latencies, 50), 3) if timed else None,
+                'p95': round(get_percentile(latencies, 95), 3) if timed else None,
+                'peak_rss_mb': round(peak_rss / 2 ** 20, 1)
+            }
+
+    print(f'{"Preset":<22}{"Mode":<18}{"Seeds/s":>10}{"p50 (s)":>10}{"p95 (s)":>10}{"Peak RSS (MB)":>16}  Change')
+    regressions = []
+    for preset_name, mode_results in results.items():
+        for mode_name, result in mode_results.items():
+            change = ''
+            baseline_result = baseline.get('presets', {}).get(preset_name, {}).get(mode_name) if baseline else None
+            if result['failures']:
+                change = f'{result["failures"]} failed  REGRESSION'
+                regressions.append(f'{preset_name} ({mode_name})')
+            elif baseline_result and baseline_result['seeds_per_second']:
+                slowdown = (baseline_result['seeds_per_second'] / result['seeds_per_second'] - 1) * 100
+                change = f'{slowdown:+.1f}% time'
+                if slowdown > regression_threshold:
+                    change += '  REGRESSION'
+                    regressions.append(f'{preset_name} ({mode_name})')
+            print(f'{preset_name:<22}{mode_name:<18}{str(result["seeds_per_second"]):>10}{str(result["p50"]):>10}'
+                  f'{str(result["p95"]):>10}{result["peak_rss_mb"]:>16}  {change}')
+
+    if update_baseline or not os.path.isfile(baseline_path):
+        if any(result['failures'] for mode_results in results.values() for result in mode_results.values()):
+            print(f'Seeds failed, so no baseline was written to {baseline_path}.')
+        else:
+            with open(baseline_path, 'w') as baseline_file:
+                json.dump({
+                    'version': VERSION,
+                    'seeds_per_mode': seeds_per_mode,
+                    'first_seed': BENCHMARK_FIRST_SEED,
+                    'presets': results
+                }, baseline_file, indent=2)
+            print(f'Baseline written to {baseline_path}.')
+
+    if regressions:
+        print(f'Regressions of more than {regression_threshold}% or failed seeds: {", ".join(regressions)}')
+    return results, regressions
+
 if __name__ == '__main__':
     test_rng_distribution()
     # test_generation(iterations=2, generate_output_rom=False)
+    # test_same_seed_in_process()
     # test_random_generation(
     #     iterations=10,
     #     num_flags=10,
@@ -380,3 +1036,9 @@ if __name__ == '__main__':
     #     halt_on_exception=True
     # )
     # thorough_test()
+    # benchmark_presets(seeds_per_mode=3, regression_threshold=10.0)
+    # test_lzss_round_trip()
+    # benchmark_lzss()
+    # test_remonsterate_rollback()
+    # test_tracklist_intensity_chains()
+    # test_tracklist_competing_chains()
@@ -4,6 +4,7 @@ from itertools import zip_longest
 
 from chestrandomizer import ChestBlock
 from formationrandomizer import get_fsets, get_formations
+from randomizercontext import get_context
 from locationrandomizer import (get_locations, get_location, Location,
                                 get_unused_locations, Entrance,
                                 add_location_map, update_locations)
@@ -37,15 +38,12 @@ PROTECTED += list(range(359, 371))  # Fanatics Tower
 PROTECTED += list(range(382, 387))  # Sealed Gate
 FIXED_ENTRANCES, REMOVE_ENTRANCES = [], []
 
-locexchange = {}
 old_entrances = {}
 try:
     towerlocids = [int(line.strip(), 0x10) for line in open(TOWER_LOCATIONS_TABLE)]
 except FileNotFoundError:
     print("Error: " + TOWER_LOCATIONS_TABLE + " was not found in the tables folder.")
 map_bans = []
-newfsets = {}
-clusters = None
 
 
 def get_new_formations(areaname, supplement=True):
@@ -77,6 +75,7 @@ def get_new_formations(areaname, supplement=True):
 
 
 def get_new_fsets(areaname, number=10, supplement=True):
+    newfsets = get_context().tower_formation_sets
     if areaname in newfsets:
         return newfsets[areaname]
     newfsets[areaname] = []
@@ -97,6 +96,7 @@ def get_new_fsets(areaname, number=10, supplement=True):
 
 
 def remap_maps(routes):
+    locexchange = get_context().tower_location_exchange
     conlinks = []
     cononeways = []
     conentrances = []
@@ -460,9 +460,9 @@ class RestStop(Cluster):
 
 
 def get_clusters():
-    global clusters
-    if clusters is not None:
-        return clusters
+    context = get_context()
+    if context.tower_clusters is not None:
+        return context.tower_clusters
 
     clusters = []
     for i, line in enumerate(open(ENTRANCE_REACHABILITY_TABLE)):
@@ -477,6 +477,7 @@ def get_clusters():
         c.original_entrances = list(c.entrances)
         clusters.append(c)
 
+    context.tower_clusters = clusters
     return get_clusters()
 
 
@@ -998,7 +999,7 @@ class Route:
         ent_to_party = {0: 1, 8: 2, 11: 3}
         party_id = ent_to_party[entid]
         for c in self.reststops:
-            loc = get_location(locexchange[c.locid, c.locid])
+            loc = get_location(get_context().tower_location_exchange[c.locid, c.locid])
             loc.party_id = party_id
 
     def __repr__(self):
@@ -2,6 +2,8 @@ import random
 import traceback
 import hashlib
 import time
+import tracemalloc
+from contextlib import contextmanager
 from functools import wraps
 from io import BytesIO
 from multiprocessing import Pipe
@@ -10,6 +12,8 @@ from os import path, makedirs
 from pathlib import Path
 from zipfile import ZipFile
 
+from randomizercontext import get_context
+
 try:
     from sys import _MEIPASS
 
@@ -122,8 +126,6 @@ def open_mei_fallback(filename, mode='r', encoding=None):
 class Substitution:
     location = None
     bytestring = None
-    every_single_write = {}
-    noverify_writes = set()
 
     @property
     def size(self) -> int:
@@ -133,91 +135,44 @@ class Substitution:
         self.location = location
 
     def write(self, outfile_rom_buffer: BytesIO, noverify: bool = False, patch_name: str = "Unknown"):
+        bytestring = bytes(self.bytestring)
         outfile_rom_buffer.seek(self.location)
-        outfile_rom_buffer.write(bytes(self.bytestring))
-        verification = (self.location, bytes(self.bytestring))
-        try:
-            self.every_single_write[patch_name].append(verification)
-        except KeyError:
-            self.every_single_write[patch_name] = [verification]
-        if noverify:
-            self.noverify_writes.add(verification)
+        outfile_rom_buffer.write(bytestring)
+        get_context().write_journal.record(self.location, bytestring, patch_name, noverify)
 
     @classmethod
     def verify_all_writes(self, outfile_rom_buffer: BytesIO):
+        # Get the data from the output rom file. If the data in the file doesn't match the data the patch
+        #   contains, either the data did not write properly, or it was overwritten by another patch.
+        #   The journal attributes each mismatch to the patch that wrote the mismatching byte last.
         failed_patches = []
-        for patch_name, verifications in self.every_single_write.items():
-            for index, (address, data) in enumerate(verifications):
-                # Get the data from the output rom file. If the data in the file doesn't match the data the patch
-                #   contains, either the data did not write properly, or it was overwritten by another patch
-                outfile_rom_buffer.seek(address)
-                verify = outfile_rom_buffer.read(len(data))
-                if verify != data:
-                    conflicting_patch = None
-                    # Check if any other of the applied patches (or the same patch) have written the same data
-                    for conflicting_patch_name, conflicting_verifications in self.every_single_write.items():
-                        for index2, (conflicting_address, conflicting_data) in enumerate(conflicting_verifications):
-                            if (patch_name == conflicting_patch_name and
-                                    (address, data) == (conflicting_address, conflicting_data)):
-                                # Don't compare a change within a patch to itself, because they would
-                                #   obviously overwrite the same values/conflict
-                                # Note that it IS possible for a patch to conflict with itself, if two
-                                #   -different- changes overwrite the same code.
-                                continue
-                            if (conflicting_address + len(conflicting_data) < address or
-                                    (address + len(data)) < conflicting_address):
-                                # The upper bound of conflicting_address range is less than the lower bound
-                                #   of address range OR the upper bound of the address range is less than
-                                #   the lower bound of the conflicting_address range.
-                                # These changes do not overlap and cannot conflict.
-                                continue
-                            else:
-                                for addr in range(conflicting_address, conflicting_address + len(conflicting_data)):
-                                    if address <= addr <= address + len(data):
-                                        # For each addr in a conflicting verification, if the addr
-                                        #   lands within the other address range, we've identified
-                                        #   two patches that conflict. No need to continue checking.
-                                        conflicting_patch = (conflicting_patch_name, index2, (conflicting_address,
-                                                                                              conflicting_data))
-                                        break
-                            if conflicting_patch:
-                                # Conflict identified. No need to check additional verifications in this patch.
-                                break
-                        if conflicting_patch:
-                            # Conflict identified. No need to check additional patches.
-                            break
-                    for offset, (c1, c2) in enumerate(zip(verify, data)):
-                        if c1 != c2:
-                            break
-                    offset += address
-                    if (address, data) in self.noverify_writes:
-                        #continue
-                        if conflicting_patch:
-                            print(f'WARNING: Patch {str(index + 1)} in {patch_name} conflicts with patch '
-                                  f'{str(conflicting_patch[1] + 1)} in {conflicting_patch[0]} '
-                                  f'at address {address:0>6x} at offset {offset:0>6x}, but is '
-                                  f'being ignored.')
-                        else:
-                            # No conflicting patch was found by the above detection code. The conflict
-                            #   might be caused by something being written directly to the
-                            #   output_rom_buffer via output_rom_buffer.write(). Only writes using the
-                            #   Substitution class can be detected.
-                            print(f'WARNING: Patch {str(index + 1)} in {patch_name} failed verification at address '
-                                  f'{address:0>6x} and offset {offset:0>6x}, but is being ignored. '
-                                  f'No conflicting patches were detected.')
-                    else:
-                        if conflicting_patch:
-                            failed_patches.append(f'Patch {str(index + 1)} in {patch_name} conflicts with patch '
-                                                  f'{str(conflicting_patch[1] + 1)} in {conflicting_patch[0]} '
-                                                  f'at address {address:0>6x} at offset {offset:0>6x}')
-                        else:
-                            # No conflicting patch was found by the above detection code. The conflict
-                            #   might be caused by something being written directly to the
-                            #   output_rom_buffer via output_rom_buffer.write(). Only writes using the
-                            #   Substitution class can be detected.
-                            failed_patches.append(f'Patch {str(index + 1)} in {patch_name} failed verification at ' +
-                                                  f'address {address:0>6x} and offset {offset:0>6x}. '
-                                                  f'No conflicting patch was identified.')
+        for entry, offset, conflicting_entry in get_context().write_journal.find_failed_writes(outfile_rom_buffer):
+            patch_name, index, address = entry.patch_name, entry.index, entry.address
+            if entry.noverify:
+                if conflicting_entry:
+                    print(f'WARNING: Patch {str(index + 1)} in {patch_name} conflicts with patch '
+                          f'{str(conflicting_entry.index + 1)} in {conflicting_entry.patch_name} '
+                          f'at address {address:0>6x} at offset {offset:0>6x}, but is '
+                          f'being ignored.')
+                else:
+                    # No conflicting patch was found in the journal. The conflict might be caused by
+                    #   something being written directly to the output_rom_buffer via
+                    #   output_rom_buffer.write(). Only writes using the Substitution class can be detected.
+                    print(f'WARNING: Patch {str(index + 1)} in {patch_name} failed verification at address '
+                          f'{address:0>6x} and offset {offset:0>6x}, but is being ignored. '
+                          f'No conflicting patches were detected.')
+            else:
+                if conflicting_entry:
+                    failed_patches.append(f'Patch {str(index + 1)} in {patch_name} conflicts with patch '
+                                          f'{str(conflicting_entry.index + 1)} in {conflicting_entry.patch_name} '
+                                          f'at address {address:0>6x} at offset {offset:0>6x}')
+                else:
+                    # No conflicting patch was found in the journal. The conflict might be caused by
+                    #   something being written directly to the output_rom_buffer via
+                    #   output_rom_buffer.write(). Only writes using the Substitution class can be detected.
+                    failed_patches.append(f'Patch {str(index + 1)} in {patch_name} failed verification at ' +
+                                          f'address {address:0>6x} and offset {offset:0>6x}. '
+                                          f'No conflicting patch was identified.')
         if failed_patches:
             failed_patches = '\n- '.join(failed_patches)
             raise Exception('The following patches failed '
@@ -1122,6 +1077,110 @@ def timer(func):
     return wrapper
 
 
+class StageTimer:
+    """
+    Records the wall time, CPU time and peak traced memory of the named stages of one run.
+    Stages may be nested. They are reported in the order they started.
+    """
+    def __init__(self, trace_memory: bool = True):
+        self.trace_memory = trace_memory
+        self.stages = []
+        self.open_stages = []
+        self.started_tracing = False
+        self.start_wall_time = None
+        self.start_cpu_time = None
+        self.total = None
+
+    def start(self):
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+        self.start_wall_time = time.perf_counter()
+        self.start_cpu_time = time.process_time()
+
+    def stop(self):
+        peak_memory = None
+        if tracemalloc.is_tracing():
+            # Every stage resets the traced peak, so the run's peak is the highest one seen by any of them
+            peak_memory = max([tracemalloc.get_traced_memory()[1]] +
+                              [stage['peak_memory'] for stage in self.stages if stage['peak_memory']])
+        self.total = {
+            'wall_time': round(time.perf_counter() - self.start_wall_time, 4),
+            'cpu_time': round(time.process_time() - self.start_cpu_time, 4),
+            'peak_memory': peak_memory
+        }
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+    @contextmanager
+    def stage(self, name: str):
+        tracing = tracemalloc.is_tracing()
+        if tracing and self.open_stages:
+            # Keep the enclosing stage's peak before resetting the peak for this one
+            parent = self.open_stages[-1]
+            parent['peak_memory'] = max(parent['peak_memory'], tracemalloc.get_traced_memory()[1])
+        if tracing:
+            tracemalloc.reset_peak()
+
+        record = {
+            'name': name,
+            'depth': len(self.open_stages),
+            'wall_time': None,
+            'cpu_time': None,
+            'peak_memory': 0,
+        }
+        self.stages.append(record)
+        self.open_stages.append(record)
+        start_wall_time = time.perf_counter()
+        start_cpu_time = time.process_time()
+        try:
+            yield record
+        finally:
+            record['wall_time'] = round(time.perf_counter() - start_wall_time, 4)
+            record['cpu_time'] = round(time.process_time() - start_cpu_time, 4)
+            self.open_stages.pop()
+            if tracing:
+                record['peak_memory'] = max(record['peak_memory'], tracemalloc.get_traced_memory()[1])
+                if self.open_stages:
+                    self.open_stages[-1]['peak_memory'] = max(self.open_stages[-1]['peak_memory'],
+                                                              record['peak_memory'])
+            else:
+                record['peak_memory'] = None
+
+    def get_report(self, **details) -> dict:
+        return {
+            **details,
+            'total': self.total,
+            'stages': self.stages
+        }
+
+
+@contextmanager
+def measure_stage(name: str):
+    """
+    Measures the code in the with block as the stage name of the current run. Does nothing unless
+    the run was started with stage reporting on.
+    """
+    stage_timer = get_context().stage_timer
+    if stage_timer is None:
+        yield None
+    else:
+        with stage_timer.stage(name) as record:
+            yield record
+
+
+def timed_stage(func):
+    """
+    Like timer, but measures every call of func as a stage of the current run. See measure_stage().
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with measure_stage(func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
+
+
 if __name__ == "__main__":
     M = [[1, 0, 0, 1],
          [0, 1, 0, 0],
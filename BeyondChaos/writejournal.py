@@ -0,0 +1,137 @@
+from bisect import bisect_right
+from io import BytesIO
+from typing import List, NamedTuple, Tuple
+
+
+class JournalEntry(NamedTuple):
+    patch_name: str
+    # The position of this write among all writes made by patch_name
+    index: int
+    address: int
+    data: bytes
+    noverify: bool
+
+    @property
+    def end(self) -> int:
+        return self.address + len(self.data)
+
+
+class WriteJournal:
+    """
+    Records every Substitution write of a run together with the patch that made it.
+
+    The final owner of each byte is found by walking the writes backwards and keeping a sorted list
+    of the ranges already claimed by later writes, so building the owner map costs O(W log W) for
+    W writes. Verification and conflict attribution then only need a binary search per failed write.
+    """
+    def __init__(self):
+        self.entries: List[JournalEntry] = []
+        # Patch names in the order of their first write, with their number of writes
+        self.patch_write_counts = {}
+        self.owner_starts = None
+        self.owner_segments = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def record(self, address: int, data: bytes, patch_name: str = "Unknown", noverify: bool = False):
+        index = self.patch_write_counts.get(patch_name, 0)
+        self.patch_write_counts[patch_name] = index + 1
+        self.entries.append(JournalEntry(patch_name, index, address, bytes(data), noverify))
+        self.owner_starts = None
+        self.owner_segments = None
+
+    def build_owner_map(self):
+        """
+        Splits the written bytes into disjoint segments, each owned by the last write that covered it.
+        """
+        covered_starts = []
+        covered_ends = []
+        segments = []
+        for entry in reversed(self.entries):
+            start, end = entry.address, entry.end
+            if start >= end:
+                continue
+            # The first already covered range that ends after this write starts
+            first = bisect_right(covered_ends, start)
+            last = first
+            position = start
+            while last < len(covered_starts) and covered_starts[last] < end:
+                if position < covered_starts[last]:
+                    segments.append((position, covered_starts[last], entry))
+                position = max(position, covered_ends[last])
+                last += 1
+            if position < end:
+                segments.append((position, end, entry))
+
+            # Merge this write with the covered ranges it touched
+            if last > first:
+                start = min(start, covered_starts[first])
+                end = max(end, covered_ends[last - 1])
+            covered_starts[first:last] = [start]
+            covered_ends[first:last] = [end]
+
+        segments.sort(key=lambda segment: segment[0])
+        self.owner_segments = segments
+        self.owner_starts = [segment[0] for segment in segments]
+
+    def get_owner(self, address: int) -> JournalEntry | None:
+        """
+        Returns the last write that covered address, or None if no write did.
+        """
+        if self.owner_segments is None:
+            self.build_owner_map()
+        position = bisect_right(self.owner_starts, address) - 1
+        if position >= 0:
+            start, end, entry = self.owner_segments[position]
+            if address < end:
+                return entry
+        return None
+
+    def find_failed_writes(self, outfile_rom_buffer: BytesIO) -> List[Tuple[JournalEntry, int, JournalEntry | None]]:
+        """
+        Compares every recorded write with the data in outfile_rom_buffer. Returns a tuple for each write
+        that does not match: the write, the address of its first mismatching byte and the write of another
+        patch that overwrote that byte, if there is one. The writes are ordered by patch, then by index.
+        """
+        patch_order = {patch_name: order for order, patch_name in enumerate(self.patch_write_counts)}
+        failed_writes = []
+        with outfile_rom_buffer.getbuffer() as rom_data:
+            for entry in sorted(self.entries, key=lambda e: (patch_order[e.patch_name], e.index)):
+                verify = bytes(rom_data[entry.address:entry.end])
+                if verify == entry.data:
+                    continue
+                offset = 0
+                for offset, (c1, c2) in enumerate(zip(verify, entry.data)):
+                    if c1 != c2:
+                        break
+                offset += entry.address
+
+                conflicting_entry = self.get_owner(offset)
+                if conflicting_entry is not None and conflicting_entry.patch_name == entry.patch_name and \
+                        (conflicting_entry.address, conflicting_entry.data) == (entry.address, entry.data):
+                    # The byte was last written by this change itself, or by an identical copy of it.
+                    #   Whatever overwrote it did not go through Substitution.
+                    conflicting_entry = None
+                failed_writes.append((entry, offset, conflicting_entry))
+        return failed_writes
+
+    def get_write_map(self) -> List[Tuple[int, int, str]]:
+        """
+        Returns (start, end, patch name) for the final owner of every written byte range, with
+        neighboring ranges of the same patch merged.
+        """
+        if self.owner_segments is None:
+            self.build_owner_map()
+        write_map = []
+        for start, end, entry in self.owner_segments:
+            if write_map and write_map[-1][1] == start and write_map[-1][2] == entry.patch_name:
+                write_map[-1] = (write_map[-1][0], end, entry.patch_name)
+            else:
+                write_map.append((start, end, entry.patch_name))
+        return write_map
+
+    def export_write_map(self, filename: str):
+        with open(filename, 'w') as map_file:
+            for start, end, patch_name in self.get_write_map():
+                map_file.write(f'{start:0>6x}-{end - 1:0>6x} {patch_name}\n')